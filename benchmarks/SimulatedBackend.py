@@ -0,0 +1,115 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import time
+import base64
+
+# In-process stand-in for PKCS11NativeBackend that keeps its objects in
+# memory and sleeps for a configurable time on every card access. Like the
+# native backend, it stays logged in while a session is open and needs to
+# login for every operation otherwise.
+class SimulatedBackend():
+	name = "simulated"
+	_PUBKEY_DER = base64.b64decode("MFkwEwYHKoZIzj0CAQYIKoZIzj0DAQcDQgAE/yLgRZydlOFERkVbGTdEw1QG+y63YVJljDgxmRGMfkNlHIJ8s8iqT0HKN3vZpWtFW8d8rejeWbpIhPexdXLb4w==")
+
+	def __init__(self, latency = 0, login_latency = None, objects = 4):
+		self._latency = latency / 1000
+		self._login_latency = self._latency if (login_latency is None) else (login_latency / 1000)
+		self._in_session = False
+		self._logged_in = False
+		self._keys = { key_id: "key%02x" % (key_id) for key_id in range(1, objects + 1) }
+		self._certs = { }
+
+	def _card_access(self):
+		time.sleep(self._latency)
+
+	def _login(self):
+		if not self._logged_in:
+			time.sleep(self._login_latency)
+			self._logged_in = self._in_session
+
+	@property
+	def in_session(self):
+		return self._in_session
+
+	def open_session(self):
+		self._in_session = True
+
+	def close_session(self):
+		self._in_session = False
+		self._logged_in = False
+
+	def login(self, with_sopin = False):
+		self._login()
+		return True
+
+	def unblock_pin(self):
+		self._login()
+		self._card_access()
+
+	def keygen(self, key_spec, key_id, key_label = None):
+		self._login()
+		self._card_access()
+		self._keys[key_id] = key_label
+
+	def _find_key(self, key_id, key_label):
+		if key_id is None:
+			key_id = { label: key_id for (key_id, label) in self._keys.items() }.get(key_label)
+		if key_id not in self._keys:
+			raise Exception("No matching object found on token (ID %s, label %s)." % (key_id, key_label))
+		return key_id
+
+	def read_pubkey(self, key_id, key_label = None):
+		self._login()
+		self._card_access()
+		self._find_key(key_id, key_label)
+		return self._PUBKEY_DER
+
+	def list_pubkeys(self):
+		self._login()
+		self._card_access()
+		for (key_id, key_label) in sorted(self._keys.items()):
+			yield (key_id, key_label, self._PUBKEY_DER)
+
+	def sign(self, key_id, key_label, mechanism, hashfnc, inputs):
+		self._login()
+		self._find_key(key_id, key_label)
+		for data in inputs:
+			self._card_access()
+			yield bytes(64)
+
+	def removekey(self, key_id, key_label = None):
+		self._login()
+		self._card_access()
+		del self._keys[self._find_key(key_id, key_label)]
+
+	def putcrt(self, crt_derdata, cert_id, cert_label = None):
+		self._login()
+		self._card_access()
+		self._certs[cert_id] = crt_derdata
+
+	def change_pin(self, new_value):
+		self._login()
+		self._card_access()
+
+	def change_sopin(self, new_value):
+		self._login()
+		self._card_access()
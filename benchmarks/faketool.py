@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+# Stand-in for pkcs11-tool, sc-hsm-tool, opensc-tool and openssl that is
+# invoked through symlinks named after the respective tool. It sleeps for
+# HSMWIZ_BENCH_LATENCY milliseconds to simulate card latency, appends the tool
+# name to HSMWIZ_BENCH_SPAWN_LOG (if set) and produces just enough output for
+# hsmwiz to carry on.
+
+import os
+import sys
+import time
+import shlex
+import base64
+
+_PUBKEY_DER = base64.b64decode("MFkwEwYHKoZIzj0CAQYIKoZIzj0DAQcDQgAE/yLgRZydlOFERkVbGTdEw1QG+y63YVJljDgxmRGMfkNlHIJ8s8iqT0HKN3vZpWtFW8d8rejeWbpIhPexdXLb4w==")
+_PEM_CSR = "-----BEGIN CERTIFICATE REQUEST-----\nMIHTMHsCAQAwGTEXMBUGA1UEAwwOU2ltdWxhdGVkIFRva2VuMFkwEwYHKoZIzj0C\n-----END CERTIFICATE REQUEST-----\n"
+
+def option_value(args, option):
+	if option in args:
+		index = args.index(option)
+		if index + 1 < len(args):
+			return args[index + 1]
+	return None
+
+def write_file(filename, data):
+	with open(filename, "wb") as f:
+		f.write(data)
+
+def pkcs11_tool(args):
+	if "--list-token-slots" in args:
+		print("Available slots:")
+		print("Slot 0 (0x0): Simulated Reader 00 00")
+		print("  token label        : SmartCard-HSM (UserPIN)")
+		print("  serial num         : DECC0000001")
+	elif "--list-objects" in args:
+		for key_id in range(1, int(os.environ.get("HSMWIZ_BENCH_OBJECTS", "4")) + 1):
+			if option_value(args, "--type") is None:
+				print("Private Key Object; EC")
+				print("  label:      key%02x" % (key_id))
+				print("  ID:         %02x" % (key_id))
+				print("  Usage:      sign, derive")
+			print("Public Key Object; EC  EC_POINT 256 bits")
+			print("  label:      key%02x" % (key_id))
+			print("  ID:         %02x" % (key_id))
+			print("  Usage:      verify")
+	elif "--read-object" in args:
+		write_file(option_value(args, "--output-file"), _PUBKEY_DER)
+	elif "--sign" in args:
+		write_file(option_value(args, "--output-file"), os.urandom(64))
+	elif "--keypairgen" in args:
+		print("Key pair generated:")
+
+def sc_hsm_tool(args):
+	print("Using reader with a card: Simulated Reader %s" % (option_value(args, "--reader") or "0"))
+	print("Version              : 3.4")
+	print("User PIN tries left  : 3")
+
+def pkcs15_tool(args):
+	print("Using reader with a card: Simulated Reader 0")
+	for key_id in range(1, int(os.environ.get("HSMWIZ_BENCH_OBJECTS", "4")) + 1):
+		print()
+		print("Private EC Key [key%02x]" % (key_id))
+		print("\tUsage          : [0x104], sign, derive")
+		print("\tFieldLength    : 256")
+		print("\tID             : %02x" % (key_id))
+
+def opensc_tool(args):
+	# A card is inserted unless HSMWIZ_BENCH_CARD_FILE names a missing file
+	card_file = os.environ.get("HSMWIZ_BENCH_CARD_FILE")
+	card_present = (card_file is None) or os.path.exists(card_file)
+	print("# Detected readers (pcsc)")
+	print("Nr.  Card  Features  Name")
+	print("0    %-3s             Simulated Reader 00 00" % ("Yes" if card_present else "No"))
+
+def openssl(args):
+	if len(args) > 0:
+		# openssl req -text, used to pretty-print CSRs
+		sys.stdout.write(sys.stdin.read())
+		return
+	# Interactive shell, which handles commands as they arrive on stdin
+	latency = float(os.environ.get("HSMWIZ_BENCH_LATENCY", "0")) / 1000
+	for line in sys.stdin:
+		cmd = shlex.split(line)
+		if len(cmd) == 0:
+			continue
+		if cmd[0] == "req":
+			time.sleep(latency)
+			write_file(option_value(cmd, "-out"), _PEM_CSR.encode())
+		elif cmd[0] != "engine":
+			print("Invalid command '%s'; type \"help\" for a list." % (cmd[0]), file = sys.stderr)
+			print("error in %s" % (cmd[0]), file = sys.stderr, flush = True)
+		print("OpenSSL> ", end = "", flush = True)
+
+def main():
+	tool = os.path.basename(sys.argv[0])
+	handler = {
+		"pkcs11-tool":		pkcs11_tool,
+		"sc-hsm-tool":		sc_hsm_tool,
+		"opensc-tool":		opensc_tool,
+		"pkcs15-tool":		pkcs15_tool,
+		"openssl":			openssl,
+	}[tool]
+	spawn_log = os.environ.get("HSMWIZ_BENCH_SPAWN_LOG")
+	if spawn_log:
+		with open(spawn_log, "a") as f:
+			print(tool, file = f)
+	time.sleep(float(os.environ.get("HSMWIZ_BENCH_LATENCY", "0")) / 1000)
+	handler(sys.argv[1:])
+
+if __name__ == "__main__":
+	main()
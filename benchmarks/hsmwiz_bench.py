@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import contextlib
+import collections
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hsmwiz.FriendlyArgumentParser import FriendlyArgumentParser
+from hsmwiz.HardwareSecurityModule import HardwareSecurityModule
+from SimulatedBackend import SimulatedBackend
+
+class SimulatedHardwareSecurityModule(HardwareSecurityModule):
+	def __init__(self, backend_args, **kwargs):
+		HardwareSecurityModule.__init__(self, **kwargs)
+		self._backend_args = backend_args
+
+	def _create_backend(self):
+		return SimulatedBackend(**self._backend_args)
+
+# Runs hsmwiz operations against a simulated token, either through the
+# pkcs11-tool backend with stub tools on the PATH or through an in-process
+# simulated backend, and measures latency, process spawns and throughput.
+# "single" runs every operation on a fresh HardwareSecurityModule without a
+# session (like one command line invocation does), "batched" runs all
+# operations within one session.
+class Benchmark():
+	Result = collections.namedtuple("Result", [ "backend", "workflow", "operation", "count", "p50", "p90", "p99", "max", "spawns_per_op", "ops_per_sec" ])
+	_TOOLS = [ "pkcs11-tool", "pkcs15-tool", "sc-hsm-tool", "opensc-tool", "openssl" ]
+	_OPERATIONS = collections.OrderedDict([
+		("identify",	lambda hsm, i: hsm.identify(force = True)),
+		("login",		lambda hsm, i: hsm.login()),
+		("keygen",		lambda hsm, i: hsm.keygen("EC:prime256v1", 0x10 + i)),
+		("getpubkey",	lambda hsm, i: hsm.getpubkey(1, key_format = "ssh", silent = True)),
+		("gencsr",		lambda hsm, i: hsm.gencsr(1, silent = True)),
+		("putcrt",		lambda hsm, i: hsm.putcrt(b"\x30\x03\x02\x01\x00", 1)),
+		("sign",		lambda hsm, i: list(hsm.sign([ bytes(32) ], key_id = 1, mechanism = "ecdsa"))),
+	])
+
+	def __init__(self, args):
+		self._args = args
+		self._tmpdir = None
+		self._spawn_log = None
+
+	def __enter__(self):
+		# Stub tools and empty shared objects live in a temporary directory;
+		# the identification cache is disabled so that it cannot hide calls.
+		self._tmpdir = tempfile.mkdtemp(prefix = "hsmwiz_bench_")
+		bin_dir = os.path.join(self._tmpdir, "bin")
+		os.mkdir(bin_dir)
+		faketool = os.path.join(os.path.dirname(os.path.abspath(__file__)), "faketool.py")
+		for tool in self._TOOLS:
+			os.symlink(faketool, os.path.join(bin_dir, tool))
+		for soname in [ "opensc-pkcs11.so", "libpkcs11.so" ]:
+			open(os.path.join(self._tmpdir, soname), "wb").close()
+		self._spawn_log = os.path.join(self._tmpdir, "spawns.log")
+		open(self._spawn_log, "w").close()
+		os.environ["PATH"] = bin_dir + ":" + os.environ.get("PATH", "")
+		os.environ["HSMWIZ_BENCH_LATENCY"] = str(self._args.latency)
+		os.environ["HSMWIZ_BENCH_SPAWN_LOG"] = self._spawn_log
+		os.environ["HSMWIZ_CACHE_DIR"] = ""
+		return self
+
+	def __exit__(self, *args):
+		shutil.rmtree(self._tmpdir)
+
+	def _spawn_count(self):
+		with open(self._spawn_log) as f:
+			return sum(1 for line in f)
+
+	def _create_hsm(self, backend):
+		if backend == "tool":
+			return HardwareSecurityModule(so_path = self._tmpdir, backend = "tool", pin = "648219")
+		else:
+			return SimulatedHardwareSecurityModule({ "latency": self._args.latency, "login_latency": self._args.login_latency }, so_path = self._tmpdir, pin = "648219")
+
+	@staticmethod
+	@contextlib.contextmanager
+	def _quiet():
+		# Tools inherit stdout, so silence them on the file descriptor level
+		sys.stdout.flush()
+		saved_fd = os.dup(1)
+		with open(os.devnull, "w") as devnull:
+			os.dup2(devnull.fileno(), 1)
+		try:
+			yield
+		finally:
+			os.dup2(saved_fd, 1)
+			os.close(saved_fd)
+
+	@staticmethod
+	def _percentile(sorted_values, percentile):
+		index = min(round(percentile / 100 * (len(sorted_values) - 1)), len(sorted_values) - 1)
+		return sorted_values[index]
+
+	def _measure(self, backend, workflow, operation):
+		function = self._OPERATIONS[operation]
+		durations = [ ]
+		spawns_before = self._spawn_count()
+		t_start = time.perf_counter()
+		if workflow == "single":
+			for i in range(self._args.iterations):
+				t0 = time.perf_counter()
+				function(self._create_hsm(backend), i)
+				durations.append(time.perf_counter() - t0)
+		else:
+			with self._create_hsm(backend) as hsm:
+				for i in range(self._args.iterations):
+					t0 = time.perf_counter()
+					function(hsm, i)
+					durations.append(time.perf_counter() - t0)
+		total_time = time.perf_counter() - t_start
+		spawns = self._spawn_count() - spawns_before
+		durations.sort()
+		return self.Result(backend = backend, workflow = workflow, operation = operation, count = len(durations),
+				p50 = self._percentile(durations, 50) * 1000, p90 = self._percentile(durations, 90) * 1000, p99 = self._percentile(durations, 99) * 1000, max = durations[-1] * 1000,
+				spawns_per_op = spawns / len(durations), ops_per_sec = len(durations) / total_time)
+
+	def run(self):
+		for backend in self._args.backend:
+			for workflow in self._args.workflow:
+				for operation in self._args.operation:
+					with self._quiet():
+						result = self._measure(backend, workflow, operation)
+					yield result
+
+def main():
+	parser = FriendlyArgumentParser(description = "Benchmark hsmwiz operations against a simulated token.")
+	parser.add_argument("-n", "--iterations", metavar = "count", type = int, default = 20, help = "Number of times every operation is run. Defaults to %(default)d.")
+	parser.add_argument("-l", "--latency", metavar = "ms", type = float, default = 2, help = "Simulated time in milliseconds that every card access (and every stub tool invocation) takes. Defaults to %(default).1f ms.")
+	parser.add_argument("--login-latency", metavar = "ms", type = float, help = "Simulated time in milliseconds that a login takes in the simulated backend. Defaults to the value of --latency.")
+	parser.add_argument("-b", "--backend", choices = [ "tool", "simulated" ], action = "append", help = "Backend to benchmark. 'tool' calls stub binaries instead of pkcs11-tool and friends, 'simulated' replaces the native PKCS#11 backend in-process. Can be given multiple times, defaults to all of %(choices)s.")
+	parser.add_argument("-w", "--workflow", choices = [ "single", "batched" ], action = "append", help = "Workflow to benchmark. 'single' uses a fresh HardwareSecurityModule for every operation, 'batched' runs all operations within one session. Can be given multiple times, defaults to all of %(choices)s.")
+	parser.add_argument("-o", "--operation", choices = list(Benchmark._OPERATIONS), action = "append", help = "Operation to benchmark. Can be given multiple times, defaults to all of %(choices)s.")
+	parser.add_argument("--json", action = "store_true", help = "Print results as JSON, one object per line, instead of a table.")
+	args = parser.parse_args(sys.argv[1:])
+	args.backend = args.backend or [ "tool", "simulated" ]
+	args.workflow = args.workflow or [ "single", "batched" ]
+	args.operation = args.operation or list(Benchmark._OPERATIONS)
+
+	if not args.json:
+		print("%-10s %-8s %-10s %6s %9s %9s %9s %9s %8s %9s" % ("backend", "workflow", "operation", "count", "p50/ms", "p90/ms", "p99/ms", "max/ms", "spawns", "ops/s"))
+	with Benchmark(args) as benchmark:
+		for result in benchmark.run():
+			if args.json:
+				print(json.dumps(result._asdict()), flush = True)
+			else:
+				print("%-10s %-8s %-10s %6d %9.2f %9.2f %9.2f %9.2f %8.2f %9.1f" % result, flush = True)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import sys
+import time
+import statistics
+import subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hsmwiz.FriendlyArgumentParser import FriendlyArgumentParser
+
+# Measures how long it takes until hsmwiz has dispatched a command, i.e., the
+# cost of interpreter startup plus all imports. Exits with a non-zero status
+# if a limit is given and the median exceeds it, so it can guard CI against
+# startup regressions.
+def import_time(python, module, cwd):
+	# Cumulative import time of the module as reported by -X importtime
+	output = subprocess.run([ python, "-X", "importtime", "-c", "import %s" % (module) ], cwd = cwd, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, check = True).stderr.decode()
+	for line in output.split("\n"):
+		fields = [ field.strip() for field in line.split("|") ]
+		if (len(fields) == 3) and (fields[2] == module):
+			return int(fields[1]) / 1000
+	raise Exception("No import time reported for %s." % (module))
+
+def main():
+	parser = FriendlyArgumentParser(description = "Benchmark the startup time of the hsmwiz command line tool.")
+	parser.add_argument("-n", "--iterations", metavar = "count", type = int, default = 20, help = "Number of times the command is run. Defaults to %(default)d.")
+	parser.add_argument("--limit", metavar = "ms", type = float, help = "Fail if the median import time of hsmwiz.__main__ exceeds this many milliseconds.")
+	parser.add_argument("command", metavar = "args", nargs = "*", default = [ "getkey", "--help" ], help = "Command line that is passed to hsmwiz. Defaults to 'getkey --help'.")
+	args = parser.parse_args(sys.argv[1:])
+
+	base_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+	hsmwiz_py = os.path.join(base_dir, "hsmwiz.py")
+	import_times = [ ]
+	run_times = [ ]
+	for i in range(args.iterations):
+		import_times.append(import_time(sys.executable, "hsmwiz.__main__", base_dir))
+		t0 = time.perf_counter()
+		subprocess.run([ sys.executable, hsmwiz_py ] + args.command, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+		run_times.append((time.perf_counter() - t0) * 1000)
+
+	median_import_time = statistics.median(import_times)
+	print("import hsmwiz.__main__ : median %6.1f ms, min %6.1f ms, max %6.1f ms" % (median_import_time, min(import_times), max(import_times)))
+	print("hsmwiz %-15s : median %6.1f ms, min %6.1f ms, max %6.1f ms" % (" ".join(args.command), statistics.median(run_times), min(run_times), max(run_times)))
+	if (args.limit is not None) and (median_import_time > args.limit):
+		print("Import time of %.1f ms exceeds limit of %.1f ms." % (median_import_time, args.limit), file = sys.stderr)
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,40 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import signal
+from .BaseAction import BaseAction
+from .CredentialAgent import CredentialAgent
+from .CredentialAgentClient import CredentialAgentClient
+
+class ActionAgent(BaseAction):
+	def __init__(self, cmdname, args):
+		BaseAction.__init__(self, cmdname, args)
+		socket_path = self.args.socket or CredentialAgentClient.default_socket_path()
+		agent = CredentialAgent(socket_path, lifetime = self.args.timeout or None, verbose = (self.args.verbose > 0))
+		# Terminate cleanly so that the socket is removed
+		signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+		print("hsmwiz agent listening on %s" % (socket_path), file = sys.stderr, flush = True)
+		if socket_path != CredentialAgentClient.default_socket_path():
+			print("Use it by setting HSMWIZ_AGENT_SOCK=%s" % (socket_path), file = sys.stderr, flush = True)
+		try:
+			agent.serve_forever()
+		except KeyboardInterrupt:
+			pass
@@ -0,0 +1,68 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import getpass
+from .BaseAction import BaseAction
+from .CredentialAgentClient import CredentialAgentClient
+
+class ActionAgentAdd(BaseAction):
+	def __init__(self, cmdname, args):
+		BaseAction.__init__(self, cmdname, args)
+		kind = "sopin" if self.args.sopin else "pin"
+		kind_name = "SO-PIN" if self.args.sopin else "PIN"
+		token_name = "token %s" % (self.args.serial) if (self.args.serial is not None) else "all tokens"
+		try:
+			with CredentialAgentClient(self.args.socket) as client:
+				if self.args.list:
+					self._list(client)
+				elif self.args.delete_all:
+					count = client.call("clear")
+					self._result = { "removed": count }
+					print("Removed %d credential(s) from the agent." % (count))
+				elif self.args.delete:
+					if not client.call("remove", kind = kind, serial = self.args.serial):
+						self._fail("The agent holds no %s for %s." % (kind_name, token_name))
+					self._result = { "kind": kind, "serial": self.args.serial }
+					print("Removed %s for %s from the agent." % (kind_name, token_name))
+				else:
+					if self.args.stdin:
+						value = sys.stdin.readline().rstrip("\r\n")
+					else:
+						value = getpass.getpass("%s for %s: " % (kind_name, token_name))
+					if value == "":
+						self._fail("No %s given." % (kind_name))
+					params = { "kind": kind, "value": value, "serial": self.args.serial }
+					if self.args.lifetime is not None:
+						params["lifetime"] = self.args.lifetime
+					client.call("add", **params)
+					self._result = { "kind": kind, "serial": self.args.serial, "lifetime": self.args.lifetime }
+					print("Added %s for %s to the agent." % (kind_name, token_name))
+		except Exception as e:
+			self._fail(str(e))
+
+	def _list(self, client):
+		entries = client.call("list")
+		self._result = { "credentials": entries }
+		if len(entries) == 0:
+			print("The agent holds no credentials.")
+		for entry in entries:
+			expires = "never expires" if (entry["expires_in"] is None) else "expires in %d secs" % (entry["expires_in"])
+			print("%-6s  %-20s  %s" % ("SO-PIN" if (entry["kind"] == "sopin") else "PIN", entry["serial"] or "all tokens", expires))
@@ -0,0 +1,73 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import getpass
+from .BaseAction import BaseAction
+from .BatchJob import BatchJob
+from .CredentialAgentClient import CredentialAgentClient
+from .HardwareSecurityModule import HardwareSecurityModule
+from .ParallelBatchRunner import ParallelBatchRunner
+
+class ActionBatch(BaseAction):
+	def __init__(self, cmdname, args):
+		BaseAction.__init__(self, cmdname, args)
+		batch_job = BatchJob.load(self.args.script, script_format = self.args.script_format)
+		if self.args.all_readers:
+			self._run_all_readers(batch_job)
+		else:
+			with HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, pin = self.args.pin) as hsm:
+				batch_job.run(hsm, verbose = (self.args.verbose > 0))
+			self._result = { "readers": [ { "reader": self.args.reader, "success": True, "error": None, "steps": len(batch_job) } ] }
+
+	def _run_all_readers(self, batch_job):
+		readers = [ reader.index for reader in HardwareSecurityModule.enumerate_readers() if reader.card_present ]
+		if len(readers) == 0:
+			self._fail("No reader with an inserted card found.")
+
+		# Workers cannot ask for the PIN interactively, so ask once up front
+		# unless they can fetch it from the credential agent
+		pin = self.args.pin
+		if (pin is None) and (not CredentialAgentClient.running()):
+			pin = getpass.getpass("PIN: ")
+		hsm_args = {
+			"verbose":		self.args.verbose > 0,
+			"so_path":		self.args.so_path,
+			"backend":		self.args.backend,
+			"pin":			pin,
+		}
+		runner = ParallelBatchRunner(batch_job, hsm_args, max_workers = self.args.jobs, verbose = (self.args.verbose > 0))
+		results = [ ]
+		for result in runner.run(readers):
+			results.append(result)
+			print("=" * 30 + " Reader %d: %s after %.1f secs " % (result.reader, "OK" if result.success else "FAILED", result.duration) + "=" * 30)
+			if result.output != "":
+				print(result.output.rstrip("\r\n"))
+			if not result.success:
+				print("Error: %s" % (result.error))
+
+		failed = [ result for result in results if not result.success ]
+		print()
+		print("%d of %d readers processed successfully." % (len(results) - len(failed), len(results)))
+		for result in sorted(failed):
+			print("    Reader %d failed: %s" % (result.reader, result.error), file = sys.stderr)
+		self._result = { "readers": [ { "reader": result.reader, "success": result.success, "error": result.error, "steps": len(batch_job) if result.success else None, "output": result.output, "duration": result.duration } for result in sorted(results) ] }
+		if len(failed) > 0:
+			self._fail("%d of %d readers failed." % (len(failed), len(results)))
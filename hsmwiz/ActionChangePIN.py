@@ -62,8 +62,9 @@ class ActionChangePIN(BaseAction):
 			else:
 				new_value = getpass.getpass("New PIN: ")
 
-		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, pin = pin, sopin = sopin)
+		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, pin = pin, sopin = sopin)
 		if self.args.affect_so_pin:
 			hsm.change_sopin(new_value)
 		else:
 			hsm.change_pin(new_value)
+		self._result = { "pin_type": "sopin" if self.args.affect_so_pin else "pin", "new_value": str(new_value) if self.args.randomize_new else None }
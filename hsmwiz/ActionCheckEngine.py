@@ -27,3 +27,4 @@ class ActionCheckEngine(BaseAction):
 		BaseAction.__init__(self, cmdname, args)
 		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path)
 		hsm.check_engine()
+		self._result = { "engine": "pkcs11" }
@@ -0,0 +1,61 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import json
+from .BaseAction import BaseAction
+from .HSMClient import HSMClient
+
+class ActionClient(BaseAction):
+	def __init__(self, cmdname, args):
+		BaseAction.__init__(self, cmdname, args)
+		params = { }
+		for param in self.args.params:
+			if "=" not in param:
+				self._fail("expected key=value, but got '%s'." % (param))
+			(key, value) = param.split("=", maxsplit = 1)
+			key = key.replace("-", "_")
+			if (key == "crt") and value.startswith("@"):
+				with open(value[1:]) as f:
+					value = f.read()
+			params[key] = value
+		if self.args.reader is not None:
+			params["reader"] = self.args.reader
+		if params.get("all") is not None:
+			params["all"] = params["all"].lower() in [ "1", "yes", "true" ]
+
+		try:
+			with HSMClient(self.args.socket) as client:
+				result = client.call(self.args.method, **params)
+		except Exception as e:
+			self._fail(str(e))
+
+		self._result = result
+		if self.json_output:
+			return
+		elif self.args.json:
+			print(json.dumps(result))
+		elif isinstance(result, str):
+			print(result.rstrip("\r\n"))
+		elif isinstance(result, list):
+			for item in result:
+				print(str(item).rstrip("\r\n"))
+		elif result is not None:
+			print(json.dumps(result))
@@ -25,4 +25,4 @@ from .HardwareSecurityModule import HardwareSecurityModule
 class ActionExplore(BaseAction):
 	def __init__(self, cmdname, args):
 		BaseAction.__init__(self, cmdname, args)
-		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0)).explore()
+		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), reader = self.args.reader).explore()
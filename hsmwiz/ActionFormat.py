@@ -25,5 +25,6 @@ from .HardwareSecurityModule import HardwareSecurityModule
 class ActionFormat(BaseAction):
 	def __init__(self, cmdname, args):
 		BaseAction.__init__(self, cmdname, args)
-		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, sopin = self.args.so_pin)
-		hsm.format()
+		with HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, sopin = self.args.so_pin) as hsm:
+			hsm.format()
+		self._result = { "formatted": True }
@@ -25,8 +25,9 @@ from .HardwareSecurityModule import HardwareSecurityModule
 class ActionGenCSR(BaseAction):
 	def __init__(self, cmdname, args):
 		BaseAction.__init__(self, cmdname, args)
-		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, pin = self.args.pin)
+		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, pin = self.args.pin)
 		if cmdname == "gencsr":
-			hsm.gencsr(key_id = self.args.id, subject = self.args.subject)
+			pem_data = hsm.gencsr(key_id = self.args.id, subject = self.args.subject, builder = self.args.builder, silent = self.json_output)
 		else:
-			hsm.gencrt(key_id = self.args.id, subject = self.args.subject, validity_days = self.args.validity_days, hashfnc = self.args.hashfnc)
+			pem_data = hsm.gencrt(key_id = self.args.id, subject = self.args.subject, validity_days = self.args.validity_days, hashfnc = self.args.hashfnc, builder = self.args.builder, silent = self.json_output)
+		self._result = { "key_id": self.args.id, "subject": self.args.subject, "pem": pem_data }
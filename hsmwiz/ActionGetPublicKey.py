@@ -18,15 +18,26 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
-import sys
+import json
 from .BaseAction import BaseAction
 from .HardwareSecurityModule import HardwareSecurityModule
 
 class ActionGetPublicKey(BaseAction):
 	def __init__(self, cmdname, args):
 		BaseAction.__init__(self, cmdname, args)
-		if all(argument is None for argument in [ self.args.label, self.args.id ]):
-			print("Error: Must specify either a label or key ID to fetch from smartcard.", file = sys.stderr)
-			sys.exit(1)
-		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, pin = self.args.pin)
-		hsm.getpubkey(key_id = self.args.id, key_label = self.args.label, key_format = self.args.key_format)
+		if all(argument is None for argument in [ self.args.label, self.args.id ]) and (not self.args.all):
+			self._fail("Must specify either a label or key ID to fetch from smartcard or --all.")
+		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, pin = self.args.pin)
+		if self.json_output:
+			# The JSON key format already contains the PEM and SSH encodings
+			if self.args.all:
+				with hsm:
+					keys = hsm.getallpubkeys(key_format = "json", silent = True)
+			else:
+				keys = [ hsm.getpubkey(key_id = self.args.id, key_label = self.args.label, key_format = "json", silent = True) ]
+			self._result = { "keys": [ json.loads(key) for key in keys ] }
+		elif self.args.all:
+			with hsm:
+				hsm.getallpubkeys(key_format = self.args.key_format)
+		else:
+			hsm.getpubkey(key_id = self.args.id, key_label = self.args.label, key_format = self.args.key_format)
@@ -25,4 +25,14 @@ from .HardwareSecurityModule import HardwareSecurityModule
 class ActionIdentify(BaseAction):
 	def __init__(self, cmdname, args):
 		BaseAction.__init__(self, cmdname, args)
-		hsm = HardwareSecurityModule(verbose = True).list()
+		hsm = HardwareSecurityModule(verbose = not self.json_output, reader = self.args.reader)
+		identification = hsm.identify(force = True)
+		if not self.json_output:
+			hsm.list()
+			return
+		objects = hsm.list(silent = True) if identification.initialized else [ ]
+		self._result = {
+			"reader":		identification.reader_name,
+			"initialized":	identification.initialized,
+			"objects":		[ obj._asdict() for obj in objects ],
+		}
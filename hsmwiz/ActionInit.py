@@ -18,15 +18,13 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
-import sys
 from .BaseAction import BaseAction
 from .HardwareSecurityModule import HardwareSecurityModule
 
 class ActionInit(BaseAction):
 	def __init__(self, cmdname, args):
 		BaseAction.__init__(self, cmdname, args)
-		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0))
+		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), reader = self.args.reader)
 		if hsm.initialized:
-			print("Error: Cannot initialize HardwareSecurityModule -- already initialized.", file = sys.stderr)
-			sys.exit(1)
+			self._fail("Cannot initialize HardwareSecurityModule -- already initialized.")
 
@@ -0,0 +1,46 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+from .BaseAction import BaseAction
+from .HardwareSecurityModule import HardwareSecurityModule
+
+class ActionInventory(BaseAction):
+	def __init__(self, cmdname, args):
+		BaseAction.__init__(self, cmdname, args)
+		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, pin = self.args.pin)
+		with hsm:
+			inventory = hsm.inventory(force = self.args.refresh)
+		objects = inventory.find(key_id = self.args.id, label = self.args.label, object_class = self.args.type)
+		self._result = { "serial": inventory.serial, "timestamp": inventory.timestamp, "objects": [ obj._asdict() for obj in objects ] }
+		if self.json_output:
+			return
+
+		print("Token %s, %d of %d objects" % (inventory.serial, len(objects), len(inventory)))
+		for obj in objects:
+			key_id = "-" if (obj.key_id is None) else "%x" % (obj.key_id)
+			if obj.key_type is None:
+				description = obj.subject or ""
+			elif obj.curve is not None:
+				description = "%s %s" % (obj.key_type.upper(), obj.curve)
+			elif obj.bits is not None:
+				description = "%s %d bits" % (obj.key_type.upper(), obj.bits)
+			else:
+				description = obj.key_type.upper()
+			print("%-8s %4s  %-24s %s" % (obj.object_class, key_id, obj.label or "", description))
@@ -19,11 +19,34 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import sys
+import time
 from .BaseAction import BaseAction
 from .HardwareSecurityModule import HardwareSecurityModule
 
 class ActionKeyGen(BaseAction):
 	def __init__(self, cmdname, args):
 		BaseAction.__init__(self, cmdname, args)
-		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, pin = self.args.pin)
-		hsm.keygen(key_spec = self.args.keyspec, key_id = self.args.id, key_label = self.args.label)
+		key_ids = self.args.id
+		if self.args.count is not None:
+			if len(key_ids) != 1:
+				self._fail("--count needs a single start ID, not a list of IDs.")
+			key_ids = list(range(key_ids[0], key_ids[0] + self.args.count))
+		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, pin = self.args.pin)
+		if (len(key_ids) == 1) and (self.args.pubkey_format is None) and (self.args.csr_subject is None):
+			label = None if (self.args.label is None) else self.args.label.replace("{id}", "%02x" % (key_ids[0]))
+			hsm.keygen(key_spec = self.args.keyspec, key_id = key_ids[0], key_label = label)
+			print("Key pair generated: %s, ID %02x%s" % (self.args.keyspec, key_ids[0], "" if (label is None) else (", label %s" % (label))))
+			self._result = { "keys": [ { "key_id": key_ids[0], "label": label, "keyspec": self.args.keyspec, "pubkey": None, "csr": None } ] }
+			return
+
+		keys = [ ]
+		start = time.time()
+		with hsm:
+			for generated in hsm.keygens(self.args.keyspec, key_ids, key_label = self.args.label, key_format = self.args.pubkey_format, csr_subject = self.args.csr_subject):
+				keys.append({ "key_id": generated.key_id, "label": generated.key_label, "keyspec": self.args.keyspec, "pubkey": generated.pubkey, "csr": generated.csr })
+				print("Key %d/%d: ID %02x done after %.1f secs" % (len(keys), len(key_ids), generated.key_id, time.time() - start), file = sys.stderr, flush = True)
+				if not self.json_output:
+					for output in [ generated.pubkey, generated.csr ]:
+						if output is not None:
+							print(output.rstrip("\r\n"), flush = True)
+		self._result = { "keys": keys }
@@ -0,0 +1,68 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import getpass
+from .BaseAction import BaseAction
+from .BatchJob import BatchJob
+from .CredentialAgentClient import CredentialAgentClient
+from .FleetProvisioner import FleetProvisioner
+from .HardwareSecurityModule import HardwareSecurityModule
+from .ProvisioningJournal import ProvisioningJournal
+from .ProvisioningManifest import ProvisioningManifest
+
+class ActionProvision(BaseAction):
+	def __init__(self, cmdname, args):
+		BaseAction.__init__(self, cmdname, args)
+		template = None if (self.args.template is None) else BatchJob.load(self.args.template, script_format = self.args.script_format)
+		manifest = ProvisioningManifest.load(self.args.manifest, template = template)
+		journal = ProvisioningJournal(self.args.journal or (self.args.manifest + ".journal"))
+
+		readers = self.args.reader
+		if readers is None:
+			readers = [ reader.index for reader in HardwareSecurityModule.enumerate_readers() if reader.card_present ]
+		if len(readers) == 0:
+			self._fail("No reader with an inserted card found.")
+
+		# Workers cannot ask for the PIN interactively, so ask once up front
+		# unless they can fetch it from the credential agent
+		pin = self.args.pin
+		if (pin is None) and (not CredentialAgentClient.running()):
+			pin = getpass.getpass("PIN: ")
+		hsm_args = {
+			"verbose":		self.args.verbose > 1,
+			"so_path":		self.args.so_path,
+			"backend":		self.args.backend,
+			"pin":			pin,
+		}
+		provisioner = FleetProvisioner(manifest, journal, hsm_args, max_workers = self.args.jobs, verbose = (self.args.verbose > 0))
+		results = [ ]
+		for result in provisioner.run(readers):
+			results.append(result)
+			print("Reader %d: card %s %s after %.1f secs (%d steps run, %d already done)" % (result.reader, result.serial or "?", result.status, result.duration, result.steps_run, result.steps_skipped), flush = True)
+			if (self.args.verbose > 0) and (result.output != ""):
+				print(result.output.rstrip("\r\n"))
+			if result.error is not None:
+				print("    Error: %s" % (result.error), file = sys.stderr)
+
+		self._result = { "journal": journal.filename, "cards": [ { key: value for (key, value) in result._asdict().items() if key != "output" } for result in sorted(results) ] }
+		failed = [ result for result in results if result.status in [ "failed", "unknown" ] ]
+		if len(failed) > 0:
+			self._fail("%d of %d cards could not be provisioned." % (len(failed), len(results)))
@@ -19,13 +19,42 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import sys
-import subprocess
 from .BaseAction import BaseAction
+from .Certificate import Certificate
 from .HardwareSecurityModule import HardwareSecurityModule
 
 class ActionPutCRT(BaseAction):
+	@staticmethod
+	def _describe(certificate, cert_id, cert_label, matched_key):
+		return {
+			"cert_id":		cert_id,
+			"label":		cert_label,
+			"matched_key":	matched_key,
+			"subject":		certificate.subject,
+			"source":		certificate.source,
+		}
+
 	def __init__(self, cmdname, args):
 		BaseAction.__init__(self, cmdname, args)
-		crt_derdata = subprocess.check_output([ "openssl", "x509", "-outform", "der", "-in", self.args.crt_pemfile ])
-		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, pin = self.args.pin)
-		hsm.putcrt(crt_derdata = crt_derdata, cert_id = self.args.id, cert_label = self.args.label)
+		certificates = [ ]
+		for path in self.args.crt_pemfile:
+			certificates += Certificate.load(path)
+		if len(certificates) == 0:
+			self._fail("No certificates found in %s." % (", ".join(self.args.crt_pemfile)))
+
+		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, pin = self.args.pin)
+		if (len(certificates) == 1) and (self.args.id is not None):
+			hsm.putcrt(crt_derdata = certificates[0].der_data, cert_id = self.args.id, cert_label = self.args.label)
+			self._result = { "certificates": [ self._describe(certificates[0], self.args.id, self.args.label, None) ] }
+			return
+		if (self.args.label is not None) and (len(certificates) > 1):
+			self._fail("--label can only be used with a single certificate.")
+
+		with hsm:
+			stored_certificates = hsm.putcrts(certificates, first_id = self.args.id, cert_label = self.args.label)
+		self._result = { "certificates": [ self._describe(stored.certificate, stored.cert_id, stored.cert_label, stored.matched_key) for stored in stored_certificates ] }
+		if not self.json_output:
+			for stored in stored_certificates:
+				# Keys without a CKA_ID are matched by label only
+				cert_id = "-" if (stored.cert_id is None) else "%02x" % (stored.cert_id)
+				print("ID %-3s %-20s %-8s %-40s %s" % (cert_id, stored.cert_label or "-", "key" if stored.matched_key else "new ID", stored.certificate.subject, stored.certificate.source))
@@ -18,7 +18,6 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
-import sys
 from .BaseAction import BaseAction
 from .HardwareSecurityModule import HardwareSecurityModule
 
@@ -26,7 +25,7 @@ class ActionRemoveKey(BaseAction):
 	def __init__(self, cmdname, args):
 		BaseAction.__init__(self, cmdname, args)
 		if all(argument is None for argument in [ self.args.label, self.args.id ]):
-			print("Error: Must specify either a label or key ID to remove from smartcard.", file = sys.stderr)
-			sys.exit(1)
-		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, pin = self.args.pin)
+			self._fail("Must specify either a label or key ID to remove from smartcard.")
+		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, pin = self.args.pin)
 		hsm.removekey(key_id = self.args.id, key_label = self.args.label)
+		self._result = { "key_id": self.args.id, "label": self.args.label }
@@ -0,0 +1,53 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import sys
+import signal
+import getpass
+from .BaseAction import BaseAction
+from .CredentialAgentClient import CredentialAgentClient
+from .HSMClient import HSMClient
+from .HSMServer import HSMServer
+
+class ActionServe(BaseAction):
+	def __init__(self, cmdname, args):
+		BaseAction.__init__(self, cmdname, args)
+		# Requests may be served for readers that have not been used yet, so
+		# the PIN cannot be asked for lazily; fetching it from the credential
+		# agent works at any time, though
+		pin = self.args.pin
+		if (pin is None) and (not CredentialAgentClient.running()):
+			pin = getpass.getpass("PIN: ")
+		hsm_args = {
+			"verbose":		self.args.verbose > 1,
+			"so_path":		self.args.so_path,
+			"backend":		self.args.backend,
+			"pin":			pin,
+		}
+		socket_path = self.args.socket or HSMClient.default_socket_path()
+		server = HSMServer(socket_path, hsm_args, readers = self.args.reader, max_queue = self.args.max_queue, verbose = (self.args.verbose > 0))
+		# Terminate cleanly so that sessions are closed and the socket removed
+		signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+		print("hsmwiz daemon listening on %s" % (socket_path), file = sys.stderr, flush = True)
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
@@ -0,0 +1,96 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import sys
+import base64
+import hashlib
+from .BaseAction import BaseAction
+from .HardwareSecurityModule import HardwareSecurityModule
+
+class ActionSign(BaseAction):
+	def _input_names(self):
+		# '-' reads further inputs from stdin, one per line, so that the number
+		# of inputs is not limited by the maximum command line length
+		for name in self.args.inputs:
+			if name == "-":
+				for line in sys.stdin:
+					line = line.strip()
+					if line != "":
+						yield line
+			else:
+				yield name
+
+	def _hash_file(self, filename):
+		hashfnc = hashlib.new(self.args.hashfnc)
+		with open(filename, "rb") as f:
+			while True:
+				chunk = f.read(1024 * 1024)
+				if len(chunk) == 0:
+					break
+				hashfnc.update(chunk)
+		return hashfnc.digest()
+
+	def _digests(self, names):
+		digest_length = hashlib.new(self.args.hashfnc).digest_size
+		for name in self._input_names():
+			if self.args.digest:
+				digest = bytes.fromhex(name)
+				if len(digest) != digest_length:
+					raise Exception("Digest %s has %d bytes, but %s digests have %d bytes." % (name, len(digest), self.args.hashfnc, digest_length))
+			else:
+				digest = self._hash_file(name)
+			names.append(name)
+			yield digest
+
+	def _encode(self, signature):
+		if self.args.encoding == "hex":
+			return signature.hex()
+		else:
+			return base64.b64encode(signature).decode()
+
+	def __init__(self, cmdname, args):
+		BaseAction.__init__(self, cmdname, args)
+		if (self.args.id is None) and (self.args.label is None):
+			self._fail("Must specify either a label or key ID of the signing key.")
+		if self.args.digest and (self.args.suffix is not None):
+			self._fail("Signature files can only be written when signing files, not digests.")
+
+		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, pin = self.args.pin)
+		names = [ ]
+		count = 0
+		results = [ ]
+		with hsm:
+			signatures = hsm.sign(self._digests(names), key_id = self.args.id, key_label = self.args.label, hashfnc = self.args.hashfnc, mechanism = self.args.mechanism, signature_format = self.args.signature_format)
+			for signature in signatures:
+				# Digests are computed lazily, names[count] belongs to this one
+				name = names[count]
+				count += 1
+				if self.args.suffix is not None:
+					with open(name + self.args.suffix, "wb") as f:
+						f.write(signature)
+					results.append({ "input": name, "file": name + self.args.suffix })
+				elif self.json_output:
+					results.append({ "input": name, "signature": self._encode(signature) })
+				else:
+					print("%s  %s" % (self._encode(signature), name), flush = True)
+		self._result = { "signatures": results }
+		if self.args.verbose > 0:
+			print("%d signature(s) created." % (count), file = sys.stderr)
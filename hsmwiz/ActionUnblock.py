@@ -25,5 +25,6 @@ from .HardwareSecurityModule import HardwareSecurityModule
 class ActionUnblock(BaseAction):
 	def __init__(self, cmdname, args):
 		BaseAction.__init__(self, cmdname, args)
-		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, pin = self.args.pin, sopin = self.args.sopin)
+		hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, pin = self.args.pin, sopin = self.args.so_pin)
 		hsm.unblock_pin()
+		self._result = { "unblocked": True }
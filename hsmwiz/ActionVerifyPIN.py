@@ -27,14 +27,17 @@ class ActionVerifyPIN(BaseAction):
 		BaseAction.__init__(self, cmdname, args)
 
 		if not args.verify_sopin:
-			hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, pin = self.args.pin)
-			if hsm.login():
+			hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, pin = self.args.pin)
+			correct = hsm.login()
+			if correct:
 				print("PIN correct.", file = sys.stderr)
 			else:
 				print("PIN was WRONG!", file = sys.stderr)
 		else:
-			hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, sopin = self.args.pin)
-			if hsm.login(with_sopin = True):
+			hsm = HardwareSecurityModule(verbose = (self.args.verbose > 0), so_path = self.args.so_path, backend = self.args.backend, reader = self.args.reader, sopin = self.args.pin)
+			correct = hsm.login(with_sopin = True)
+			if correct:
 				print("SO-PIN correct.", file = sys.stderr)
 			else:
 				print("SO-PIN was WRONG!", file = sys.stderr)
+		self._result = { "pin_type": "sopin" if args.verify_sopin else "pin", "correct": correct }
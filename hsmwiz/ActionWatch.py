@@ -0,0 +1,105 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import signal
+import getpass
+import concurrent.futures
+from .BaseAction import BaseAction
+from .BatchJob import BatchJob
+from .CredentialAgentClient import CredentialAgentClient
+from .FleetProvisioner import FleetProvisioner
+from .ParallelBatchRunner import ParallelBatchRunner
+from .ProvisioningJournal import ProvisioningJournal
+from .ProvisioningManifest import ProvisioningManifest
+from .ReaderWatcher import ReaderWatcher
+
+class ActionWatch(BaseAction):
+	def _create_runner(self, hsm_args):
+		if self.args.manifest is not None:
+			template = None if (self.args.script is None) else BatchJob.load(self.args.script, script_format = self.args.script_format)
+			manifest = ProvisioningManifest.load(self.args.manifest, template = template)
+			journal = ProvisioningJournal(self.args.journal or (self.args.manifest + ".journal"))
+			return FleetProvisioner(manifest, journal, hsm_args, verbose = (self.args.verbose > 0))
+		return ParallelBatchRunner(BatchJob.load(self.args.script, script_format = self.args.script_format), hsm_args, verbose = (self.args.verbose > 0))
+
+	def _print_result(self, result):
+		if isinstance(result, FleetProvisioner.CardResult):
+			success = result.status not in [ "failed", "unknown" ]
+			print("Reader %d: card %s %s after %.1f secs (%d steps run, %d already done)" % (result.reader, result.serial or "?", result.status, result.duration, result.steps_run, result.steps_skipped), flush = True)
+		else:
+			success = result.success
+			print("Reader %d: %s after %.1f secs" % (result.reader, "OK" if success else "FAILED", result.duration), flush = True)
+		if ((self.args.verbose > 0) or (not success)) and (result.output != ""):
+			print(result.output.rstrip("\r\n"))
+		if result.error is not None:
+			print("    Error: %s" % (result.error), file = sys.stderr, flush = True)
+
+	def __init__(self, cmdname, args):
+		BaseAction.__init__(self, cmdname, args)
+		if (self.args.script is None) and (self.args.manifest is None):
+			self._fail("Either a batch script or a manifest must be given.")
+
+		# Workers cannot ask for the PIN interactively, so ask once up front
+		# unless they can fetch it from the credential agent
+		pin = self.args.pin
+		if (pin is None) and (not CredentialAgentClient.running()):
+			pin = getpass.getpass("PIN: ")
+		hsm_args = {
+			"verbose":		self.args.verbose > 1,
+			"so_path":		self.args.so_path,
+			"backend":		self.args.backend,
+			"pin":			pin,
+		}
+		runner = self._create_runner(hsm_args)
+		signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+		results = [ ]
+		self._result = { "cards": results }
+		running = { }
+		# Cards that were swapped while the job for their reader was running
+		rerun = set()
+		with ReaderWatcher(monitor = self.args.monitor, poll_interval = self.args.poll_interval, verbose = (self.args.verbose > 0)) as watcher, concurrent.futures.ProcessPoolExecutor(max_workers = self.args.jobs) as executor:
+			def dispatch(reader):
+				if (self.args.count is None) or (len(results) + len(running) < self.args.count):
+					running[reader] = runner.submit(executor, reader)
+
+			print("Watching readers (%s), press Ctrl-C to stop." % (watcher.monitor_name), file = sys.stderr, flush = True)
+			try:
+				while (self.args.count is None) or (len(results) < self.args.count):
+					for event in watcher.poll(timeout = 0.25 if (len(running) > 0) else self.args.poll_interval, report_present = not self.args.ignore_present):
+						print("Reader %d: card %s (%s)" % (event.reader, event.kind, event.name), file = sys.stderr, flush = True)
+						if event.kind == "removed":
+							rerun.discard(event.reader)
+						elif event.reader in running:
+							rerun.add(event.reader)
+						else:
+							dispatch(event.reader)
+					for (reader, future) in list(running.items()):
+						if future.done():
+							del running[reader]
+							result = runner.result(future, reader)
+							results.append({ key: value for (key, value) in result._asdict().items() if key != "output" })
+							self._print_result(result)
+							if reader in rerun:
+								rerun.discard(reader)
+								dispatch(reader)
+			except KeyboardInterrupt:
+				pass
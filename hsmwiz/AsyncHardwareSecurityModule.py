@@ -0,0 +1,116 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import asyncio
+import functools
+import threading
+import concurrent.futures
+from .HardwareSecurityModule import HardwareSecurityModule
+
+# asyncio front end for HardwareSecurityModule. All operations on a token are
+# run in one dedicated worker thread per reader, which keeps the event loop
+# responsive (both for the native backend and while waiting for spawned
+# tools) and at the same time serializes access to each token, even across
+# multiple AsyncHardwareSecurityModule instances. Operations on different
+# readers run concurrently.
+class AsyncHardwareSecurityModule():
+	_executors = { }
+	_executors_lock = threading.Lock()
+
+	def __init__(self, verbose = False, pin = None, sopin = None, so_path = None, backend = "auto", reader = None):
+		self._hsm = HardwareSecurityModule(verbose = verbose, pin = pin, sopin = sopin, so_path = so_path, backend = backend, reader = reader)
+		self._executor = self._get_executor(reader)
+
+	@classmethod
+	def _get_executor(cls, reader):
+		with cls._executors_lock:
+			if reader not in cls._executors:
+				cls._executors[reader] = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "hsmwiz-reader-%s" % ("default" if (reader is None) else reader))
+			return cls._executors[reader]
+
+	async def _run(self, function, *args, **kwargs):
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+	@property
+	def hsm(self):
+		return self._hsm
+
+	@property
+	def reader(self):
+		return self._hsm.reader
+
+	async def __aenter__(self):
+		await self.open_session()
+		return self
+
+	async def __aexit__(self, *args):
+		await self.close_session()
+
+	async def open_session(self):
+		await self._run(self._hsm.__enter__)
+
+	async def close_session(self):
+		await self._run(self._hsm.__exit__, None, None, None)
+
+	@classmethod
+	async def enumerate_readers(cls):
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(None, HardwareSecurityModule.enumerate_readers)
+
+	async def identify(self, force = False):
+		return await self._run(self._hsm.identify, force = force)
+
+	async def login(self, with_sopin = False):
+		return await self._run(self._hsm.login, with_sopin = with_sopin)
+
+	async def keygen(self, key_spec, key_id, key_label = None):
+		await self._run(self._hsm.keygen, key_spec, key_id, key_label = key_label)
+
+	async def removekey(self, key_id, key_label = None):
+		await self._run(self._hsm.removekey, key_id, key_label = key_label)
+
+	async def getpubkey(self, key_id, key_label = None, key_format = "pem"):
+		return await self._run(self._hsm.getpubkey, key_id, key_label = key_label, key_format = key_format, silent = True)
+
+	async def getallpubkeys(self, key_format = "pem"):
+		return await self._run(self._hsm.getallpubkeys, key_format = key_format, silent = True)
+
+	async def gencsr(self, key_id, subject = "/CN=HardwareSecurityModule Example"):
+		return await self._run(self._hsm.gencsr, key_id, subject = subject, silent = True)
+
+	async def gencrt(self, key_id, subject = "/CN=HardwareSecurityModule Example", validity_days = 365, hashfnc = "sha256"):
+		return await self._run(self._hsm.gencrt, key_id, subject = subject, validity_days = validity_days, hashfnc = hashfnc, silent = True)
+
+	async def putcrt(self, crt_derdata, cert_id, cert_label = None):
+		await self._run(self._hsm.putcrt, crt_derdata, cert_id, cert_label = cert_label)
+
+	async def sign(self, digests, key_id = None, key_label = None, hashfnc = "sha256", mechanism = "auto", signature_format = "der"):
+		# The whole batch is signed within one go in the worker thread
+		def sign_all():
+			return list(self._hsm.sign(digests, key_id = key_id, key_label = key_label, hashfnc = hashfnc, mechanism = mechanism, signature_format = signature_format))
+		return await self._run(sign_all)
+
+	async def change_pin(self, new_value):
+		await self._run(self._hsm.change_pin, new_value)
+
+	async def change_sopin(self, new_value):
+		await self._run(self._hsm.change_sopin, new_value)
@@ -18,10 +18,88 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import os
+import sys
+import json
+import time
+import atexit
+from .Instrumentation import Instrumentation, InstrumentationSummary, JSONLinesExporter
+
 class BaseAction():
 	def __init__(self, cmdname, args):
 		self._cmdname = cmdname
 		self._args = args
+		self._result = None
+		self._error = None
+		self._setup_profiling()
+		self._setup_output()
+
+	def _setup_profiling(self):
+		# Actions do all of their work in the constructor, so results are
+		# reported when the process exits
+		profile = getattr(self._args, "profile", False)
+		profile_output = getattr(self._args, "profile_output", None)
+		profile_format = getattr(self._args, "profile_format", "jsonl")
+		if (not profile) and (profile_output is None):
+			return
+
+		summary = None
+		if profile or (profile_format == "prometheus"):
+			summary = InstrumentationSummary()
+			Instrumentation.add_listener(summary)
+		if (profile_output is not None) and (profile_format == "jsonl"):
+			jsonl_file = open(profile_output, "a")
+			Instrumentation.add_listener(JSONLinesExporter(jsonl_file))
+			atexit.register(jsonl_file.close)
+
+		def report():
+			if profile:
+				summary.print_table(sys.stderr)
+			if (profile_output is not None) and (profile_format == "prometheus"):
+				summary.write_prometheus(profile_output)
+		atexit.register(report)
+
+	def _setup_output(self):
+		# In JSON mode, stdout only carries one JSON object that is written
+		# when the process exits. Everything else that would end up on stdout,
+		# including the output of spawned tools, goes to stderr instead.
+		if getattr(self._args, "output", "text") != "json":
+			return
+		sys.stdout.flush()
+		json_file = os.fdopen(os.dup(1), "w")
+		os.dup2(2, 1)
+		summary = InstrumentationSummary()
+		Instrumentation.add_listener(summary)
+		start = time.time()
+
+		previous_excepthook = sys.excepthook
+		def excepthook(exc_type, exc_value, exc_traceback):
+			self._error = str(exc_value) or exc_type.__name__
+			previous_excepthook(exc_type, exc_value, exc_traceback)
+		sys.excepthook = excepthook
+
+		def report():
+			print(json.dumps({
+				"command":	self._cmdname,
+				"success":	self._error is None,
+				"result":	self._result,
+				"error":	self._error,
+				"timings":	{
+					"wall_time":	time.time() - start,
+					"entries":		[ entry._asdict() for entry in summary.entries ],
+				},
+			}), file = json_file, flush = True)
+		atexit.register(report)
+
+	@property
+	def json_output(self):
+		return getattr(self._args, "output", "text") == "json"
+
+	def _fail(self, message):
+		# Reports an error that is not caused by an exception and exits
+		self._error = message
+		print("Error: %s" % (message), file = sys.stderr)
+		sys.exit(1)
 
 	@property
 	def args(self):
@@ -0,0 +1,244 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import json
+import shlex
+import collections
+from .FriendlyArgumentParser import baseint
+from .Certificate import Certificate
+
+# A list of steps that are executed one after another against a single
+# HardwareSecurityModule instance. Scripts are either JSON, YAML (if PyYAML is
+# installed) or line-based, in which case each line looks like:
+#
+#	keygen keyspec=EC:prime256v1 id=2 label=sshkey
+#	gencrt id=2 subject="/CN=My Key" outfile=key2.crt
+#	putcrt id=2 crtfile=key2.crt
+class BatchJob():
+	Step = collections.namedtuple("Step", [ "number", "name", "params" ])
+
+	# Step name: (required parameters, optional parameters)
+	_STEPS = {
+		"keygen":		(("keyspec", ), ("id", "label")),
+		"gencsr":		((), ("id", "subject", "outfile", "builder")),
+		"gencrt":		((), ("id", "subject", "validity_days", "hashfnc", "outfile", "builder")),
+		"putcrt":		(("crtfile", ), ("id", "label")),
+		"getkey":		((), ("id", "label", "format")),
+		"changepin":	(("new", ), ()),
+		"inventory":	((), ("outfile", )),
+	}
+	_ALIASES = {
+		"genkey":		"keygen",
+		"getpubkey":	"getkey",
+	}
+	_DEFAULTS = {
+		"subject":			"/CN=Hardware Security Module Example",
+		"validity_days":	365,
+		"hashfnc":			"sha256",
+		"format":			"pem",
+		"builder":			"native",
+	}
+
+	def __init__(self, steps):
+		self._steps = [ self._validate(self.Step(*step)) for step in steps ]
+
+	def __reduce__(self):
+		# Allows passing batch jobs to worker processes
+		return (self.__class__, ([ tuple(step) for step in self._steps ], ))
+
+	@classmethod
+	def _validate(cls, step):
+		name = cls._ALIASES.get(step.name, step.name)
+		if name not in cls._STEPS:
+			raise Exception("Step %d: unknown step '%s'. Supported: %s" % (step.number, step.name, ", ".join(sorted(cls._STEPS))))
+		(required, optional) = cls._STEPS[name]
+		missing = set(required) - set(step.params)
+		if len(missing) > 0:
+			raise Exception("Step %d (%s): missing parameter(s) %s." % (step.number, name, ", ".join(sorted(missing))))
+		unknown = set(step.params) - set(required) - set(optional)
+		if len(unknown) > 0:
+			raise Exception("Step %d (%s): unsupported parameter(s) %s." % (step.number, name, ", ".join(sorted(unknown))))
+		params = dict(step.params)
+		for (key, conversion) in (("id", baseint), ("validity_days", int)):
+			if isinstance(params.get(key), str):
+				params[key] = conversion(params[key])
+		if params.get("builder", "native") not in [ "native", "openssl" ]:
+			raise Exception("Step %d (%s): builder must be either 'native' or 'openssl'." % (step.number, name))
+		return cls.Step(number = step.number, name = name, params = params)
+
+	@classmethod
+	def _parse_structured(cls, data):
+		if isinstance(data, dict):
+			data = data.get("steps")
+		if not isinstance(data, list):
+			raise Exception("Batch script must be a list of steps or an object with a 'steps' list.")
+		steps = [ ]
+		for (number, entry) in enumerate(data, 1):
+			if isinstance(entry, str):
+				steps.append(cls._parse_line(number, entry))
+				continue
+			params = dict(entry)
+			name = params.pop("step", None)
+			if name is None:
+				raise Exception("Step %d: no 'step' given." % (number))
+			steps.append(cls.Step(number = number, name = name, params = params))
+		return steps
+
+	@classmethod
+	def _parse_line(cls, number, line):
+		tokens = shlex.split(line)
+		params = { }
+		for token in tokens[1:]:
+			if "=" not in token:
+				raise Exception("Step %d: expected key=value, but got '%s'." % (number, token))
+			(key, value) = token.split("=", maxsplit = 1)
+			params[key.replace("-", "_")] = value
+		return cls.Step(number = number, name = tokens[0], params = params)
+
+	@classmethod
+	def from_structured(cls, data):
+		# Creates a job from already parsed JSON/YAML data
+		return cls(cls._parse_structured(data))
+
+	@classmethod
+	def _parse_lines(cls, text):
+		steps = [ ]
+		for (lineno, line) in enumerate(text.split("\n"), 1):
+			line = line.strip()
+			if (line == "") or line.startswith("#"):
+				continue
+			steps.append(cls._parse_line(lineno, line))
+		return steps
+
+	@classmethod
+	def parse(cls, text, script_format = "auto"):
+		assert(script_format in [ "auto", "json", "yaml", "lines" ])
+		if script_format == "auto":
+			stripped = text.lstrip()
+			if stripped.startswith("[") or stripped.startswith("{"):
+				script_format = "json"
+			elif stripped.startswith("---") or stripped.startswith("- ") or stripped.startswith("steps:"):
+				script_format = "yaml"
+			else:
+				script_format = "lines"
+
+		if script_format == "json":
+			steps = cls._parse_structured(json.loads(text))
+		elif script_format == "yaml":
+			try:
+				import yaml
+			except ImportError:
+				raise Exception("Batch script is in YAML format, but PyYAML is not installed.")
+			steps = cls._parse_structured(yaml.safe_load(text))
+		else:
+			steps = cls._parse_lines(text)
+		return cls(steps)
+
+	@classmethod
+	def load(cls, filename, script_format = "auto"):
+		if filename == "-":
+			return cls.parse(sys.stdin.read(), script_format = script_format)
+		with open(filename) as f:
+			return cls.parse(f.read(), script_format = script_format)
+
+	@property
+	def steps(self):
+		return iter(self._steps)
+
+	def __len__(self):
+		return len(self._steps)
+
+	@staticmethod
+	def _write_output(filename, data):
+		with open(filename, "w") as f:
+			f.write(data)
+
+	def _run_keygen(self, hsm, params):
+		hsm.keygen(key_spec = params["keyspec"], key_id = params.get("id", 1), key_label = params.get("label"))
+
+	def _run_gencsr(self, hsm, params):
+		outfile = params.get("outfile")
+		pem_data = hsm.gencsr(key_id = params.get("id", 1), subject = params["subject"], silent = outfile is not None, builder = params["builder"])
+		if outfile is not None:
+			self._write_output(outfile, pem_data)
+
+	def _run_gencrt(self, hsm, params):
+		outfile = params.get("outfile")
+		pem_data = hsm.gencrt(key_id = params.get("id", 1), subject = params["subject"], validity_days = params["validity_days"], hashfnc = params["hashfnc"], silent = outfile is not None, builder = params["builder"])
+		if outfile is not None:
+			self._write_output(outfile, pem_data)
+
+	def _run_putcrt(self, hsm, params):
+		# Same as the putcrt command: without an ID, certificates are matched
+		# to the keys on the card by their public key
+		certificates = Certificate.load(params["crtfile"])
+		if len(certificates) == 0:
+			raise Exception("No certificates found in %s." % (params["crtfile"]))
+		if (len(certificates) == 1) and ("id" in params):
+			hsm.putcrt(crt_derdata = certificates[0].der_data, cert_id = params["id"], cert_label = params.get("label"))
+			return
+		if ("label" in params) and (len(certificates) > 1):
+			raise Exception("'label' can only be used with a single certificate.")
+		hsm.putcrts(certificates, first_id = params.get("id"), cert_label = params.get("label"))
+
+	def _run_getkey(self, hsm, params):
+		if ("id" in params) == ("label" in params):
+			raise Exception("Exactly one of 'id' or 'label' must be given.")
+		hsm.getpubkey(key_id = params.get("id"), key_label = params.get("label"), key_format = params["format"])
+
+	def _run_changepin(self, hsm, params):
+		hsm.change_pin(params["new"])
+
+	def _run_inventory(self, hsm, params):
+		inventory = hsm.inventory(force = True)
+		if params.get("outfile") is not None:
+			self._write_output(params["outfile"], json.dumps(inventory.to_dict()))
+		else:
+			for obj in inventory:
+				print("%-8s %4s  %s" % (obj.object_class, "-" if (obj.key_id is None) else "%x" % (obj.key_id), obj.label or ""))
+
+	def run(self, hsm, verbose = False, variables = None, skip = None, step_done = None):
+		# Every "{name}" in a string parameter is replaced by the value of the
+		# given variable; "{reader}" is always available. skip(step, params)
+		# can return True to leave out a step and step_done(step) is called
+		# after each step that was run.
+		variables = dict(variables or { })
+		if hsm.reader is not None:
+			# Allows distinct file names when running on multiple readers
+			variables["reader"] = str(hsm.reader)
+		for (index, step) in enumerate(self._steps, 1):
+			params = dict(self._DEFAULTS)
+			params.update(step.params)
+			for (name, value) in variables.items():
+				params = { key: param.replace("{%s}" % (name), value) if isinstance(param, str) else param for (key, param) in params.items() }
+			if (skip is not None) and skip(step, params):
+				if verbose:
+					print("Batch step %d/%d: %s skipped" % (index, len(self._steps), step.name))
+				continue
+			if verbose:
+				print("Batch step %d/%d: %s %s" % (index, len(self._steps), step.name, " ".join("%s=%s" % (key, params[key]) for key in sorted(step.params) if key != "new")))
+			handler = getattr(self, "_run_" + step.name)
+			try:
+				handler(hsm, params)
+			except Exception as e:
+				raise Exception("Batch step %d (%s) failed: %s" % (step.number, step.name, str(e))) from e
+			if step_done is not None:
+				step_done(step)
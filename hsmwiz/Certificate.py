@@ -0,0 +1,95 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+from .DER import DER
+from .PEM import PEM
+from .X509Builder import X509Builder
+
+# Decoded X.509 certificate; only the fields that are needed to store it on a
+# token (and to find the key it belongs to) are extracted.
+class Certificate():
+	_FILE_EXTENSIONS = [ ".pem", ".crt", ".cer", ".der" ]
+
+	def __init__(self, der_data, source = None):
+		self._der_data = der_data
+		self._source = source
+		certificate = DER.decode_single(der_data, expect_tag = DER.TAG_SEQUENCE)
+		tbs_fields = DER.decode_children(DER.decode_children(certificate.content)[0].content)
+		if tbs_fields[0].tag == 0xa0:
+			# Skip explicit version
+			tbs_fields = tbs_fields[1:]
+		self._subject = tbs_fields[4]
+		self._pubkey_der = tbs_fields[5].raw
+
+	@classmethod
+	def load(cls, path):
+		# Loads all certificates from a PEM bundle, a DER file or, for a
+		# directory, from all certificate files in it in lexical order
+		if os.path.isdir(path):
+			certificates = [ ]
+			for filename in sorted(os.listdir(path)):
+				if os.path.splitext(filename)[1].lower() in cls._FILE_EXTENSIONS:
+					certificates += cls.load(os.path.join(path, filename))
+			return certificates
+
+		with open(path, "rb") as f:
+			data = f.read()
+		blocks = PEM.decode_all(data, label = "CERTIFICATE")
+		if len(blocks) == 0:
+			if data.startswith(b"-----BEGIN"):
+				return [ ]
+			blocks = [ data ]
+		if len(blocks) == 1:
+			return [ cls(blocks[0], source = path) ]
+		return [ cls(der_data, source = "%s #%d" % (path, index)) for (index, der_data) in enumerate(blocks, 1) ]
+
+	@property
+	def der_data(self):
+		return self._der_data
+
+	@property
+	def source(self):
+		return self._source
+
+	@property
+	def pubkey_der(self):
+		return self._pubkey_der
+
+	def _subject_attributes(self):
+		names = { oid: name for (name, (oid, tag)) in X509Builder._NAME_ATTRIBUTES.items() }
+		for rdn in DER.decode_children(self._subject.content):
+			for attribute in DER.decode_children(rdn.content):
+				(oid, value) = DER.decode_children(attribute.content)
+				oid = DER.decode_oid(oid.content)
+				yield (names.get(oid, oid), value.content.decode("utf-8", errors = "replace"))
+
+	@property
+	def subject(self):
+		# In the same "/CN=foo/O=bar" format that --subject takes
+		return "".join("/%s=%s" % (name, value.replace("/", "\\/")) for (name, value) in self._subject_attributes())
+
+	@property
+	def common_name(self):
+		for (name, value) in self._subject_attributes():
+			if name == "CN":
+				return value
+		return None
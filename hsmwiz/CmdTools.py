@@ -19,6 +19,22 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 class CmdTools():
+	_SECRET_OPTIONS = [ "--pin", "--so-pin", "--new-pin" ]
+	_SECRET_PREFIXES = [ "PIN:" ]
+
+	@classmethod
+	def redacted(cls, cmd):
+		# Copy of the command with all PINs masked, for printing only
+		result = [ ]
+		for arg in cmd:
+			if (len(result) > 0) and (result[-1] in cls._SECRET_OPTIONS):
+				arg = "****"
+			for prefix in cls._SECRET_PREFIXES:
+				if arg.startswith(prefix):
+					arg = prefix + "****"
+			result.append(arg)
+		return result
+
 	@classmethod
 	def cmdline(cls, cmd):
 		def escape(text):
@@ -0,0 +1,277 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import sys
+import json
+import time
+import ctypes
+import socket
+import struct
+import threading
+import socketserver
+from .HSMServer import RPCError
+from .CredentialAgentClient import CredentialAgentClient
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		if not self.server.agent.peer_allowed(self.request):
+			return
+		for line in self.rfile:
+			if line.strip() == b"":
+				continue
+			response = self.server.agent.handle_line(line)
+			self.wfile.write(json.dumps(response).encode() + b"\n")
+			self.wfile.flush()
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+	def service_actions(self):
+		# Called by serve_forever() about twice a second
+		self.agent.expire()
+
+# Daemon that holds PINs and SO-PINs in memory so that hsmwiz commands can
+# fetch them over a Unix domain socket (see CredentialAgentClient) instead of
+# prompting for them or having them passed on the command line. Credentials
+# are either stored for one token serial number or as a default for all
+# tokens and are forgotten after their lifetime has passed. Nothing is ever
+# written to disk; the socket is only accessible to the user running the
+# agent.
+class CredentialAgent():
+	_ERR_PARSE = -32700
+	_ERR_INVALID_REQUEST = -32600
+	_ERR_METHOD_NOT_FOUND = -32601
+	_ERR_INVALID_PARAMS = -32602
+
+	_KINDS = [ "pin", "sopin" ]
+
+	# Method name: (required parameters, optional parameters)
+	_METHODS = {
+		"ping":			((), ()),
+		"get":			(("kind", ), ("serial", )),
+		"add":			(("kind", "value"), ("serial", "lifetime")),
+		"update":		(("kind", "serial", "value"), ()),
+		"remove":		(("kind", ), ("serial", )),
+		"reject":		(("kind", "value"), ("serial", )),
+		"clear":		((), ()),
+		"list":			((), ()),
+	}
+
+	def __init__(self, socket_path, lifetime = None, verbose = False):
+		self._socket_path = socket_path
+		self._lifetime = lifetime
+		self._verbose = verbose
+		self._lock = threading.Lock()
+		# (kind, serial or None): (value, expiry time or None)
+		self._credentials = { }
+		self._server = None
+
+	def _log(self, message):
+		if self._verbose:
+			print(message, file = sys.stderr, flush = True)
+
+	def _lookup(self, kind, serial):
+		# Credentials stored for the serial take precedence over the default
+		for key in [ (kind, serial), (kind, None) ]:
+			if key in self._credentials:
+				return key
+		return None
+
+	def expire(self):
+		now = time.monotonic()
+		with self._lock:
+			expired = [ key for (key, (value, expiry)) in self._credentials.items() if (expiry is not None) and (expiry <= now) ]
+			for key in expired:
+				del self._credentials[key]
+		for (kind, serial) in expired:
+			self._log("Forgot expired %s for %s" % (kind, serial or "all tokens"))
+
+	def _rpc_ping(self, params):
+		return "pong"
+
+	def _rpc_get(self, params):
+		with self._lock:
+			key = self._lookup(params["kind"], params.get("serial"))
+			return None if (key is None) else self._credentials[key][0]
+
+	def _rpc_add(self, params):
+		lifetime = params.get("lifetime", self._lifetime)
+		expiry = None if (lifetime is None) else time.monotonic() + lifetime
+		with self._lock:
+			self._credentials[(params["kind"], params.get("serial"))] = (params["value"], expiry)
+
+	def _rpc_update(self, params):
+		# After a PIN change, the new PIN replaces whatever the token's old
+		# PIN was taken from. A changed default is only changed for this one
+		# token, all other tokens keep using the old default.
+		with self._lock:
+			key = self._lookup(params["kind"], params["serial"])
+			if key is None:
+				return False
+			expiry = self._credentials[key][1]
+			self._credentials[(params["kind"], params["serial"])] = (params["value"], expiry)
+			return True
+
+	def _rpc_remove(self, params):
+		with self._lock:
+			return self._credentials.pop((params["kind"], params.get("serial")), None) is not None
+
+	def _rpc_reject(self, params):
+		# A token refused the PIN it was given. Whatever entry it was taken
+		# from is forgotten, so that it does not use up the retry counter of
+		# this or other tokens, unless it has been replaced in the meantime.
+		with self._lock:
+			key = self._lookup(params["kind"], params.get("serial"))
+			if (key is None) or (self._credentials[key][0] != params["value"]):
+				return False
+			del self._credentials[key]
+		self._log("Forgot rejected %s for %s" % (key[0], key[1] or "all tokens"))
+		return True
+
+	def _rpc_clear(self, params):
+		with self._lock:
+			count = len(self._credentials)
+			self._credentials = { }
+		return count
+
+	def _rpc_list(self, params):
+		now = time.monotonic()
+		with self._lock:
+			return [ { "kind": kind, "serial": serial, "expires_in": None if (expiry is None) else round(expiry - now) } for ((kind, serial), (value, expiry)) in sorted(self._credentials.items(), key = lambda item: (item[0][0], item[0][1] or "")) ]
+
+	def _check_params(self, method, params):
+		if not isinstance(params, dict):
+			raise RPCError(self._ERR_INVALID_PARAMS, "Parameters must be given as an object.")
+		(required, optional) = self._METHODS[method]
+		missing = set(required) - set(params)
+		if len(missing) > 0:
+			raise RPCError(self._ERR_INVALID_PARAMS, "Missing parameter(s) %s." % (", ".join(sorted(missing))))
+		unknown = set(params) - set(required) - set(optional)
+		if len(unknown) > 0:
+			raise RPCError(self._ERR_INVALID_PARAMS, "Unsupported parameter(s) %s." % (", ".join(sorted(unknown))))
+		if ("kind" in params) and (params["kind"] not in self._KINDS):
+			raise RPCError(self._ERR_INVALID_PARAMS, "Unsupported credential kind '%s'. Supported: %s" % (params["kind"], ", ".join(self._KINDS)))
+		for key in [ "serial", "value" ]:
+			if (params.get(key) is not None) and (not isinstance(params[key], str)):
+				raise RPCError(self._ERR_INVALID_PARAMS, "'%s' must be a string." % (key))
+		if "lifetime" in params:
+			if (params["lifetime"] is not None) and ((not isinstance(params["lifetime"], int)) or (params["lifetime"] <= 0)):
+				raise RPCError(self._ERR_INVALID_PARAMS, "'lifetime' must be a positive number of seconds.")
+		return params
+
+	def handle_request(self, request):
+		if (not isinstance(request, dict)) or (not isinstance(request.get("method"), str)):
+			raise RPCError(self._ERR_INVALID_REQUEST, "Request must be an object with a 'method'.")
+		method = request["method"]
+		if method not in self._METHODS:
+			raise RPCError(self._ERR_METHOD_NOT_FOUND, "Unknown method '%s'. Supported: %s" % (method, ", ".join(sorted(self._METHODS))))
+		params = self._check_params(method, request.get("params", { }))
+		return getattr(self, "_rpc_" + method)(params)
+
+	def handle_line(self, line):
+		request_id = None
+		try:
+			try:
+				request = json.loads(line)
+			except ValueError as e:
+				raise RPCError(self._ERR_PARSE, "Cannot parse request: %s" % (str(e)))
+			if isinstance(request, dict):
+				request_id = request.get("id")
+				params = request.get("params")
+				# Never log the credential itself
+				if isinstance(params, dict):
+					self._log("Request %s: %s" % (request_id, " ".join(str(value) for value in [ request.get("method"), params.get("kind"), params.get("serial") ] if value is not None)))
+			result = self.handle_request(request)
+			return { "jsonrpc": "2.0", "id": request_id, "result": result }
+		except RPCError as e:
+			return { "jsonrpc": "2.0", "id": request_id, "error": { "code": e.code, "message": str(e) } }
+
+	def peer_allowed(self, connection):
+		# The socket is created with mode 0600 already; where the kernel tells
+		# us who is connecting, additionally refuse other users (e.g., root
+		# connecting through a socket path shared by accident)
+		if not hasattr(socket, "SO_PEERCRED"):
+			return True
+		creds = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+		(pid, uid, gid) = struct.unpack("3i", creds)
+		if uid != os.getuid():
+			self._log("Refusing connection from PID %d of UID %d" % (pid, uid))
+			return False
+		return True
+
+	@staticmethod
+	def _disable_dumps():
+		# Like ssh-agent: no core dumps that could contain the PINs and no
+		# ptrace attaching by other processes of the same user
+		PR_SET_DUMPABLE = 4
+		try:
+			ctypes.CDLL(None).prctl(PR_SET_DUMPABLE, 0, 0, 0, 0)
+		except (OSError, AttributeError):
+			pass
+
+	def _remove_stale_socket(self):
+		if not os.path.exists(self._socket_path):
+			return
+		probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			probe.connect(self._socket_path)
+		except OSError:
+			os.unlink(self._socket_path)
+			return
+		finally:
+			probe.close()
+		raise Exception("Another hsmwiz agent is already listening on %s." % (self._socket_path))
+
+	def _prepare_directory(self):
+		# The default socket outside of $XDG_RUNTIME_DIR lives in a directory
+		# of its own; clients refuse it if someone else created that first
+		directory = os.path.dirname(os.path.abspath(self._socket_path))
+		if not os.path.exists(directory):
+			os.mkdir(directory, 0o700)
+		CredentialAgentClient.check_directory(directory)
+
+	def serve_forever(self):
+		self._disable_dumps()
+		self._prepare_directory()
+		self._remove_stale_socket()
+		old_umask = os.umask(0o177)
+		try:
+			self._server = _UnixServer(self._socket_path, _RequestHandler)
+		finally:
+			os.umask(old_umask)
+		self._server.agent = self
+		try:
+			self._server.serve_forever()
+		finally:
+			self.close()
+
+	def shutdown(self):
+		if self._server is not None:
+			self._server.shutdown()
+
+	def close(self):
+		if self._server is not None:
+			self._server.server_close()
+			self._server = None
+			if os.path.exists(self._socket_path):
+				os.unlink(self._socket_path)
+		with self._lock:
+			self._credentials = { }
@@ -0,0 +1,151 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import sys
+import stat
+import socket
+import struct
+from .HSMClient import HSMClient
+
+class UntrustedAgentException(Exception): pass
+
+# Client for the "hsmwiz agent" credential daemon (see CredentialAgent). The
+# agent's socket is taken from $HSMWIZ_AGENT_SOCK, much like ssh-agent's
+# $SSH_AUTH_SOCK, and otherwise lives next to the hsmwiz daemon's socket.
+# Since PINs are sent to whoever listens there, the client refuses sockets
+# that another user could have put in place.
+class CredentialAgentClient(HSMClient):
+	@classmethod
+	def default_socket_path(cls):
+		if os.environ.get("HSMWIZ_AGENT_SOCK"):
+			return os.environ["HSMWIZ_AGENT_SOCK"]
+		runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+		if runtime_dir:
+			return os.path.join(runtime_dir, "hsmwiz-agent.sock")
+		# /tmp is shared by all users, so the socket gets a private directory
+		# there instead of a name any other user could take first
+		return "/tmp/hsmwiz-agent-%d/agent.sock" % (os.getuid())
+
+	@staticmethod
+	def check_directory(path):
+		# The directory must not allow other users to replace the socket:
+		# either it belongs to us or root and only its owner may write to it,
+		# or it is sticky like /tmp
+		st = os.lstat(path)
+		if not stat.S_ISDIR(st.st_mode):
+			raise UntrustedAgentException("%s is not a directory." % (path))
+		if st.st_uid not in (os.getuid(), 0):
+			raise UntrustedAgentException("%s is owned by UID %d, not by UID %d." % (path, st.st_uid, os.getuid()))
+		if (st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)) and not (st.st_mode & stat.S_ISVTX):
+			raise UntrustedAgentException("%s is writable by other users." % (path))
+
+	def _check_socket(self):
+		try:
+			st = os.lstat(self._socket_path)
+		except FileNotFoundError:
+			# connecting fails with the usual error
+			return
+		self.check_directory(os.path.dirname(os.path.abspath(self._socket_path)))
+		if not stat.S_ISSOCK(st.st_mode):
+			raise UntrustedAgentException("%s is not a socket." % (self._socket_path))
+		if st.st_uid != os.getuid():
+			raise UntrustedAgentException("Agent socket %s is owned by UID %d, not by UID %d." % (self._socket_path, st.st_uid, os.getuid()))
+		if st.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+			raise UntrustedAgentException("Agent socket %s is accessible by other users (mode %o)." % (self._socket_path, stat.S_IMODE(st.st_mode)))
+
+	def _check_peer(self):
+		if not hasattr(socket, "SO_PEERCRED"):
+			return
+		creds = self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+		(pid, uid, gid) = struct.unpack("3i", creds)
+		if uid != os.getuid():
+			raise UntrustedAgentException("Agent at %s is run by UID %d (PID %d), not by UID %d." % (self._socket_path, uid, pid, os.getuid()))
+
+	def connect(self):
+		if self._socket is None:
+			self._check_socket()
+			super().connect()
+			try:
+				self._check_peer()
+			except UntrustedAgentException:
+				self.close()
+				raise
+
+	@classmethod
+	def _connected(cls):
+		# Returns a connected client or None if no agent is running
+		client = cls()
+		if not os.path.exists(client._socket_path):
+			return None
+		try:
+			client.connect()
+		except UntrustedAgentException as e:
+			print("Not using hsmwiz agent: %s" % (str(e)), file = sys.stderr)
+			return None
+		except Exception:
+			return None
+		return client
+
+	@classmethod
+	def running(cls):
+		client = cls._connected()
+		if client is None:
+			return False
+		with client:
+			return client.call("ping") == "pong"
+
+	@classmethod
+	def lookup(cls, kind, serial):
+		# Returns the PIN ("pin") or SO-PIN ("sopin") the agent holds for a
+		# token or None. "serial" is a callable returning the token's serial
+		# number; it is only called when the agent holds credentials for
+		# specific tokens, since reading the serial might spawn a process.
+		client = cls._connected()
+		if client is None:
+			return None
+		with client:
+			entries = [ entry for entry in client.call("list") if entry["kind"] == kind ]
+			if len(entries) == 0:
+				return None
+			token_serial = serial() if any(entry["serial"] is not None for entry in entries) else None
+			return client.call("get", kind = kind, serial = token_serial)
+
+	@classmethod
+	def update(cls, kind, serial, value):
+		# Replaces the credential the agent holds for a token after it was
+		# changed on the token, so that the agent does not keep handing out a
+		# stale PIN that would use up the token's retry counter
+		client = cls._connected()
+		if client is None:
+			return False
+		with client:
+			if not any(entry["kind"] == kind for entry in client.call("list")):
+				return False
+			return client.call("update", kind = kind, serial = serial(), value = value)
+
+	@classmethod
+	def reject(cls, kind, serial, value):
+		# Removes a credential the token refused from the agent
+		client = cls._connected()
+		if client is None:
+			return False
+		with client:
+			return client.call("reject", kind = kind, serial = serial(), value = value)
@@ -0,0 +1,176 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import collections
+
+# Minimal DER encoder/decoder, just enough to handle public keys and
+# certificates without having to call out to OpenSSL.
+class DER():
+	Element = collections.namedtuple("Element", [ "tag", "content", "raw" ])
+
+	TAG_BOOLEAN = 0x01
+	TAG_INTEGER = 0x02
+	TAG_BITSTRING = 0x03
+	TAG_OCTETSTRING = 0x04
+	TAG_NULL = 0x05
+	TAG_OID = 0x06
+	TAG_UTF8STRING = 0x0c
+	TAG_PRINTABLESTRING = 0x13
+	TAG_IA5STRING = 0x16
+	TAG_UTCTIME = 0x17
+	TAG_GENERALIZEDTIME = 0x18
+	TAG_SEQUENCE = 0x30
+	TAG_SET = 0x31
+
+	@classmethod
+	def encode_length(cls, length):
+		if length < 0x80:
+			return bytes([ length ])
+		length_bytes = length.to_bytes((length.bit_length() + 7) // 8, byteorder = "big")
+		return bytes([ 0x80 | len(length_bytes) ]) + length_bytes
+
+	@classmethod
+	def encode(cls, tag, content):
+		return bytes([ tag ]) + cls.encode_length(len(content)) + content
+
+	@classmethod
+	def sequence(cls, *elements):
+		return cls.encode(cls.TAG_SEQUENCE, b"".join(elements))
+
+	@classmethod
+	def set(cls, *elements):
+		# DER requires SET OF elements to be sorted by their encoding
+		return cls.encode(cls.TAG_SET, b"".join(sorted(elements)))
+
+	@classmethod
+	def explicit(cls, tag_number, element):
+		return cls.encode(0xa0 | tag_number, element)
+
+	@classmethod
+	def boolean(cls, value):
+		return cls.encode(cls.TAG_BOOLEAN, b"\xff" if value else b"\x00")
+
+	@classmethod
+	def string(cls, tag, text):
+		return cls.encode(tag, text.encode("utf-8"))
+
+	@classmethod
+	def time(cls, timestamp):
+		# RFC 5280: UTCTime until 2049, GeneralizedTime from 2050 on
+		if timestamp.year < 2050:
+			return cls.encode(cls.TAG_UTCTIME, timestamp.strftime("%y%m%d%H%M%SZ").encode())
+		return cls.encode(cls.TAG_GENERALIZEDTIME, timestamp.strftime("%Y%m%d%H%M%SZ").encode())
+
+	@classmethod
+	def integer(cls, value):
+		if isinstance(value, bytes):
+			value = int.from_bytes(value, byteorder = "big")
+		length = (value.bit_length() + 8) // 8
+		return cls.encode(cls.TAG_INTEGER, value.to_bytes(length, byteorder = "big", signed = True))
+
+	@classmethod
+	def null(cls):
+		return cls.encode(cls.TAG_NULL, b"")
+
+	@classmethod
+	def bitstring(cls, data, unused_bits = 0):
+		return cls.encode(cls.TAG_BITSTRING, bytes([ unused_bits ]) + data)
+
+	@classmethod
+	def octetstring(cls, data):
+		return cls.encode(cls.TAG_OCTETSTRING, data)
+
+	@classmethod
+	def oid(cls, dotted):
+		components = [ int(component) for component in dotted.split(".") ]
+		# the first two arcs share one subidentifier, which can exceed 127
+		# for arc 2 (e.g., 2.999)
+		content = bytearray()
+		for component in [ (40 * components[0]) + components[1] ] + components[2:]:
+			encoded = [ component & 0x7f ]
+			component >>= 7
+			while component > 0:
+				encoded.insert(0, 0x80 | (component & 0x7f))
+				component >>= 7
+			content += bytes(encoded)
+		return cls.encode(cls.TAG_OID, bytes(content))
+
+	@classmethod
+	def decode(cls, data, offset = 0):
+		# Returns the TLV element at the given offset and the offset of the
+		# first byte following it.
+		if offset + 2 > len(data):
+			raise Exception("DER data truncated at offset %d." % (offset))
+		tag = data[offset]
+		if (tag & 0x1f) == 0x1f:
+			raise Exception("High tag numbers are not supported (offset %d)." % (offset))
+		length = data[offset + 1]
+		header_length = 2
+		if length & 0x80:
+			length_bytes = length & 0x7f
+			if (length_bytes == 0) or (offset + 2 + length_bytes > len(data)):
+				raise Exception("Invalid DER length encoding at offset %d." % (offset))
+			length = int.from_bytes(data[offset + 2 : offset + 2 + length_bytes], byteorder = "big")
+			header_length += length_bytes
+		end = offset + header_length + length
+		if end > len(data):
+			raise Exception("DER data truncated at offset %d." % (offset))
+		element = cls.Element(tag = tag, content = bytes(data[offset + header_length : end]), raw = bytes(data[offset : end]))
+		return (element, end)
+
+	@classmethod
+	def decode_single(cls, data, expect_tag = None):
+		(element, end) = cls.decode(data)
+		if end != len(data):
+			raise Exception("Trailing data after DER element (%d bytes)." % (len(data) - end))
+		if (expect_tag is not None) and (element.tag != expect_tag):
+			raise Exception("Expected DER tag 0x%02x, but got 0x%02x." % (expect_tag, element.tag))
+		return element
+
+	@classmethod
+	def decode_children(cls, content):
+		children = [ ]
+		offset = 0
+		while offset < len(content):
+			(element, offset) = cls.decode(content, offset)
+			children.append(element)
+		return children
+
+	@classmethod
+	def decode_integer(cls, content):
+		return int.from_bytes(content, byteorder = "big", signed = True)
+
+	@classmethod
+	def decode_oid(cls, content):
+		components = [ ]
+		value = 0
+		for byte in content:
+			value = (value << 7) | (byte & 0x7f)
+			if not (byte & 0x80):
+				components.append(value)
+				value = 0
+		if len(components) == 0:
+			raise Exception("Empty OID encountered.")
+		first = components[0]
+		if first < 80:
+			prefix = [ first // 40, first % 40 ]
+		else:
+			prefix = [ 2, first - 80 ]
+		return ".".join(str(component) for component in prefix + components[1:])
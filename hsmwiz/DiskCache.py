@@ -0,0 +1,119 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import time
+import fcntl
+import tempfile
+import threading
+import contextlib
+
+# Small JSON-backed key/value cache that lives in the user's cache directory
+# and is shared among hsmwiz invocations. Entries are also kept in memory so
+# that lookups within the same process do not have to hit the filesystem.
+# Caching is disabled entirely if HSMWIZ_CACHE_DIR is set to an empty string.
+class DiskCache():
+	_memory = { }
+	_memory_lock = threading.Lock()
+
+	def __init__(self, name):
+		self._name = name
+		cache_dir = self.cache_dir()
+		self._filename = None if (cache_dir is None) else os.path.join(cache_dir, name + ".json")
+
+	@staticmethod
+	def cache_dir():
+		cache_dir = os.environ.get("HSMWIZ_CACHE_DIR")
+		if cache_dir is None:
+			cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "hsmwiz")
+		if cache_dir == "":
+			return None
+		return cache_dir
+
+	@contextlib.contextmanager
+	def _locked(self):
+		os.makedirs(os.path.dirname(self._filename), mode = 0o700, exist_ok = True)
+		with open(self._filename + ".lock", "w") as lockfile:
+			fcntl.flock(lockfile, fcntl.LOCK_EX)
+			yield
+
+	def _read(self):
+		try:
+			with open(self._filename) as f:
+				content = json.load(f)
+			if isinstance(content, dict):
+				return content
+		except (OSError, ValueError):
+			pass
+		return { }
+
+	def _write(self, content):
+		(fd, tmpname) = tempfile.mkstemp(prefix = ".%s_" % (self._name), dir = os.path.dirname(self._filename))
+		try:
+			with os.fdopen(fd, "w") as f:
+				json.dump(content, f)
+			os.replace(tmpname, self._filename)
+		except Exception:
+			os.unlink(tmpname)
+			raise
+
+	@staticmethod
+	def _is_fresh(entry, max_age):
+		if entry is None:
+			return False
+		return (max_age is None) or (time.time() - entry["timestamp"] <= max_age)
+
+	def get(self, key, max_age = None):
+		with self._memory_lock:
+			entry = self._memory.get((self._name, key))
+		if (not self._is_fresh(entry, max_age)) and (self._filename is not None):
+			entry = self._read().get(key)
+		if not self._is_fresh(entry, max_age):
+			return None
+		return entry["value"]
+
+	def put(self, key, value):
+		entry = { "timestamp": time.time(), "value": value }
+		with self._memory_lock:
+			self._memory[(self._name, key)] = entry
+		if self._filename is None:
+			return
+		try:
+			with self._locked():
+				content = self._read()
+				content[key] = entry
+				self._write(content)
+		except OSError:
+			# Caching is a pure optimization, never fail because of it
+			pass
+
+	def remove(self, key):
+		with self._memory_lock:
+			self._memory.pop((self._name, key), None)
+		if self._filename is None:
+			return
+		try:
+			with self._locked():
+				content = self._read()
+				if content.pop(key, None) is not None:
+					self._write(content)
+		except OSError:
+			pass
@@ -0,0 +1,117 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import time
+import collections
+import concurrent.futures
+from .HardwareSecurityModule import HardwareSecurityModule
+from .ParallelBatchRunner import run_captured
+from .ProvisioningJournal import ProvisioningJournal
+
+# Steps that change a PIN. If one was interrupted, the card may or may not
+# already use the new PIN; trying the PIN from the manifest would use up one
+# retry on every resume until the card is locked.
+_PIN_CHANGING_STEPS = [ "changepin" ]
+
+def _provision(manifest, journal, reader, hsm_args, verbose):
+	# Returns (serial, status, steps run, steps skipped)
+	with HardwareSecurityModule(reader = reader, **hsm_args) as hsm:
+		serial = hsm.token_serial()
+		card = manifest.get(serial)
+		if card is None:
+			return (serial, "unknown", 0, 0)
+		(started, finished, completed, begun) = journal.state(serial)
+		if finished:
+			return (serial, "done", 0, len(completed))
+		interrupted = [ (number, name) for (number, name) in sorted(begun.items()) if number not in completed ]
+		if len(interrupted) > 0:
+			(number, name) = interrupted[0]
+			error = "Step %d (%s) was interrupted and may have changed the PIN already. Not resuming, since a login with the wrong PIN uses up a retry; check which PIN the card accepts and update its \"begin\" journal entry to \"step\" (PIN changed) or remove it (PIN unchanged)." % (number, name)
+			journal.append(serial, "error", error = error)
+			raise Exception("Card %s: %s" % (serial, error))
+		if not started:
+			journal.append(serial, "start", reader = reader)
+		counts = { "run": 0, "skipped": 0 }
+
+		def skip(step, params):
+			if step.number in completed:
+				if completed[step.number] != step.name:
+					raise Exception("Journal has step %d as %s, but the manifest has %s for card %s." % (step.number, completed[step.number], step.name, serial))
+				counts["skipped"] += 1
+				return True
+			if started and (step.name == "keygen") and (len(hsm.find_objects(key_id = params.get("id", 1), object_class = "privkey", force = True)) > 0):
+				# Keygen completed on the card, but was not journaled anymore
+				journal.append(serial, "step", step = step.number, name = step.name, recovered = True)
+				counts["skipped"] += 1
+				return True
+			if step.name in _PIN_CHANGING_STEPS:
+				journal.append(serial, "begin", step = step.number, name = step.name)
+			return False
+
+		def step_done(step):
+			counts["run"] += 1
+			journal.append(serial, "step", step = step.number, name = step.name)
+
+		try:
+			card.job.run(hsm, verbose = verbose, variables = card.variables, skip = skip, step_done = step_done)
+		except Exception as e:
+			journal.append(serial, "error", error = str(e))
+			raise Exception("Card %s: %s" % (serial, str(e))) from e
+		journal.append(serial, "finish")
+		return (serial, "provisioned", counts["run"], counts["skipped"])
+
+def _provision_reader(manifest, journal_filename, reader, hsm_args, verbose):
+	# Runs in a worker process, output is captured per reader
+	t0 = time.time()
+	(result, error, output) = run_captured(_provision, manifest, ProvisioningJournal(journal_filename), reader, hsm_args, verbose)
+	(serial, status, steps_run, steps_skipped) = result if (error is None) else (None, "failed", 0, 0)
+	return (reader, serial, status, steps_run, steps_skipped, error, output, time.time() - t0)
+
+# Provisions all cards in the given readers according to a manifest, one
+# worker process per reader. Cards are matched to manifest entries by their
+# serial number and progress is recorded in a journal, so that a card that
+# is inserted again (or a provisioning run that is restarted) continues with
+# the first step that has not been completed yet.
+class FleetProvisioner():
+	CardResult = collections.namedtuple("CardResult", [ "reader", "serial", "status", "steps_run", "steps_skipped", "error", "output", "duration" ])
+
+	def __init__(self, manifest, journal, hsm_args, max_workers = None, verbose = False):
+		self._manifest = manifest
+		self._journal = journal
+		self._hsm_args = hsm_args
+		self._max_workers = max_workers
+		self._verbose = verbose
+
+	def submit(self, executor, reader):
+		return executor.submit(_provision_reader, self._manifest, self._journal.filename, reader, self._hsm_args, self._verbose)
+
+	def result(self, future, reader):
+		try:
+			return self.CardResult(*future.result())
+		except Exception as e:
+			return self.CardResult(reader = reader, serial = None, status = "failed", steps_run = 0, steps_skipped = 0, error = "Worker failed: %s" % (str(e)), output = "", duration = 0)
+
+	def run(self, readers):
+		# Yields one CardResult per reader in order of completion
+		max_workers = self._max_workers or max(len(readers), 1)
+		with concurrent.futures.ProcessPoolExecutor(max_workers = max_workers) as executor:
+			futures = { self.submit(executor, reader): reader for reader in readers }
+			for future in concurrent.futures.as_completed(futures):
+				yield self.result(future, futures[future])
@@ -0,0 +1,82 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import json
+import socket
+
+# Thin client for the "hsmwiz serve" daemon. Requests and responses are
+# JSON-RPC 2.0 objects, one per line, over a Unix domain socket.
+class HSMClient():
+	def __init__(self, socket_path = None):
+		self._socket_path = socket_path or self.default_socket_path()
+		self._socket = None
+		self._file = None
+		self._next_id = 1
+
+	@classmethod
+	def default_socket_path(cls):
+		runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+		if runtime_dir:
+			return os.path.join(runtime_dir, "hsmwiz.sock")
+		return "/tmp/hsmwiz-%d.sock" % (os.getuid())
+
+	def __enter__(self):
+		self.connect()
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def connect(self):
+		if self._socket is None:
+			self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				self._socket.connect(self._socket_path)
+			except OSError as e:
+				self._socket.close()
+				self._socket = None
+				raise Exception("Cannot connect to hsmwiz daemon at %s: %s" % (self._socket_path, str(e)))
+			self._file = self._socket.makefile("rwb")
+
+	def close(self):
+		if self._socket is not None:
+			self._file.close()
+			self._socket.close()
+			self._socket = None
+			self._file = None
+
+	def call(self, method, **params):
+		self.connect()
+		request_id = self._next_id
+		self._next_id += 1
+		request = { "jsonrpc": "2.0", "id": request_id, "method": method, "params": params }
+		self._file.write(json.dumps(request).encode() + b"\n")
+		self._file.flush()
+		line = self._file.readline()
+		if len(line) == 0:
+			raise Exception("hsmwiz daemon closed the connection.")
+		response = json.loads(line)
+		if response.get("id") != request_id:
+			raise Exception("Received response for request %s while waiting for %d." % (response.get("id"), request_id))
+		if "error" in response:
+			raise Exception("%s (code %d)" % (response["error"]["message"], response["error"]["code"]))
+		return response["result"]
@@ -0,0 +1,237 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import sys
+import json
+import base64
+import socket
+import socketserver
+from .FriendlyArgumentParser import baseint
+from .HardwareSecurityModule import HardwareSecurityModule
+from .TokenScheduler import TokenScheduler
+from .PEM import PEM
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		for line in self.rfile:
+			if line.strip() == b"":
+				continue
+			response = self.server.hsm_server.handle_line(line)
+			self.wfile.write(json.dumps(response).encode() + b"\n")
+			self.wfile.flush()
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+class RPCError(Exception):
+	def __init__(self, code, message):
+		super().__init__(message)
+		self.code = code
+
+# Daemon that keeps HardwareSecurityModule sessions open and serves requests
+# from local clients (see HSMClient). Requests are dispatched through a
+# TokenScheduler, i.e., there is one queue and one logged-in session per
+# reader; requests to the same reader are serialized, requests to different
+# readers run concurrently.
+class HSMServer():
+	_ERR_PARSE = -32700
+	_ERR_INVALID_REQUEST = -32600
+	_ERR_METHOD_NOT_FOUND = -32601
+	_ERR_INVALID_PARAMS = -32602
+	_ERR_OPERATION_FAILED = -32000
+
+	# Method name: (required parameters, optional parameters)
+	_METHODS = {
+		"ping":			((), ()),
+		"getkey":		((), ("id", "label", "all", "format")),
+		"gencsr":		((), ("id", "subject")),
+		"gencrt":		((), ("id", "subject", "validity_days", "hashfnc")),
+		"putcrt":		(("crt", ), ("id", "label")),
+		"keygen":		(("keyspec", ), ("id", "label")),
+		"sign":			(("digests", ), ("id", "label", "hashfnc", "mechanism", "signature_format")),
+	}
+	_DEFAULTS = {
+		"id":				1,
+		"subject":			"/CN=Hardware Security Module Example",
+		"validity_days":	365,
+		"hashfnc":			"sha256",
+		"format":			"pem",
+		"mechanism":		"auto",
+		"signature_format":	"der",
+	}
+
+	def __init__(self, socket_path, hsm_args, readers = None, max_queue = 64, verbose = False):
+		self._socket_path = socket_path
+		self._readers = readers
+		self._verbose = verbose
+		self._scheduler = TokenScheduler(hsm_args, max_queue = max_queue, session_linger = None, readers = readers)
+		self._server = None
+
+	def _rpc_ping(self, hsm, params):
+		return "pong"
+
+	def _rpc_getkey(self, hsm, params):
+		if params.get("all"):
+			return hsm.getallpubkeys(key_format = params["format"], silent = True)
+		if ("id" in params) == ("label" in params):
+			raise RPCError(self._ERR_INVALID_PARAMS, "Exactly one of 'id', 'label' or 'all' must be given.")
+		return hsm.getpubkey(key_id = params.get("id"), key_label = params.get("label"), key_format = params["format"], silent = True)
+
+	def _rpc_gencsr(self, hsm, params):
+		return hsm.gencsr(key_id = params["id"], subject = params["subject"], silent = True)
+
+	def _rpc_gencrt(self, hsm, params):
+		return hsm.gencrt(key_id = params["id"], subject = params["subject"], validity_days = params["validity_days"], hashfnc = params["hashfnc"], silent = True)
+
+	def _rpc_putcrt(self, hsm, params):
+		hsm.putcrt(crt_derdata = PEM.decode(params["crt"], label = "CERTIFICATE"), cert_id = params["id"], cert_label = params.get("label"))
+
+	def _rpc_keygen(self, hsm, params):
+		hsm.keygen(key_spec = params["keyspec"], key_id = params["id"], key_label = params.get("label"))
+
+	def _rpc_sign(self, hsm, params):
+		# Digests are hex encoded, signatures are returned base64 encoded
+		digests = params["digests"]
+		if isinstance(digests, str):
+			digests = digests.split(",")
+		try:
+			digests = [ bytes.fromhex(digest) for digest in digests ]
+		except (TypeError, ValueError) as e:
+			raise RPCError(self._ERR_INVALID_PARAMS, "'digests' must be a list of hex-encoded digests: %s" % (str(e)))
+		if params["hashfnc"] not in HardwareSecurityModule._HASH_OIDS:
+			raise RPCError(self._ERR_INVALID_PARAMS, "Unsupported hash function '%s'." % (params["hashfnc"]))
+		if params["mechanism"] not in HardwareSecurityModule._SIGN_MECHANISMS:
+			raise RPCError(self._ERR_INVALID_PARAMS, "Unsupported signature mechanism '%s'." % (params["mechanism"]))
+		if params["signature_format"] not in [ "der", "raw" ]:
+			raise RPCError(self._ERR_INVALID_PARAMS, "Unsupported signature format '%s'." % (params["signature_format"]))
+		signatures = hsm.sign(digests, key_id = params.get("id"), key_label = params.get("label"), hashfnc = params["hashfnc"], mechanism = params["mechanism"], signature_format = params["signature_format"])
+		return [ base64.b64encode(signature).decode() for signature in signatures ]
+
+	def _check_params(self, method, params):
+		if not isinstance(params, dict):
+			raise RPCError(self._ERR_INVALID_PARAMS, "Parameters must be given as an object.")
+		params = dict(params)
+		reader = params.pop("reader", None)
+		if isinstance(reader, str):
+			try:
+				reader = int(reader)
+			except ValueError:
+				raise RPCError(self._ERR_INVALID_PARAMS, "Invalid value for 'reader': %s" % (reader))
+		elif (reader is not None) and (not isinstance(reader, int)):
+			raise RPCError(self._ERR_INVALID_PARAMS, "Invalid value for 'reader': %s" % (reader))
+		if (reader is None) and (self._readers is not None):
+			reader = self._readers[0]
+		(required, optional) = self._METHODS[method]
+		missing = set(required) - set(params)
+		if len(missing) > 0:
+			raise RPCError(self._ERR_INVALID_PARAMS, "Missing parameter(s) %s." % (", ".join(sorted(missing))))
+		unknown = set(params) - set(required) - set(optional)
+		if len(unknown) > 0:
+			raise RPCError(self._ERR_INVALID_PARAMS, "Unsupported parameter(s) %s." % (", ".join(sorted(unknown))))
+		for (key, conversion) in (("id", baseint), ("validity_days", int)):
+			if isinstance(params.get(key), str):
+				try:
+					params[key] = conversion(params[key])
+				except ValueError:
+					raise RPCError(self._ERR_INVALID_PARAMS, "Invalid value for '%s': %s" % (key, params[key]))
+		full_params = { key: value for (key, value) in self._DEFAULTS.items() if key in (required + optional) and key != "id" }
+		if ("id" in optional) and ("label" not in params) and (not params.get("all")):
+			full_params["id"] = self._DEFAULTS["id"]
+		full_params.update(params)
+		return (reader, full_params)
+
+	def handle_request(self, request):
+		if (not isinstance(request, dict)) or (not isinstance(request.get("method"), str)):
+			raise RPCError(self._ERR_INVALID_REQUEST, "Request must be an object with a 'method'.")
+		method = request["method"]
+		if method not in self._METHODS:
+			raise RPCError(self._ERR_METHOD_NOT_FOUND, "Unknown method '%s'. Supported: %s" % (method, ", ".join(sorted(self._METHODS))))
+		(reader, params) = self._check_params(method, request.get("params", { }))
+		handler = getattr(self, "_rpc_" + method)
+		if method == "ping":
+			return handler(None, params)
+		try:
+			return self._scheduler.submit(reader, lambda hsm: handler(hsm, params)).result()
+		except RPCError:
+			raise
+		except Exception as e:
+			raise RPCError(self._ERR_OPERATION_FAILED, "%s failed: %s" % (method, str(e))) from e
+
+	def handle_line(self, line):
+		request_id = None
+		try:
+			try:
+				request = json.loads(line)
+			except ValueError as e:
+				raise RPCError(self._ERR_PARSE, "Cannot parse request: %s" % (str(e)))
+			if isinstance(request, dict):
+				request_id = request.get("id")
+			if self._verbose:
+				print("Request %s: %s" % (request_id, request.get("method") if isinstance(request, dict) else "?"), file = sys.stderr)
+			result = self.handle_request(request)
+			return { "jsonrpc": "2.0", "id": request_id, "result": result }
+		except RPCError as e:
+			return { "jsonrpc": "2.0", "id": request_id, "error": { "code": e.code, "message": str(e) } }
+
+	def _remove_stale_socket(self):
+		if not os.path.exists(self._socket_path):
+			return
+		probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			probe.connect(self._socket_path)
+		except OSError:
+			os.unlink(self._socket_path)
+			return
+		finally:
+			probe.close()
+		raise Exception("Another hsmwiz daemon is already listening on %s." % (self._socket_path))
+
+	def serve_forever(self):
+		# Open the default session up front so that a wrong PIN or missing card
+		# is noticed on startup rather than on the first request
+		reader = None if (self._readers is None) else self._readers[0]
+		if not self._scheduler.call(reader, "login"):
+			self._scheduler.close()
+			raise Exception("Login to reader %s failed." % ("default" if (reader is None) else reader))
+		self._remove_stale_socket()
+		old_umask = os.umask(0o077)
+		try:
+			self._server = _UnixServer(self._socket_path, _RequestHandler)
+		finally:
+			os.umask(old_umask)
+		self._server.hsm_server = self
+		try:
+			self._server.serve_forever()
+		finally:
+			self.close()
+
+	def shutdown(self):
+		if self._server is not None:
+			self._server.shutdown()
+
+	def close(self):
+		if self._server is not None:
+			self._server.server_close()
+			self._server = None
+			if os.path.exists(self._socket_path):
+				os.unlink(self._socket_path)
+		self._scheduler.close()
@@ -18,157 +18,438 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
-import os
+import re
+import json
 import subprocess
-import tempfile
+import collections
+import concurrent.futures
 from .CmdTools import CmdTools
+from .CredentialAgentClient import CredentialAgentClient
+from .Instrumentation import Instrumentation
+from .DiskCache import DiskCache
+from .MemoryFile import MemoryFile
+from .OpenSSLShell import OpenSSLShell, OpenSSLShellUnavailableException
+from .SharedObjectResolver import SharedObjectResolver
+from .PublicKey import PublicKey
+from .X509Builder import X509Builder
+from .PEM import PEM
+from .DER import DER
+from .TokenInventory import TokenInventory
+from .PKCS11Library import PKCS11Exception
+from .PKCS11NativeBackend import PKCS11NativeBackend
+from .PKCS11ToolBackend import PKCS11ToolBackend
 
 class HardwareSecurityModule(object):
 	_INITIAL_SOPIN = "3537363231383830"
 	_INITIAL_PIN = "648219"
+	Reader = collections.namedtuple("Reader", [ "index", "name", "card_present" ])
+	Identification = collections.namedtuple("Identification", [ "reader_name", "initialized", "output" ])
+	StoredCertificate = collections.namedtuple("StoredCertificate", [ "certificate", "cert_id", "cert_label", "matched_key" ])
+	GeneratedKey = collections.namedtuple("GeneratedKey", [ "key_id", "key_label", "pubkey", "csr" ])
+	_IDENTIFY_CACHE_TTL_SECS = 10
+	_INVENTORY_CACHE_TTL_SECS = 300
+	_HASH_OIDS = {
+		"sha1":		"1.3.14.3.2.26",
+		"sha224":	"2.16.840.1.101.3.4.2.4",
+		"sha256":	"2.16.840.1.101.3.4.2.1",
+		"sha384":	"2.16.840.1.101.3.4.2.2",
+		"sha512":	"2.16.840.1.101.3.4.2.3",
+	}
+	_SIGN_MECHANISMS = [ "auto", "pkcs1", "pss", "ecdsa" ]
 
-	def __init__(self, verbose = False, pin = None, sopin = None, so_path = None):
+	def __init__(self, verbose = False, pin = None, sopin = None, so_path = None, backend = "auto", reader = None):
+		assert(backend in [ "auto", "native", "tool" ])
 		self.__verbose = verbose
+		self.__reader = reader
 		self.__pin = pin
 		self.__sopin = sopin
+		self.__agent_credentials = { }
 		self.__sopath = so_path
-		self.__initialized = self.__identify()
+		self.__so_resolver = None
+		self.__backend_name = backend
+		self.__backend = None
+		self.__identification = None
+		self.__identification_cache = DiskCache("identify")
+		self.__inventory_cache = DiskCache("inventory")
+		self.__token_serial = None
+		self.__in_context = False
+		self.__openssl_shell = None
+		self.__openssl_shell_available = True
 		if self.__verbose:
 			print("Default SO-PIN: %s    Default PIN: %s" % (self._INITIAL_SOPIN, self._INITIAL_PIN))
 
+	@Instrumentation.operation("identify")
 	def __identify(self):
-		proc = subprocess.Popen([ "sc-hsm-tool" ], stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
-		(stdout, _) = proc.communicate()
+		stdout = Instrumentation.spawn([ "sc-hsm-tool" ] + self._reader_args(), capture = True, stderr = subprocess.STDOUT, check = False).stdout
 		if self.__verbose:
 			print(stdout.decode())
 			print("~" * 120)
 		if b"No smart card readers" in stdout:
 			raise Exception("No smart card readers connected.")
 
-		return b"has never been initialized" not in stdout
+		stdout = stdout.decode(errors = "replace")
+		reader_name = None
+		for line in stdout.split("\n"):
+			if line.startswith("Using reader with a card:"):
+				reader_name = line.split(":", maxsplit = 1)[1].strip()
+		return self.Identification(reader_name = reader_name, initialized = "has never been initialized" not in stdout, output = stdout)
+
+	@property
+	def _identification_cache_key(self):
+		# The reader's name and pcsc-lite's count of card insertions and
+		# removals in it, so that a swapped card is not taken for the cached
+		# one. Both come from pcscd without accessing the card or spawning a
+		# process. Without pcsc-lite or a card, nothing is cached.
+		try:
+			from .ReaderWatcher import PCSCMonitor
+			monitor = PCSCMonitor()
+			try:
+				readers = monitor.readers()
+				counters = monitor.card_counters()
+			finally:
+				monitor.close()
+		except Exception:
+			return None
+		if self.__reader is None:
+			# Like sc-hsm-tool, the first reader with a card is used
+			readers = [ reader for reader in readers if reader.card_present ]
+		else:
+			readers = [ reader for reader in readers if reader.card_present and (reader.index == self.__reader) ]
+		if (len(readers) == 0) or (counters.get(readers[0].name) is None):
+			return None
+		return (readers[0].name, counters[readers[0].name])
+
+	def identify(self, force = False):
+		# Identification is only run when it's actually needed; the result is
+		# cached for a short while per reader and card so that commands run
+		# in quick succession do not all have to query the card.
+		if (self.__identification is not None) and (not force):
+			return self.__identification
+		cache_key = self._identification_cache_key
+		if (not force) and (cache_key is not None):
+			cached = self.__identification_cache.get("%s:%d" % cache_key, max_age = self._IDENTIFY_CACHE_TTL_SECS)
+			if (cached is not None) and (cached["reader_name"] == cache_key[0]):
+				self.__identification = self.Identification(**cached)
+				if self.__verbose:
+					print("Using cached identification of reader %s" % (self.__identification.reader_name))
+				return self.__identification
+		self.__identification = self.__identify()
+		if cache_key is not None:
+			self.__identification_cache.put("%s:%d" % cache_key, self.__identification._asdict())
+		return self.__identification
+
+	def _invalidate_identification(self):
+		self.__identification = None
+		cache_key = self._identification_cache_key
+		if cache_key is not None:
+			self.__identification_cache.remove("%s:%d" % cache_key)
+
+	def token_serial(self):
+		# Serial number of the token, read once per instance
+		if self.__token_serial is None:
+			self.__token_serial = self.backend.token_serial()
+		return self.__token_serial
+
+	@Instrumentation.operation("inventory")
+	def inventory(self, force = False):
+		# Lists all objects on the token. The listing is cached per token
+		# serial number together with a change fingerprint of the token (if
+		# the backend can provide one cheaply) so that repeated queries do not
+		# need to log in and walk all objects again. Without a fingerprint,
+		# cached listings expire after a while instead. Operations of this
+		# class that modify the token drop the cached listing.
+		serial = self.token_serial()
+		fingerprint = self.backend.change_fingerprint()
+		if (not force) and (serial is not None):
+			cached = self.__inventory_cache.get(serial, max_age = self._INVENTORY_CACHE_TTL_SECS if (fingerprint is None) else None)
+			if (cached is not None) and (cached["fingerprint"] == fingerprint):
+				if self.__verbose:
+					print("Using cached inventory of token %s" % (serial))
+				return TokenInventory.from_dict(cached["inventory"])
+		inventory = TokenInventory(serial, list(self.backend.list_objects()))
+		if serial is not None:
+			self.__inventory_cache.put(serial, { "fingerprint": fingerprint, "inventory": inventory.to_dict() })
+		return inventory
+
+	def find_objects(self, key_id = None, label = None, object_class = None, force = False):
+		return self.inventory(force = force).find(key_id = key_id, label = label, object_class = object_class)
+
+	def _invalidate_inventory(self):
+		try:
+			serial = self.token_serial()
+		except Exception:
+			# Without a token there is nothing that could have been cached
+			return
+		if serial is not None:
+			self.__inventory_cache.remove(serial)
+
+	def __enter__(self):
+		self.backend.open_session()
+		self.__in_context = True
+		return self
+
+	def __exit__(self, *args):
+		self.__in_context = False
+		if self.__openssl_shell is not None:
+			self.__openssl_shell.close()
+			self.__openssl_shell = None
+		self.backend.close_session()
+
+	@classmethod
+	def enumerate_readers(cls):
+		output = Instrumentation.spawn([ "opensc-tool", "--list-readers" ], capture = True, stderr = subprocess.STDOUT).stdout.decode()
+		readers = [ ]
+		name_column = None
+		for line in output.split("\n"):
+			if line.startswith("Nr."):
+				name_column = line.find("Name")
+			elif re.match(r"^\d+\s", line) and (name_column is not None):
+				fields = line.split()
+				readers.append(cls.Reader(index = int(fields[0]), name = line[name_column:].strip(), card_present = (fields[1] == "Yes")))
+		return readers
+
+	@property
+	def reader(self):
+		return self.__reader
+
+	def _reader_name(self):
+		# PKCS#11 slots are found by the name of the reader, since they are not
+		# numbered like the readers are
+		if self.__reader is None:
+			return None
+		for reader in self.enumerate_readers():
+			if reader.index == self.__reader:
+				return reader.name
+		raise Exception("No smart card reader with index %d connected." % (self.__reader))
+
+	def _reader_args(self):
+		if self.__reader is None:
+			return [ ]
+		return [ "--reader", str(self.__reader) ]
 
 	def _shared_obj(self, soname):
 		if self.__sopath is None:
 			raise Exception("No shared object search path was given, cannot locate '%s'." % (soname))
-		for path in self.__sopath.split(":"):
-			path = os.path.realpath(os.path.expanduser(path))
-			if not path.endswith("/"):
-				path += "/"
-			path += soname
-			if os.path.isfile(path):
-				return path
-		raise Exception("Could not find shared object '%s' anywhere in SO-searchpath '%s'." % (soname, self.__sopath))
+		if self.__so_resolver is None:
+			self.__so_resolver = SharedObjectResolver(self.__sopath)
+		return self.__so_resolver.resolve(soname)
+
+	def _credential(self, kind):
+		# PIN ("pin") or SO-PIN ("sopin") as given or, failing that, as held by
+		# a running credential agent. The agent is asked at most once per kind.
+		value = self.__pin if (kind == "pin") else self.__sopin
+		if value is not None:
+			return value
+		if kind not in self.__agent_credentials:
+			self.__agent_credentials[kind] = CredentialAgentClient.lookup(kind, serial = self.token_serial)
+			if self.__verbose and (self.__agent_credentials[kind] is not None):
+				print("Using %s held by the credential agent" % ("SO-PIN" if (kind == "sopin") else "PIN"))
+		return self.__agent_credentials[kind]
+
+	def _credential_rejected(self, kind):
+		# Called by the backends when the token refused a PIN. Returns True if
+		# it came from the agent; it is then dropped there and not used again,
+		# so that a stale PIN in the agent cannot lock the token.
+		value = self.__agent_credentials.get(kind)
+		if value is None:
+			return False
+		self.__agent_credentials[kind] = None
+		if CredentialAgentClient.reject(kind, serial = self.token_serial, value = value) and self.__verbose:
+			print("Removed %s rejected by the token from the credential agent" % ("SO-PIN" if (kind == "sopin") else "PIN"))
+		return True
+
+	def _credential_changed(self, kind, new_value):
+		if kind in self.__agent_credentials:
+			self.__agent_credentials[kind] = new_value
+		if CredentialAgentClient.update(kind, serial = self.token_serial, value = str(new_value)) and self.__verbose:
+			print("Updated %s held by the credential agent" % ("SO-PIN" if (kind == "sopin") else "PIN"))
+
+	def _create_backend(self):
+		module_path = self._shared_obj("opensc-pkcs11.so")
+		reader_name = self._reader_name()
+		if self.__backend_name in [ "auto", "native" ]:
+			try:
+				return PKCS11NativeBackend(module_path, verbose = self.__verbose, pin = self.__pin, sopin = self.__sopin, reader_name = reader_name, credentials = self._credential, credentials_rejected = self._credential_rejected)
+			except (OSError, AttributeError, PKCS11Exception) as e:
+				if self.__backend_name == "native":
+					raise
+				if self.__verbose:
+					print("Cannot use native PKCS#11 backend, falling back to pkcs11-tool: %s" % (str(e)))
+		return PKCS11ToolBackend(module_path, call = self._call, call_output = self._call_output, pin = self.__pin, sopin = self.__sopin, reader_name = reader_name, credentials = self._credential, credentials_rejected = self._credential_rejected)
+
+	@property
+	def backend(self):
+		if self.__backend is None:
+			self.__backend = self._create_backend()
+		return self.__backend
 
 	def _call(self, cmd):
 		if self.__verbose:
-			print("Now executing: %s" % (CmdTools.cmdline(cmd)))
-		subprocess.check_call(cmd)
+			print("Now executing: %s" % (CmdTools.cmdline(CmdTools.redacted(cmd))))
+		Instrumentation.spawn(cmd)
 		if self.__verbose:
 			print()
 
+	def _call_output(self, cmd, stderr = None):
+		if self.__verbose:
+			print("Now executing: %s" % (CmdTools.cmdline(CmdTools.redacted(cmd))))
+		return Instrumentation.spawn(cmd, capture = True, stderr = stderr).stdout
+
 	@property
 	def initialized(self):
-		return self.__initialized
+		return self.identify().initialized
 
+	@Instrumentation.operation("initialize")
 	def initialize(self):
 		assert(not self.intialized)
-		cmd = [ "sc-hsm-tool", "--initialize", "--so-pin", self._INITIAL_SOPIN, "--pin", self._INITIAL_PIN ]
+		cmd = [ "sc-hsm-tool" ] + self._reader_args() + [ "--initialize", "--so-pin", self._INITIAL_SOPIN, "--pin", self._INITIAL_PIN ]
 		self._call(cmd)
+		self._invalidate_identification()
+		self._invalidate_inventory()
 
-	def list(self):
-		self._call([ "pkcs15-tool", "--dump" ])
+	@Instrumentation.operation("list")
+	def list(self, silent = False):
+		# Returns the parsed dump when silent, otherwise only prints it
+		cmd = [ "pkcs15-tool" ] + self._reader_args() + [ "--dump" ]
+		if not silent:
+			self._call(cmd)
+			return None
+		return TokenInventory.parse_pkcs15_tool_dump(self._call_output(cmd).decode(errors = "replace"))
 
+	@Instrumentation.operation("login")
 	def login(self, with_sopin = False):
-		cmd = [ "pkcs11-tool", "--module", self._shared_obj("opensc-pkcs11.so"), "--login", "--list-objects" ]
-		if with_sopin:
-			cmd += [ "--login-type", "so" ]
-			if self.__sopin is not None:
-				cmd += [ "--so-pin", self.__sopin ]
-		else:
-			if self.__pin is not None:
-				cmd += [ "--pin", self.__pin ]
-		try:
-			self._call(cmd)
-			return True
-		except subprocess.CalledProcessError:
-			return False
+		return self.backend.login(with_sopin = with_sopin)
 
+	@Instrumentation.operation("unblock_pin")
 	def unblock_pin(self):
-		cmd = [ "pkcs11-tool", "--module", self._shared_obj("opensc-pkcs11.so"), "--login", "--login-type", "so" ]
-		if self.__sopin is not None:
-			cmd += [ "--so-pin", self.__sopin ]
-		cmd += [ "--init-pin" ]
-		self._call(cmd)
+		self.backend.unblock_pin()
 
+	@Instrumentation.operation("explore")
 	def explore(self):
 		if self.__verbose:
 			print("Verify PIN   : verify chv129")
 			print("Change PIN   : change chv129 \"648219\" \"123456\"")
 			print("Change SO-PIN: change chv136 \"3537363231383830\" \"16b72e4528d5063e\"")
 			print("=" * 120)
-		self._call([ "opensc-explorer", "--mf", "aid:E82B0601040181C31F0201" ])
+		self._call([ "opensc-explorer" ] + self._reader_args() + [ "--mf", "aid:E82B0601040181C31F0201" ])
 
+	@Instrumentation.operation("keygen")
 	def keygen(self, key_spec, key_id, key_label = None):
-		cmd = [ "pkcs11-tool", "--module", self._shared_obj("opensc-pkcs11.so"), "--login" ]
-		if self.__pin is not None:
-			cmd += [ "--pin", self.__pin ]
-		cmd += [ "--keypairgen", "--key-type", key_spec, "--id", "%x" % (key_id) ]
-		if key_label is not None:
-			cmd += [ "--label", key_label ]
-		self._call(cmd)
+		self.backend.keygen(key_spec, key_id, key_label = key_label)
+		self._invalidate_inventory()
+
+	@Instrumentation.operation("keygens")
+	def keygens(self, key_spec, key_ids, key_label = None, key_format = None, csr_subject = None, hashfnc = "sha256"):
+		# Generates one keypair per key ID in one session and yields a
+		# GeneratedKey for each as soon as it is done. A "{id}" in the label or
+		# CSR subject is replaced by the hex key ID. All card operations are
+		# issued from this thread, one after another; the host-side work for a
+		# key (parsing and formatting the public key, assembling its CSR) runs
+		# on a helper thread while the card already generates the next key.
+		def prepare(key_id, key_label, pubkey_der):
+			pubkey = PublicKey.from_der(pubkey_der)
+			formatted = None if (key_format is None) else self._format_pubkey(pubkey_der, key_format, key_id = key_id, key_label = key_label, comment = True)
+			if csr_subject is None:
+				return (pubkey, formatted, None, None)
+			builder = X509Builder(pubkey, None, hashfnc = hashfnc)
+			csr_info = builder.csr_info(csr_subject.replace("{id}", "%02x" % (key_id)))
+			return (pubkey, formatted, builder, csr_info)
+
+		def finish(key_id, key_label, future):
+			(pubkey, formatted, builder, csr_info) = future.result()
+			csr = None
+			if builder is not None:
+				mechanism = "pkcs1" if (pubkey.key_type == "rsa") else "ecdsa"
+				signature = list(self.sign([ builder.digest(csr_info) ], key_id = key_id, hashfnc = hashfnc, mechanism = mechanism))[0]
+				csr = PEM.encode(builder.signed(csr_info, signature), "CERTIFICATE REQUEST")
+			return self.GeneratedKey(key_id = key_id, key_label = key_label, pubkey = formatted, csr = csr)
+
+		in_session = self.backend.in_session
+		self.backend.open_session()
+		try:
+			with concurrent.futures.ThreadPoolExecutor(max_workers = 1) as executor:
+				pending = None
+				for key_id in key_ids:
+					label = None if (key_label is None) else key_label.replace("{id}", "%02x" % (key_id))
+					self.backend.keygen(key_spec, key_id, key_label = label)
+					if pending is not None:
+						yield finish(*pending)
+						pending = None
+					if (key_format is not None) or (csr_subject is not None):
+						pubkey_der = self.backend.read_pubkey(key_id)
+						pending = (key_id, label, executor.submit(prepare, key_id, label, pubkey_der))
+					else:
+						yield self.GeneratedKey(key_id = key_id, key_label = label, pubkey = None, csr = None)
+				if pending is not None:
+					yield finish(*pending)
+		finally:
+			self._invalidate_inventory()
+			if not in_session:
+				self.backend.close_session()
 
-	def _print_pubkey_derfile(self, derfile_name, silent = False):
-		for (openssl_cmd, name) in [ ("rsa", "RSA"), ("ec", "ECC") ]:
+	def _format_pubkey(self, pubkey_der, key_format, key_id = None, key_label = None, comment = False):
+		pubkey = PublicKey.from_der(pubkey_der)
+		if key_format == "json":
+			try:
+				ssh_key = pubkey.to_ssh().rstrip("\n")
+			except Exception:
+				ssh_key = None
+			return json.dumps({
+				"id":			None if (key_id is None) else "%02x" % (key_id),
+				"label":		key_label,
+				"type":			pubkey.type_name,
+				"bits":			pubkey.bits,
+				"curve":		None if (pubkey.curve is None) else pubkey.curve.name,
+				"pem":			pubkey.to_pem(),
+				"ssh":			ssh_key,
+			}) + "\n"
+		elif key_format == "pem":
+			description = pubkey.type_name
+			if comment:
+				description += ", ID %s" % ("-" if (key_id is None) else "%02x" % (key_id))
+				if key_label is not None:
+					description += ", label %s" % (key_label)
+			return "# %s key:\n%s" % (description, pubkey.to_pem())
+		elif (key_format == "ssh") and comment:
+			# When listing all keys, unrepresentable keys must not abort the
+			# whole listing; they are emitted as an authorized_keys comment.
 			try:
-				pem_pubkey = subprocess.check_output([ "openssl", openssl_cmd, "-pubin", "-inform", "der", "-in", derfile_name ], stderr = subprocess.DEVNULL)
-				if not silent:
-					print("# %s key:" % (name))
-					print(pem_pubkey.decode().rstrip("\r\n"))
-				return pem_pubkey
-			except subprocess.CalledProcessError:
-				pass
-		raise Exception("Could not successfully decode DER-encoded public key in '%s'." % (derfile_name))
-
-	def _print_sshkey_derfile(self, derfile_name):
-		pubkey_pem = self._print_pubkey_derfile(derfile_name, silent = True)
-		with tempfile.NamedTemporaryFile("wb", prefix = "pubkey_", suffix = ".pem") as f:
-			f.write(pubkey_pem)
-			f.flush()
-			self._call([ "ssh-keygen", "-i", "-m", "PKCS8", "-f", f.name ])
-
-	def getpubkey(self, key_id, key_label = None, key_format = None):
+				ssh_key = pubkey.to_ssh().rstrip("\n")
+			except Exception as e:
+				return "# ID %s: %s\n" % ("-" if (key_id is None) else "%02x" % (key_id), str(e))
+			return "%s %s\n" % (ssh_key, key_label or ("key-%02x" % (key_id or 0)))
+		else:
+			return pubkey.format(key_format)
+
+	@Instrumentation.operation("getpubkey")
+	def getpubkey(self, key_id, key_label = None, key_format = None, silent = False):
 		assert((key_id is None) ^ (key_label is None))
-		assert(key_format in [ "pem", "ssh" ])
-		with tempfile.NamedTemporaryFile(prefix = "pubkey_", suffix = ".der") as pubkey_derfile:
-			cmd = [ "pkcs11-tool", "--module", self._shared_obj("opensc-pkcs11.so"), "--login" ]
-			if self.__pin is not None:
-				cmd += [ "--pin", self.__pin ]
-			if key_id is not None:
-				cmd += [ "--id", "%x" % (key_id) ]
-			if key_label is not None:
-				cmd += [ "--label", key_label ]
-			cmd += [ "--read-object", "--type", "pubkey" ]
-			cmd += [ "--output-file", pubkey_derfile.name ]
-			self._call(cmd)
-			if key_format == "pem":
-				self._print_pubkey_derfile(pubkey_derfile.name)
-			elif key_format == "ssh":
-				self._print_sshkey_derfile(pubkey_derfile.name)
-			else:
-				raise Exception(NotImplemented)
+		assert(key_format in [ "pem", "ssh", "jwk", "json" ])
+		pubkey_der = self.backend.read_pubkey(key_id, key_label = key_label)
+		formatted_key = self._format_pubkey(pubkey_der, key_format, key_id = key_id, key_label = key_label)
+		if not silent:
+			print(formatted_key.rstrip("\r\n"))
+		return formatted_key
+
+	@Instrumentation.operation("getallpubkeys")
+	def getallpubkeys(self, key_format = "pem", silent = False):
+		# Keys are printed as soon as they have been read from the card
+		assert(key_format in [ "pem", "ssh", "jwk", "json" ])
+		formatted_keys = [ ]
+		for (key_id, key_label, pubkey_der) in self.backend.list_pubkeys():
+			formatted_key = self._format_pubkey(pubkey_der, key_format, key_id = key_id, key_label = key_label, comment = True)
+			if not silent:
+				print(formatted_key.rstrip("\r\n"), flush = True)
+			formatted_keys.append(formatted_key)
+		return formatted_keys
 
+	@Instrumentation.operation("removekey")
 	def removekey(self, key_id, key_label = None):
 		assert((key_id is None) ^ (key_label is None))
-		cmd = [ "pkcs11-tool", "--module", self._shared_obj("opensc-pkcs11.so"), "--login" ]
-		if self.__pin is not None:
-			cmd += [ "--pin", self.__pin ]
-		if key_id is not None:
-			cmd += [ "--id", "%x" % (key_id) ]
-		if key_label is not None:
-			cmd += [ "--label", key_label ]
-		cmd += [ "--delete-object", "--type", "privkey" ]
-		self._call(cmd)
+		self.backend.removekey(key_id, key_label = key_label)
+		self._invalidate_inventory()
 
+	@Instrumentation.operation("check_engine")
 	def check_engine(self):
 		cmd = [ "openssl", "engine" ]
 		cmd += [ "-tt" ]
@@ -180,95 +461,205 @@ class HardwareSecurityModule(object):
 		cmd += [ "dynamic" ]
 		self._call(cmd)
 
-	def _execute_openssl_engine(self, user_openssl_cmd):
-		openssl_cmds = [ ]
+	def _openssl_engine_cmd(self):
 		openssl_cmd = [ "engine" ]
 		openssl_cmd += [ "-tt" ]
 		openssl_cmd += [ "-pre", "SO_PATH:%s" % (self._shared_obj("libpkcs11.so")) ]
 		openssl_cmd += [ "-pre", "ID:pkcs11" ]
 		openssl_cmd += [ "-pre", "LIST_ADD:1" ]
 		openssl_cmd += [ "-pre", "LOAD" ]
-		if self.__pin is not None:
-			openssl_cmd += [ "-pre", "PIN:%s" % (self.__pin) ]
+		pin = self._credential("pin")
+		if pin is not None:
+			openssl_cmd += [ "-pre", "PIN:%s" % (pin) ]
 		openssl_cmd += [ "-pre", "MODULE_PATH:%s" % (self._shared_obj("opensc-pkcs11.so")) ]
 		openssl_cmd += [ "dynamic" ]
-		openssl_cmds.append(openssl_cmd)
-		openssl_cmds.append(user_openssl_cmd)
+		return openssl_cmd
 
+	def _openssl_shell(self):
+		# Within a "with" block, one openssl shell with the engine loaded (and
+		# logged in) is kept and reused for all following commands.
+		if (self.__openssl_shell is None) and self.__in_context and self.__openssl_shell_available:
+			shell = OpenSSLShell(verbose = self.__verbose)
+			shell.start()
+			try:
+				shell.execute(self._openssl_engine_cmd())
+			except OpenSSLShellUnavailableException as e:
+				if self.__verbose:
+					print("Cannot keep an openssl shell open, running one openssl process per command: %s" % (str(e)))
+				self.__openssl_shell_available = False
+				shell.close()
+				return None
+			except Exception:
+				shell.close()
+				raise
+			self.__openssl_shell = shell
+		return self.__openssl_shell
+
+	def _execute_openssl_engine(self, user_openssl_cmd):
+		shell = self._openssl_shell()
+		if shell is not None:
+			try:
+				return shell.execute(user_openssl_cmd).encode()
+			except OpenSSLShellUnavailableException:
+				# Shell died; retry this and run all further commands one-shot
+				self.__openssl_shell_available = False
+				self.__openssl_shell = None
+				shell.close()
+
+		openssl_cmds = [ self._openssl_engine_cmd(), user_openssl_cmd ]
 		openssl_cmds_str = "\n".join(CmdTools.cmdline(cmd) for cmd in openssl_cmds)
 		if self.__verbose:
 			print("OpenSSL command lines:")
-			print(openssl_cmds_str)
+			print("\n".join(CmdTools.cmdline(CmdTools.redacted(cmd)) for cmd in openssl_cmds))
 		openssl_cmds = openssl_cmds_str.encode() + b"\n"
 
-		output = subprocess.check_output([ "openssl" ], input = openssl_cmds)
+		output = Instrumentation.spawn([ "openssl" ], input = openssl_cmds, capture = True).stdout
 		return output
 
 	def _print_csr(self, pem_bytes):
-		output = subprocess.check_output([ "openssl", "req", "-text" ], input = pem_bytes)
+		output = Instrumentation.spawn([ "openssl", "req", "-text" ], input = pem_bytes, capture = True).stdout
 		print(output.decode().rstrip("\r\n"))
 
-	def _gencsr_crt(self, key_id, subject, validity_days = None, hashfnc = None):
-		with tempfile.NamedTemporaryFile(prefix = "csr_crt_", suffix = ".pem") as temp_csr_crt:
+	def _gencsr_crt_native(self, key_id, subject, validity_days = None, hashfnc = None):
+		# Everything but the signature is assembled in-process
+		pubkey = PublicKey.from_der(self.backend.read_pubkey(key_id))
+		mechanism = "pkcs1" if (pubkey.key_type == "rsa") else "ecdsa"
+		hashfnc = hashfnc or "sha256"
+		def sign_digest(digest):
+			return list(self.sign([ digest ], key_id = key_id, hashfnc = hashfnc, mechanism = mechanism))[0]
+		builder = X509Builder(pubkey, sign_digest, hashfnc = hashfnc)
+		if validity_days is None:
+			return builder.csr(subject)
+		return builder.self_signed_certificate(subject, validity_days = validity_days)
+
+	def _gencsr_crt(self, key_id, subject, validity_days = None, hashfnc = None, silent = False, builder = "native"):
+		assert(builder in [ "native", "openssl" ])
+		if builder == "native":
+			pem_data = self._gencsr_crt_native(key_id, subject, validity_days = validity_days, hashfnc = hashfnc)
+			if not silent:
+				print(pem_data.rstrip("\r\n"))
+			return pem_data
+
+		with MemoryFile("csr_crt") as temp_csr_crt:
 			openssl_cmd = [ "req", "-new" ]
 			openssl_cmd += [ "-keyform", "engine", "-engine", "pkcs11" ]
-			openssl_cmd += [ "-key", "0:%d" % (key_id) ]
+			openssl_cmd += [ "-key", "%d:%d" % (self.backend.slot, key_id) ]
 			if validity_days is not None:
 				openssl_cmd += [ "-x509", "-days", str(validity_days) ]
 			if hashfnc is not None:
 				openssl_cmd += [ "-%s" % (hashfnc) ]
 			openssl_cmd += [ "-subj", subject ]
-			openssl_cmd += [ "-out", temp_csr_crt.name ]
+			openssl_cmd += [ "-out", temp_csr_crt.path ]
 			if self.__verbose:
 				openssl_cmd += [ "-text" ]
 			output = self._execute_openssl_engine(openssl_cmd)
-			with open(temp_csr_crt.name) as f:
-				print(f.read().rstrip("\r\n"))
+			pem_data = temp_csr_crt.read().decode()
+			if not silent:
+				print(pem_data.rstrip("\r\n"))
+			return pem_data
+
+	@Instrumentation.operation("gencsr")
+	def gencsr(self, key_id, subject = "/CN=HardwareSecurityModule Example", silent = False, builder = "native"):
+		return self._gencsr_crt(key_id = key_id, subject = subject, silent = silent, builder = builder)
 
-	def gencsr(self, key_id, subject = "/CN=HardwareSecurityModule Example"):
-		return self._gencsr_crt(key_id = key_id, subject = subject)
+	@Instrumentation.operation("gencrt")
+	def gencrt(self, key_id, subject = "/CN=HardwareSecurityModule Example", validity_days = 365, hashfnc = "sha256", silent = False, builder = "native"):
+		return self._gencsr_crt(key_id = key_id, subject = subject, validity_days = validity_days, hashfnc = hashfnc, silent = silent, builder = builder)
 
-	def gencrt(self, key_id, subject = "/CN=HardwareSecurityModule Example", validity_days = 365, hashfnc = "sha256"):
-		return self._gencsr_crt(key_id = key_id, subject = subject, validity_days = validity_days, hashfnc = hashfnc)
+	@Instrumentation.operation("sign")
+	def sign(self, digests, key_id = None, key_label = None, hashfnc = "sha256", mechanism = "auto", signature_format = "der"):
+		# Signs an iterable of digests (computed with hashfnc) in one session
+		# and yields the signatures as they are created. 'auto' picks PKCS#1
+		# v1.5 for RSA and ECDSA for EC keys. ECDSA signatures are either DER
+		# encoded (like OpenSSL does) or raw r || s (like JWS does).
+		assert(hashfnc in self._HASH_OIDS)
+		assert(mechanism in self._SIGN_MECHANISMS)
+		assert(signature_format in [ "der", "raw" ])
+		if mechanism == "auto":
+			pubkey = PublicKey.from_der(self.backend.read_pubkey(key_id, key_label = key_label))
+			mechanism = "pkcs1" if (pubkey.key_type == "rsa") else "ecdsa"
+		digest_algorithm = DER.sequence(DER.oid(self._HASH_OIDS[hashfnc]), DER.null())
 
+		def prepare(digests):
+			for digest in digests:
+				if mechanism == "pkcs1":
+					yield DER.sequence(digest_algorithm, DER.octetstring(digest))
+				else:
+					yield digest
+
+		backend_mechanism = { "pkcs1": "rsa-pkcs", "pss": "rsa-pss", "ecdsa": "ecdsa" }[mechanism]
+		for signature in self.backend.sign(key_id, key_label, backend_mechanism, hashfnc, prepare(digests)):
+			if (mechanism == "ecdsa") and (signature_format == "der"):
+				half = len(signature) // 2
+				signature = DER.sequence(DER.integer(signature[:half]), DER.integer(signature[half:]))
+			yield signature
+
+	@Instrumentation.operation("putcrt")
 	def putcrt(self, crt_derdata, cert_id, cert_label = None):
-		with tempfile.NamedTemporaryFile("wb", prefix = "crt_", suffix= ".der") as crt_tempfile:
-			crt_tempfile.write(crt_derdata)
-			crt_tempfile.flush()
-
-			cmd = [ "pkcs11-tool", "--module", self._shared_obj("opensc-pkcs11.so"), "--login" ]
-			if self.__pin is not None:
-				cmd += [ "--pin", self.__pin ]
-			if cert_id is not None:
-				cmd += [ "--id", "%x" % (cert_id) ]
-			if cert_label is not None:
-				cmd += [ "--label", cert_label ]
-			cmd += [ "--write-object", crt_tempfile.name, "--type", "cert" ]
-			self._call(cmd)
+		self.backend.putcrt(crt_derdata, cert_id, cert_label = cert_label)
+		self._invalidate_inventory()
 
+	@Instrumentation.operation("putcrts")
+	def putcrts(self, certificates, first_id = None, cert_label = None):
+		# Stores multiple certificates in one session. A certificate whose
+		# public key is on the card gets that key's ID and label, all others
+		# get consecutive IDs (from first_id or after the highest key ID on
+		# the card) and their common name as label. A given cert_label is
+		# used for all certificates instead.
+		in_session = self.backend.in_session
+		self.backend.open_session()
+		try:
+			keys = { }
+			for (key_id, key_label, pubkey_der) in self.backend.list_pubkeys():
+				keys[PublicKey.from_der(pubkey_der).der_data] = (key_id, key_label)
+			if first_id is None:
+				first_id = max([ key_id for (key_id, key_label) in keys.values() if key_id is not None ], default = 0) + 1
+			next_id = first_id
+			stored = [ ]
+			for certificate in certificates:
+				matched_key = certificate.pubkey_der in keys
+				if matched_key:
+					(cert_id, label) = keys[certificate.pubkey_der]
+				else:
+					(cert_id, label) = (next_id, certificate.common_name)
+					next_id += 1
+				if cert_label is not None:
+					label = cert_label
+				self.backend.putcrt(certificate.der_data, cert_id, cert_label = label)
+				stored.append(self.StoredCertificate(certificate = certificate, cert_id = cert_id, cert_label = label, matched_key = matched_key))
+			return stored
+		finally:
+			self._invalidate_inventory()
+			if not in_session:
+				self.backend.close_session()
+
+	@Instrumentation.operation("change_pin")
 	def change_pin(self, new_value):
 		assert(new_value is not None)
-		cmd = [ "pkcs11-tool", "--module", self._shared_obj("opensc-pkcs11.so"), "--login" ]
-		if self.__pin is not None:
-			cmd += [ "--pin", self.__pin ]
-		cmd += [ "--change-pin", "--new-pin", str(new_value) ]
-		self._call(cmd)
+		self.backend.change_pin(new_value)
+		self._credential_changed("pin", new_value)
 
+	@Instrumentation.operation("change_sopin")
 	def change_sopin(self, new_value):
 		assert(new_value is not None)
-		cmd = [ "pkcs11-tool", "--module", self._shared_obj("opensc-pkcs11.so"), "--login" ]
-		cmd += [ "--login-type", "so" ]
-		if self.__sopin is not None:
-			cmd += [ "--so-pin", self.__sopin ]
-		cmd += [ "--change-pin", "--new-pin", str(new_value) ]
-		self._call(cmd)
+		self.backend.change_sopin(new_value)
+		self._credential_changed("sopin", new_value)
 
+	@Instrumentation.operation("format")
 	def format(self):
 		assert(self.__sopin is not None)
 		if not self.login(with_sopin = True):
 			raise Exception("Login with SO-PIN failed. Cannot format smartcard.")
-		cmd = [ "sc-hsm-tool", "--initialize", "--so-pin", self.__sopin, "--pin", self._INITIAL_PIN ]
+		# Reinitializing the card invalidates all open sessions
+		in_session = self.backend.in_session
+		self.backend.close_session()
+		cmd = [ "sc-hsm-tool" ] + self._reader_args() + [ "--initialize", "--so-pin", self.__sopin, "--pin", self._INITIAL_PIN ]
 		self._call(cmd)
+		self._invalidate_identification()
+		self._invalidate_inventory()
+		self._credential_changed("pin", self._INITIAL_PIN)
+		if in_session:
+			self.backend.open_session()
 		if self.__sopin != self._INITIAL_SOPIN:
 			self.change_sopin(self._INITIAL_SOPIN)
 		print("Smartcard successfully formatted. New SO-PIN: %s and PIN: %s" % (self._INITIAL_SOPIN, self._INITIAL_PIN))
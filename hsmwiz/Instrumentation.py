@@ -0,0 +1,251 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import sys
+import json
+import time
+import resource
+import inspect
+import tempfile
+import functools
+import threading
+import subprocess
+import collections
+
+# Optional instrumentation of card operations and spawned processes. Every
+# operation (e.g., keygen) and every process spawned while it runs produces a
+# Record that is passed to all registered listeners. Without listeners,
+# operations and processes run without any bookkeeping. Child CPU time is
+# taken from the process-wide children rusage, so processes that are spawned
+# concurrently from multiple threads may be attributed to each other.
+class Instrumentation():
+	Record = collections.namedtuple("Record", [ "kind", "operation", "program", "wall_time", "child_cpu_time", "exit_status", "spawns", "bytes_in", "bytes_out" ])
+	_listeners = [ ]
+	_listeners_lock = threading.Lock()
+	_current = threading.local()
+
+	@classmethod
+	def add_listener(cls, listener):
+		with cls._listeners_lock:
+			cls._listeners = cls._listeners + [ listener ]
+
+	@classmethod
+	def remove_listener(cls, listener):
+		with cls._listeners_lock:
+			cls._listeners = [ registered for registered in cls._listeners if registered is not listener ]
+
+	@classmethod
+	def enabled(cls):
+		return len(cls._listeners) > 0
+
+	@classmethod
+	def _emit(cls, record):
+		for listener in cls._listeners:
+			listener(record)
+
+	@staticmethod
+	def _child_cpu_time():
+		usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+		return usage.ru_utime + usage.ru_stime
+
+	@classmethod
+	def _stack(cls):
+		if not hasattr(cls._current, "stack"):
+			cls._current.stack = [ ]
+		return cls._current.stack
+
+	@classmethod
+	def _begin(cls, name):
+		# Spawns are accounted to all operations that are currently running
+		entry = (name, { "spawns": 0, "bytes_in": 0, "bytes_out": 0 })
+		cls._stack().append(entry)
+		return (entry, time.perf_counter(), cls._child_cpu_time())
+
+	@classmethod
+	def _remove(cls, entry):
+		# By identity: with suspended generators, entries are not necessarily
+		# removed in the order they were added
+		stack = cls._stack()
+		for (index, other) in enumerate(stack):
+			if other is entry:
+				del stack[index]
+				return
+
+	@classmethod
+	def _end(cls, name, state, exit_status):
+		(entry, t0, cpu0) = state
+		cls._remove(entry)
+		cls._emit(cls.Record(kind = "operation", operation = name, program = None, wall_time = time.perf_counter() - t0, child_cpu_time = cls._child_cpu_time() - cpu0, exit_status = exit_status, **entry[1]))
+
+	@classmethod
+	def operation(cls, name):
+		# Decorator for operations; generator functions are measured until
+		# they are exhausted (or closed).
+		def decorator(function):
+			if inspect.isgeneratorfunction(function):
+				@functools.wraps(function)
+				def wrapper(*args, **kwargs):
+					if not cls.enabled():
+						yield from function(*args, **kwargs)
+						return
+					state = cls._begin(name)
+					exit_status = 1
+					generator = function(*args, **kwargs)
+					try:
+						value = None
+						while True:
+							try:
+								item = generator.send(value)
+							except StopIteration as e:
+								result = e.value
+								break
+							# While suspended, spawns belong to whatever
+							# runs in the meantime, not to this operation
+							cls._remove(state[0])
+							try:
+								value = yield item
+							finally:
+								cls._stack().append(state[0])
+						exit_status = 0
+						return result
+					finally:
+						generator.close()
+						cls._end(name, state, exit_status)
+			else:
+				@functools.wraps(function)
+				def wrapper(*args, **kwargs):
+					if not cls.enabled():
+						return function(*args, **kwargs)
+					state = cls._begin(name)
+					exit_status = 1
+					try:
+						result = function(*args, **kwargs)
+						exit_status = 0
+						return result
+					finally:
+						cls._end(name, state, exit_status)
+			return wrapper
+		return decorator
+
+	@classmethod
+	def _account_spawn(cls, program, wall_time, child_cpu_time, exit_status, bytes_in, bytes_out):
+		stack = cls._stack()
+		for (name, totals) in stack:
+			totals["spawns"] += 1
+			totals["bytes_in"] += bytes_in
+			totals["bytes_out"] += bytes_out or 0
+		operation = stack[-1][0] if (len(stack) > 0) else None
+		cls._emit(cls.Record(kind = "spawn", operation = operation, program = program, wall_time = wall_time, child_cpu_time = child_cpu_time, exit_status = exit_status, spawns = 1, bytes_in = bytes_in, bytes_out = bytes_out))
+
+	@classmethod
+	def popen(cls, cmd, **kwargs):
+		# For long-running processes only the spawn itself is recorded, with
+		# an unknown exit status and the time it took to start the process
+		t0 = time.perf_counter()
+		proc = subprocess.Popen(cmd, **kwargs)
+		if cls.enabled():
+			cls._account_spawn(os.path.basename(cmd[0]), time.perf_counter() - t0, 0, None, 0, None)
+		return proc
+
+	@classmethod
+	def spawn(cls, cmd, input = None, capture = False, stderr = None, check = True):
+		# Runs cmd like subprocess.run() and returns the CompletedProcess.
+		# Raises CalledProcessError on a non-zero exit status if check is set.
+		stdout = subprocess.PIPE if capture else None
+		if not cls.enabled():
+			result = subprocess.run(cmd, input = input, stdout = stdout, stderr = stderr)
+		else:
+			cpu0 = cls._child_cpu_time()
+			t0 = time.perf_counter()
+			result = subprocess.run(cmd, input = input, stdout = stdout, stderr = stderr)
+			wall_time = time.perf_counter() - t0
+			bytes_in = 0 if (input is None) else len(input)
+			bytes_out = None if (result.stdout is None) else len(result.stdout)
+			cls._account_spawn(os.path.basename(cmd[0]), wall_time, cls._child_cpu_time() - cpu0, result.returncode, bytes_in, bytes_out)
+		if check and (result.returncode != 0):
+			raise subprocess.CalledProcessError(result.returncode, cmd, output = result.stdout, stderr = result.stderr)
+		return result
+
+# Listener that writes every record as one JSON object per line
+class JSONLinesExporter():
+	def __init__(self, f):
+		self._f = f
+		self._lock = threading.Lock()
+
+	def __call__(self, record):
+		with self._lock:
+			print(json.dumps(record._asdict()), file = self._f, flush = True)
+
+# Listener that aggregates records per operation and per spawned program and
+# renders them as a table or as a Prometheus textfile.
+class InstrumentationSummary():
+	Entry = collections.namedtuple("Entry", [ "kind", "name", "count", "failures", "wall_time", "max_wall_time", "child_cpu_time", "spawns", "bytes_in", "bytes_out" ])
+
+	def __init__(self):
+		self._entries = { }
+		self._lock = threading.Lock()
+
+	def __call__(self, record):
+		key = (record.kind, record.operation if (record.kind == "operation") else record.program)
+		with self._lock:
+			entry = self._entries.get(key, self.Entry(kind = key[0], name = key[1], count = 0, failures = 0, wall_time = 0, max_wall_time = 0, child_cpu_time = 0, spawns = 0, bytes_in = 0, bytes_out = 0))
+			self._entries[key] = entry._replace(count = entry.count + 1, failures = entry.failures + (record.exit_status not in (0, None)), wall_time = entry.wall_time + record.wall_time,
+					max_wall_time = max(entry.max_wall_time, record.wall_time), child_cpu_time = entry.child_cpu_time + record.child_cpu_time,
+					spawns = entry.spawns + record.spawns, bytes_in = entry.bytes_in + record.bytes_in, bytes_out = entry.bytes_out + (record.bytes_out or 0))
+
+	@property
+	def entries(self):
+		with self._lock:
+			return sorted(self._entries.values(), key = lambda entry: (entry.kind != "operation", -entry.wall_time))
+
+	def print_table(self, f = sys.stderr):
+		print("%-9s %-14s %6s %6s %10s %10s %10s %10s %7s %9s %9s" % ("kind", "name", "count", "failed", "total/ms", "avg/ms", "max/ms", "cpu/ms", "spawns", "bytes in", "bytes out"), file = f)
+		for entry in self.entries:
+			print("%-9s %-14s %6d %6d %10.1f %10.1f %10.1f %10.1f %7d %9d %9d" % (entry.kind, entry.name, entry.count, entry.failures, entry.wall_time * 1000, entry.wall_time / entry.count * 1000,
+					entry.max_wall_time * 1000, entry.child_cpu_time * 1000, entry.spawns, entry.bytes_in, entry.bytes_out), file = f)
+
+	def write_prometheus(self, filename):
+		# Written atomically so that the node exporter never sees a partial file
+		metrics = [
+			("count", "total", "Number of operations or spawned processes"),
+			("failures", "failures_total", "Number of failed operations or processes with a non-zero exit status"),
+			("wall_time", "seconds_total", "Wall time spent"),
+			("child_cpu_time", "child_cpu_seconds_total", "CPU time used by child processes"),
+			("spawns", "spawns_total", "Number of spawned processes"),
+			("bytes_in", "bytes_in_total", "Bytes passed to child processes on stdin"),
+			("bytes_out", "bytes_out_total", "Bytes read from the stdout of child processes"),
+		]
+		lines = [ ]
+		entries = self.entries
+		for (kind, label) in (("operation", "operation"), ("spawn", "program")):
+			for (field, suffix, description) in metrics:
+				name = "hsmwiz_%s_%s" % (kind, suffix)
+				lines.append("# HELP %s %s." % (name, description))
+				lines.append("# TYPE %s counter" % (name))
+				for entry in entries:
+					if entry.kind == kind:
+						lines.append("%s{%s=\"%s\"} %s" % (name, label, entry.name, getattr(entry, field)))
+		(fd, tmpname) = tempfile.mkstemp(prefix = ".hsmwiz_", suffix = ".prom", dir = os.path.dirname(os.path.abspath(filename)))
+		with os.fdopen(fd, "w") as f:
+			f.write("\n".join(lines) + "\n")
+		os.chmod(tmpname, 0o644)
+		os.replace(tmpname, filename)
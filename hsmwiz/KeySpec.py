@@ -0,0 +1,114 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import collections
+
+class KeySpec():
+	Curve = collections.namedtuple("Curve", [ "name", "oid", "bits", "ssh_name" ])
+	_CURVES = [
+		Curve(name = "prime192v1", oid = "1.2.840.10045.3.1.1", bits = 192, ssh_name = None),
+		Curve(name = "secp224r1", oid = "1.3.132.0.33", bits = 224, ssh_name = None),
+		Curve(name = "prime256v1", oid = "1.2.840.10045.3.1.7", bits = 256, ssh_name = "nistp256"),
+		Curve(name = "secp384r1", oid = "1.3.132.0.34", bits = 384, ssh_name = "nistp384"),
+		Curve(name = "secp521r1", oid = "1.3.132.0.35", bits = 521, ssh_name = "nistp521"),
+		Curve(name = "secp256k1", oid = "1.3.132.0.10", bits = 256, ssh_name = None),
+		Curve(name = "brainpoolP192r1", oid = "1.3.36.3.3.2.8.1.1.3", bits = 192, ssh_name = None),
+		Curve(name = "brainpoolP224r1", oid = "1.3.36.3.3.2.8.1.1.5", bits = 224, ssh_name = None),
+		Curve(name = "brainpoolP256r1", oid = "1.3.36.3.3.2.8.1.1.7", bits = 256, ssh_name = None),
+		Curve(name = "brainpoolP320r1", oid = "1.3.36.3.3.2.8.1.1.9", bits = 320, ssh_name = None),
+		Curve(name = "brainpoolP384r1", oid = "1.3.36.3.3.2.8.1.1.11", bits = 384, ssh_name = None),
+		Curve(name = "brainpoolP512r1", oid = "1.3.36.3.3.2.8.1.1.13", bits = 512, ssh_name = None),
+	]
+	_CURVE_ALIASES = {
+		"secp192r1":		"prime192v1",
+		"secp256r1":		"prime256v1",
+		"ansiX9p256r1":		"prime256v1",
+		"prime384v1":		"secp384r1",
+		"nistp256":			"prime256v1",
+		"nistp384":			"secp384r1",
+		"nistp521":			"secp521r1",
+		# OpenSC-style names of the brainpool curves
+		"brainpool192r1":	"brainpoolP192r1",
+		"brainpool224r1":	"brainpoolP224r1",
+		"brainpool256r1":	"brainpoolP256r1",
+		"brainpool320r1":	"brainpoolP320r1",
+		"brainpool384r1":	"brainpoolP384r1",
+		"brainpool512r1":	"brainpoolP512r1",
+	}
+	_CURVES_BY_NAME = { curve.name.lower(): curve for curve in _CURVES }
+	_CURVES_BY_OID = { curve.oid: curve for curve in _CURVES }
+
+	def __init__(self, key_type, bits = None, curve = None):
+		assert(key_type in [ "rsa", "ec" ])
+		self._key_type = key_type
+		self._bits = bits
+		self._curve = curve
+
+	@classmethod
+	def parse(cls, key_spec):
+		# Same syntax that pkcs11-tool accepts, i.e., "rsa:2048" or
+		# "EC:prime256v1".
+		if ":" not in key_spec:
+			raise Exception("Invalid key specification '%s', expected 'rsa:BITLENGTH' or 'EC:CURVENAME'." % (key_spec))
+		(key_type, parameter) = key_spec.split(":", maxsplit = 1)
+		key_type = key_type.lower()
+		if key_type == "rsa":
+			try:
+				bits = int(parameter)
+			except ValueError:
+				raise Exception("Invalid RSA bit length '%s' in key specification." % (parameter))
+			return cls("rsa", bits = bits)
+		elif key_type == "ec":
+			return cls("ec", curve = cls.get_curve_by_name(parameter))
+		else:
+			raise Exception("Unsupported key type '%s' in key specification '%s'." % (key_type, key_spec))
+
+	@classmethod
+	def get_curve_by_name(cls, name):
+		name = cls._CURVE_ALIASES.get(name, name)
+		curve = cls._CURVES_BY_NAME.get(name.lower())
+		if curve is None:
+			raise Exception("Unknown elliptic curve '%s'. Known curves: %s" % (name, ", ".join(curve.name for curve in cls._CURVES)))
+		return curve
+
+	@classmethod
+	def get_curve_by_oid(cls, oid):
+		return cls._CURVES_BY_OID.get(oid)
+
+	@property
+	def key_type(self):
+		return self._key_type
+
+	@property
+	def bits(self):
+		if self._key_type == "rsa":
+			return self._bits
+		else:
+			return self._curve.bits
+
+	@property
+	def curve(self):
+		return self._curve
+
+	def __str__(self):
+		if self._key_type == "rsa":
+			return "rsa:%d" % (self._bits)
+		else:
+			return "EC:%s" % (self._curve.name)
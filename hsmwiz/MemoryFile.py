@@ -0,0 +1,71 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import tempfile
+
+# A file that only lives in memory, for tools that insist on being passed a
+# filename. Uses an anonymous memfd where available (child processes open it
+# through /proc) and falls back to a file in /dev/shm otherwise.
+class MemoryFile():
+	def __init__(self, name, data = None):
+		self._name = name
+		self._fd = None
+		self._tmpname = None
+		self._path = None
+		self._data = data
+
+	def __enter__(self):
+		if hasattr(os, "memfd_create") and os.path.isdir("/proc/self/fd"):
+			self._fd = os.memfd_create(self._name)
+			self._path = "/proc/%d/fd/%d" % (os.getpid(), self._fd)
+		else:
+			(self._fd, self._tmpname) = tempfile.mkstemp(prefix = self._name + "_", dir = "/dev/shm" if os.path.isdir("/dev/shm") else None)
+			self._path = self._tmpname
+		if self._data is not None:
+			self.write(self._data)
+		return self
+
+	def __exit__(self, *args):
+		os.close(self._fd)
+		if self._tmpname is not None:
+			os.unlink(self._tmpname)
+
+	@property
+	def path(self):
+		return self._path
+
+	def write(self, data):
+		os.lseek(self._fd, 0, os.SEEK_SET)
+		os.ftruncate(self._fd, 0)
+		while len(data) > 0:
+			data = data[os.write(self._fd, data) : ]
+
+	def read(self):
+		# The child may have truncated and rewritten the file through its own
+		# file description, so always read from the very beginning.
+		os.lseek(self._fd, 0, os.SEEK_SET)
+		chunks = [ ]
+		while True:
+			chunk = os.read(self._fd, 65536)
+			if len(chunk) == 0:
+				break
+			chunks.append(chunk)
+		return b"".join(chunks)
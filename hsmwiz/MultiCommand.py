@@ -26,6 +26,7 @@
 import sys
 import collections
 import textwrap
+import importlib
 
 from .FriendlyArgumentParser import FriendlyArgumentParser
 from .PrefixMatcher import PrefixMatcher
@@ -113,11 +114,21 @@ class MultiCommand():
 		args = parser.parse_args(cmdline[1:])
 		return self.ParseResult(command, args)
 
+	@staticmethod
+	def _import_action(name):
+		# Actions can be given as "module:attribute" so that only the module
+		# of the command that is actually run needs to be imported
+		(module_name, _, attribute) = name.partition(":")
+		return getattr(importlib.import_module(module_name), attribute)
+
 	def run(self, cmdline, silent = False):
 		parseresult = self.parse(cmdline, silent)
 		if parseresult.cmd.action is None:
 			raise Exception("Should run command '%s', but no action was registered." % (parseresult.cmd.name))
-		parseresult.cmd.action(parseresult.cmd.name, parseresult.args)
+		action = parseresult.cmd.action
+		if isinstance(action, str):
+			action = self._import_action(action)
+		action(parseresult.cmd.name, parseresult.args)
 
 if __name__ == "__main__":
 	mc = MultiCommand()
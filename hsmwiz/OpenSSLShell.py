@@ -0,0 +1,88 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import subprocess
+from .CmdTools import CmdTools
+from .Instrumentation import Instrumentation
+
+class OpenSSLShellUnavailableException(Exception): pass
+
+# Long-running interactive "openssl" shell that is fed one command at a time
+# over stdin. Commands are separated by an invalid marker command; the shell
+# answers it with "error in <marker>" on stderr, which tells us that the
+# previous command has finished and which stderr output belongs to it.
+# OpenSSL 3 no longer has an interactive mode; this is reported as
+# OpenSSLShellUnavailableException so that callers can fall back to running
+# one openssl process per command.
+class OpenSSLShell():
+	def __init__(self, verbose = False):
+		self._verbose = verbose
+		self._proc = None
+		self._sequence = 0
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def start(self):
+		self._proc = Instrumentation.popen([ "openssl" ], stdin = subprocess.PIPE, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+
+	def execute(self, cmd):
+		# Runs one command and returns everything it wrote to stderr
+		self._sequence += 1
+		marker = "hsmwiz_sync_%d" % (self._sequence)
+		cmdline = CmdTools.cmdline(cmd)
+		if self._verbose:
+			print("OpenSSL shell: %s" % (CmdTools.cmdline(CmdTools.redacted(cmd))))
+		try:
+			self._proc.stdin.write((cmdline + "\n" + marker + "\n").encode())
+			self._proc.stdin.flush()
+		except BrokenPipeError:
+			raise OpenSSLShellUnavailableException("openssl shell has terminated.")
+
+		lines = [ ]
+		while True:
+			line = self._proc.stderr.readline()
+			if line == b"":
+				raise OpenSSLShellUnavailableException("openssl shell has terminated while running '%s'." % (cmd[0]))
+			line = line.decode(errors = "replace")
+			if line.rstrip("\r\n") == "error in %s" % (marker):
+				break
+			lines.append(line)
+		# The last line is the complaint about the invalid marker command
+		output = "".join(line for line in lines if marker not in line)
+		if any(line.rstrip("\r\n") == "error in %s" % (cmd[0]) for line in lines):
+			raise Exception("openssl %s failed: %s" % (cmd[0], output.strip()))
+		return output
+
+	def close(self):
+		if self._proc is None:
+			return
+		try:
+			self._proc.stdin.close()
+		except BrokenPipeError:
+			pass
+		self._proc.stderr.close()
+		self._proc.wait()
+		self._proc = None
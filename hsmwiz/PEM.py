@@ -0,0 +1,56 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import re
+import base64
+
+# Minimal PEM encoding and decoding so that certificates and keys can be
+# converted to DER without calling openssl.
+class PEM():
+	_PEM_RE = re.compile(r"-----BEGIN (?P<label>[A-Z0-9 ]+)-----(?P<data>.*?)-----END (?P=label)-----", flags = re.DOTALL)
+
+	@classmethod
+	def decode_all(cls, pem_text, label = None):
+		# Returns the DER data of all blocks in order, optionally restricted to
+		# blocks with the given label (e.g., "CERTIFICATE")
+		if isinstance(pem_text, bytes):
+			pem_text = pem_text.decode("ascii", errors = "replace")
+		blocks = [ ]
+		for match in cls._PEM_RE.finditer(pem_text):
+			if (label is not None) and (match.group("label") != label):
+				continue
+			blocks.append(base64.b64decode("".join(match.group("data").split())))
+		return blocks
+
+	@classmethod
+	def decode(cls, pem_text, label = None):
+		blocks = cls.decode_all(pem_text, label = label)
+		if len(blocks) == 0:
+			raise Exception("No PEM block%s found." % ("" if (label is None) else (" of type %s" % (label))))
+		return blocks[0]
+
+	@classmethod
+	def encode(cls, der_data, label):
+		encoded = base64.b64encode(der_data).decode()
+		lines = [ "-----BEGIN %s-----" % (label) ]
+		lines += [ encoded[i : i + 64] for i in range(0, len(encoded), 64) ]
+		lines += [ "-----END %s-----" % (label) ]
+		return "\n".join(lines) + "\n"
@@ -0,0 +1,430 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import ctypes
+import atexit
+import threading
+
+CK_ULONG = ctypes.c_ulong
+CK_BBOOL = ctypes.c_ubyte
+
+class CK_VERSION(ctypes.Structure):
+	_fields_ = [
+		("major", ctypes.c_ubyte),
+		("minor", ctypes.c_ubyte),
+	]
+
+class CK_C_INITIALIZE_ARGS(ctypes.Structure):
+	_fields_ = [
+		("CreateMutex", ctypes.c_void_p),
+		("DestroyMutex", ctypes.c_void_p),
+		("LockMutex", ctypes.c_void_p),
+		("UnlockMutex", ctypes.c_void_p),
+		("flags", CK_ULONG),
+		("pReserved", ctypes.c_void_p),
+	]
+
+class CK_SLOT_INFO(ctypes.Structure):
+	_fields_ = [
+		("slotDescription", ctypes.c_char * 64),
+		("manufacturerID", ctypes.c_char * 32),
+		("flags", CK_ULONG),
+		("hardwareVersion", CK_VERSION),
+		("firmwareVersion", CK_VERSION),
+	]
+
+class CK_TOKEN_INFO(ctypes.Structure):
+	_fields_ = [
+		("label", ctypes.c_char * 32),
+		("manufacturerID", ctypes.c_char * 32),
+		("model", ctypes.c_char * 16),
+		("serialNumber", ctypes.c_char * 16),
+		("flags", CK_ULONG),
+		("ulMaxSessionCount", CK_ULONG),
+		("ulSessionCount", CK_ULONG),
+		("ulMaxRwSessionCount", CK_ULONG),
+		("ulRwSessionCount", CK_ULONG),
+		("ulMaxPinLen", CK_ULONG),
+		("ulMinPinLen", CK_ULONG),
+		("ulTotalPublicMemory", CK_ULONG),
+		("ulFreePublicMemory", CK_ULONG),
+		("ulTotalPrivateMemory", CK_ULONG),
+		("ulFreePrivateMemory", CK_ULONG),
+		("hardwareVersion", CK_VERSION),
+		("firmwareVersion", CK_VERSION),
+		("utcTime", ctypes.c_char * 16),
+	]
+
+class CK_ATTRIBUTE(ctypes.Structure):
+	_fields_ = [
+		("type", CK_ULONG),
+		("pValue", ctypes.c_void_p),
+		("ulValueLen", CK_ULONG),
+	]
+
+class CK_MECHANISM(ctypes.Structure):
+	_fields_ = [
+		("mechanism", CK_ULONG),
+		("pParameter", ctypes.c_void_p),
+		("ulParameterLen", CK_ULONG),
+	]
+
+class CK_RSA_PKCS_PSS_PARAMS(ctypes.Structure):
+	_fields_ = [
+		("hashAlg", CK_ULONG),
+		("mgf", CK_ULONG),
+		("sLen", CK_ULONG),
+	]
+
+class PKCS11Exception(Exception):
+	_NAMES = {
+		0x002:	"CKR_HOST_MEMORY",
+		0x003:	"CKR_SLOT_ID_INVALID",
+		0x005:	"CKR_GENERAL_ERROR",
+		0x006:	"CKR_FUNCTION_FAILED",
+		0x007:	"CKR_ARGUMENTS_BAD",
+		0x010:	"CKR_ATTRIBUTE_READ_ONLY",
+		0x012:	"CKR_ATTRIBUTE_TYPE_INVALID",
+		0x013:	"CKR_ATTRIBUTE_VALUE_INVALID",
+		0x030:	"CKR_DEVICE_ERROR",
+		0x031:	"CKR_DEVICE_MEMORY",
+		0x032:	"CKR_DEVICE_REMOVED",
+		0x054:	"CKR_FUNCTION_NOT_SUPPORTED",
+		0x060:	"CKR_KEY_HANDLE_INVALID",
+		0x070:	"CKR_MECHANISM_INVALID",
+		0x071:	"CKR_MECHANISM_PARAM_INVALID",
+		0x082:	"CKR_OBJECT_HANDLE_INVALID",
+		0x0a0:	"CKR_PIN_INCORRECT",
+		0x0a1:	"CKR_PIN_INVALID",
+		0x0a2:	"CKR_PIN_LEN_RANGE",
+		0x0a4:	"CKR_PIN_LOCKED",
+		0x0b3:	"CKR_SESSION_HANDLE_INVALID",
+		0x0b5:	"CKR_SESSION_READ_ONLY",
+		0x0d0:	"CKR_TEMPLATE_INCOMPLETE",
+		0x0d1:	"CKR_TEMPLATE_INCONSISTENT",
+		0x0e0:	"CKR_TOKEN_NOT_PRESENT",
+		0x0e1:	"CKR_TOKEN_NOT_RECOGNIZED",
+		0x0e2:	"CKR_TOKEN_WRITE_PROTECTED",
+		0x100:	"CKR_USER_ALREADY_LOGGED_IN",
+		0x101:	"CKR_USER_NOT_LOGGED_IN",
+		0x102:	"CKR_USER_PIN_NOT_INITIALIZED",
+		0x103:	"CKR_USER_TYPE_INVALID",
+		0x150:	"CKR_BUFFER_TOO_SMALL",
+		0x190:	"CKR_CRYPTOKI_NOT_INITIALIZED",
+		0x191:	"CKR_CRYPTOKI_ALREADY_INITIALIZED",
+	}
+
+	def __init__(self, function, rv):
+		self.function = function
+		self.rv = rv
+		Exception.__init__(self, "%s failed: %s (0x%x)" % (function, self._NAMES.get(rv, "unknown error"), rv))
+
+# Thin ctypes wrapper around a PKCS#11 module. Modules are loaded and
+# initialized only once per process and shared among all users, see load().
+class PKCS11Library():
+	CKR_OK = 0x000
+	CKR_ATTRIBUTE_TYPE_INVALID = 0x012
+	CKR_PIN_INCORRECT = 0x0a0
+	CKR_PIN_LOCKED = 0x0a4
+	CKR_USER_ALREADY_LOGGED_IN = 0x100
+	CKR_BUFFER_TOO_SMALL = 0x150
+	CKR_CRYPTOKI_ALREADY_INITIALIZED = 0x191
+
+	CKF_TOKEN_PRESENT = 0x001
+	CKF_RW_SESSION = 0x002
+	CKF_SERIAL_SESSION = 0x004
+	CKF_OS_LOCKING_OK = 0x002
+	CKF_PROTECTED_AUTHENTICATION_PATH = 0x100
+	CKF_TOKEN_INITIALIZED = 0x400
+
+	CKU_SO = 0
+	CKU_USER = 1
+
+	CKO_DATA = 0
+	CKO_CERTIFICATE = 1
+	CKO_PUBLIC_KEY = 2
+	CKO_PRIVATE_KEY = 3
+
+	CKK_RSA = 0
+	CKK_EC = 3
+
+	CKC_X_509 = 0
+
+	CKA_CLASS = 0x000
+	CKA_TOKEN = 0x001
+	CKA_PRIVATE = 0x002
+	CKA_LABEL = 0x003
+	CKA_VALUE = 0x011
+	CKA_CERTIFICATE_TYPE = 0x080
+	CKA_ISSUER = 0x081
+	CKA_SERIAL_NUMBER = 0x082
+	CKA_KEY_TYPE = 0x100
+	CKA_SUBJECT = 0x101
+	CKA_ID = 0x102
+	CKA_SENSITIVE = 0x103
+	CKA_ENCRYPT = 0x104
+	CKA_DECRYPT = 0x105
+	CKA_WRAP = 0x106
+	CKA_UNWRAP = 0x107
+	CKA_SIGN = 0x108
+	CKA_VERIFY = 0x10a
+	CKA_DERIVE = 0x10c
+	CKA_MODULUS = 0x120
+	CKA_MODULUS_BITS = 0x121
+	CKA_PUBLIC_EXPONENT = 0x122
+	CKA_EXTRACTABLE = 0x162
+	CKA_EC_PARAMS = 0x180
+	CKA_EC_POINT = 0x181
+
+	CKM_RSA_PKCS_KEY_PAIR_GEN = 0x0000
+	CKM_EC_KEY_PAIR_GEN = 0x1040
+	CKM_RSA_PKCS = 0x0001
+	CKM_RSA_PKCS_PSS = 0x000d
+	CKM_ECDSA = 0x1041
+	CKM_SHA_1 = 0x0220
+	CKM_SHA224 = 0x0255
+	CKM_SHA256 = 0x0250
+	CKM_SHA384 = 0x0260
+	CKM_SHA512 = 0x0270
+
+	CKG_MGF1_SHA1 = 0x1
+	CKG_MGF1_SHA256 = 0x2
+	CKG_MGF1_SHA384 = 0x3
+	CKG_MGF1_SHA512 = 0x4
+	CKG_MGF1_SHA224 = 0x5
+
+	_CK_UNAVAILABLE_INFORMATION = CK_ULONG(-1).value
+
+	_PROTOTYPES = {
+		"C_Initialize":			(ctypes.c_void_p, ),
+		"C_Finalize":			(ctypes.c_void_p, ),
+		"C_GetSlotList":		(CK_BBOOL, ctypes.POINTER(CK_ULONG), ctypes.POINTER(CK_ULONG)),
+		"C_GetSlotInfo":		(CK_ULONG, ctypes.POINTER(CK_SLOT_INFO)),
+		"C_GetTokenInfo":		(CK_ULONG, ctypes.POINTER(CK_TOKEN_INFO)),
+		"C_OpenSession":		(CK_ULONG, CK_ULONG, ctypes.c_void_p, ctypes.c_void_p, ctypes.POINTER(CK_ULONG)),
+		"C_CloseSession":		(CK_ULONG, ),
+		"C_Login":				(CK_ULONG, CK_ULONG, ctypes.c_char_p, CK_ULONG),
+		"C_Logout":				(CK_ULONG, ),
+		"C_InitPIN":			(CK_ULONG, ctypes.c_char_p, CK_ULONG),
+		"C_SetPIN":				(CK_ULONG, ctypes.c_char_p, CK_ULONG, ctypes.c_char_p, CK_ULONG),
+		"C_FindObjectsInit":	(CK_ULONG, ctypes.POINTER(CK_ATTRIBUTE), CK_ULONG),
+		"C_FindObjects":		(CK_ULONG, ctypes.POINTER(CK_ULONG), CK_ULONG, ctypes.POINTER(CK_ULONG)),
+		"C_FindObjectsFinal":	(CK_ULONG, ),
+		"C_GetAttributeValue":	(CK_ULONG, CK_ULONG, ctypes.POINTER(CK_ATTRIBUTE), CK_ULONG),
+		"C_CreateObject":		(CK_ULONG, ctypes.POINTER(CK_ATTRIBUTE), CK_ULONG, ctypes.POINTER(CK_ULONG)),
+		"C_DestroyObject":		(CK_ULONG, CK_ULONG),
+		"C_GenerateKeyPair":	(CK_ULONG, ctypes.POINTER(CK_MECHANISM), ctypes.POINTER(CK_ATTRIBUTE), CK_ULONG, ctypes.POINTER(CK_ATTRIBUTE), CK_ULONG, ctypes.POINTER(CK_ULONG), ctypes.POINTER(CK_ULONG)),
+		"C_SignInit":			(CK_ULONG, ctypes.POINTER(CK_MECHANISM), CK_ULONG),
+		"C_Sign":				(CK_ULONG, ctypes.c_char_p, CK_ULONG, ctypes.c_char_p, ctypes.POINTER(CK_ULONG)),
+	}
+
+	_loaded = { }
+	_loaded_lock = threading.Lock()
+
+	def __init__(self, module_path):
+		self._module_path = module_path
+		self._dll = ctypes.CDLL(module_path)
+		for (name, argtypes) in self._PROTOTYPES.items():
+			function = getattr(self._dll, name)
+			function.argtypes = argtypes
+			function.restype = CK_ULONG
+		init_args = CK_C_INITIALIZE_ARGS(flags = self.CKF_OS_LOCKING_OK)
+		rv = self._dll.C_Initialize(ctypes.cast(ctypes.pointer(init_args), ctypes.c_void_p))
+		if rv not in (self.CKR_OK, self.CKR_CRYPTOKI_ALREADY_INITIALIZED):
+			raise PKCS11Exception("C_Initialize", rv)
+		atexit.register(self._finalize)
+
+	@classmethod
+	def load(cls, module_path):
+		with cls._loaded_lock:
+			if module_path not in cls._loaded:
+				cls._loaded[module_path] = cls(module_path)
+			return cls._loaded[module_path]
+
+	@property
+	def module_path(self):
+		return self._module_path
+
+	def _finalize(self):
+		self._dll.C_Finalize(None)
+
+	def _check(self, function, rv, accept = None):
+		if (rv != self.CKR_OK) and ((accept is None) or (rv not in accept)):
+			raise PKCS11Exception(function, rv)
+		return rv
+
+	@staticmethod
+	def _string(value):
+		return value.decode("utf-8", errors = "replace").rstrip(" \x00")
+
+	@staticmethod
+	def _template(attributes):
+		# Returns the CK_ATTRIBUTE array and the list of backing buffers, which
+		# the caller needs to keep alive as long as the array is in use.
+		array = (CK_ATTRIBUTE * len(attributes))()
+		buffers = [ ]
+		for (index, (attribute_type, value)) in enumerate(attributes):
+			if isinstance(value, bool):
+				buf = CK_BBOOL(int(value))
+			elif isinstance(value, int):
+				buf = CK_ULONG(value)
+			else:
+				if isinstance(value, str):
+					value = value.encode("utf-8")
+				buf = ctypes.create_string_buffer(value, len(value))
+			buffers.append(buf)
+			array[index].type = attribute_type
+			array[index].pValue = ctypes.addressof(buf)
+			array[index].ulValueLen = ctypes.sizeof(buf)
+		return (array, buffers)
+
+	def get_slot_list(self, token_present = True):
+		count = CK_ULONG(0)
+		self._check("C_GetSlotList", self._dll.C_GetSlotList(int(token_present), None, ctypes.byref(count)))
+		slots = (CK_ULONG * count.value)()
+		self._check("C_GetSlotList", self._dll.C_GetSlotList(int(token_present), slots, ctypes.byref(count)))
+		return list(slots[:count.value])
+
+	def get_slot_info(self, slot):
+		info = CK_SLOT_INFO()
+		self._check("C_GetSlotInfo", self._dll.C_GetSlotInfo(slot, ctypes.byref(info)))
+		return {
+			"description":		self._string(info.slotDescription),
+			"manufacturer":		self._string(info.manufacturerID),
+			"flags":			info.flags,
+		}
+
+	def get_token_info(self, slot):
+		info = CK_TOKEN_INFO()
+		self._check("C_GetTokenInfo", self._dll.C_GetTokenInfo(slot, ctypes.byref(info)))
+		return {
+			"label":			self._string(info.label),
+			"manufacturer":		self._string(info.manufacturerID),
+			"model":			self._string(info.model),
+			"serial":			self._string(info.serialNumber),
+			"flags":			info.flags,
+			"free_public_memory":	info.ulFreePublicMemory,
+			"free_private_memory":	info.ulFreePrivateMemory,
+		}
+
+	def open_session(self, slot, read_write = True):
+		flags = self.CKF_SERIAL_SESSION
+		if read_write:
+			flags |= self.CKF_RW_SESSION
+		session = CK_ULONG(0)
+		self._check("C_OpenSession", self._dll.C_OpenSession(slot, flags, None, None, ctypes.byref(session)))
+		return session.value
+
+	def close_session(self, session):
+		self._check("C_CloseSession", self._dll.C_CloseSession(session))
+
+	def login(self, session, user_type, pin):
+		# A PIN of None is used for readers with a protected authentication
+		# path (i.e., a PIN pad).
+		if pin is not None:
+			pin = pin.encode("utf-8")
+		rv = self._dll.C_Login(session, user_type, pin, 0 if (pin is None) else len(pin))
+		return self._check("C_Login", rv, accept = (self.CKR_USER_ALREADY_LOGGED_IN, ))
+
+	def logout(self, session):
+		self._check("C_Logout", self._dll.C_Logout(session))
+
+	def init_pin(self, session, pin):
+		if pin is not None:
+			pin = pin.encode("utf-8")
+		self._check("C_InitPIN", self._dll.C_InitPIN(session, pin, 0 if (pin is None) else len(pin)))
+
+	def set_pin(self, session, old_pin, new_pin):
+		old_pin = None if (old_pin is None) else old_pin.encode("utf-8")
+		new_pin = None if (new_pin is None) else new_pin.encode("utf-8")
+		rv = self._dll.C_SetPIN(session, old_pin, 0 if (old_pin is None) else len(old_pin), new_pin, 0 if (new_pin is None) else len(new_pin))
+		self._check("C_SetPIN", rv)
+
+	def find_objects(self, session, attributes):
+		(template, buffers) = self._template(attributes)
+		self._check("C_FindObjectsInit", self._dll.C_FindObjectsInit(session, template, len(attributes)))
+		try:
+			result = [ ]
+			handles = (CK_ULONG * 32)()
+			count = CK_ULONG(0)
+			while True:
+				self._check("C_FindObjects", self._dll.C_FindObjects(session, handles, len(handles), ctypes.byref(count)))
+				if count.value == 0:
+					break
+				result += handles[:count.value]
+			return result
+		finally:
+			self._check("C_FindObjectsFinal", self._dll.C_FindObjectsFinal(session))
+
+	def get_attribute(self, session, handle, attribute_type):
+		# Returns the raw attribute value as bytes or None if the object does
+		# not have that attribute (or it is sensitive).
+		attribute = CK_ATTRIBUTE(type = attribute_type, pValue = None, ulValueLen = 0)
+		rv = self._dll.C_GetAttributeValue(session, handle, ctypes.byref(attribute), 1)
+		if (rv == self.CKR_ATTRIBUTE_TYPE_INVALID) or (attribute.ulValueLen == self._CK_UNAVAILABLE_INFORMATION):
+			return None
+		self._check("C_GetAttributeValue", rv)
+		buf = ctypes.create_string_buffer(attribute.ulValueLen)
+		attribute.pValue = ctypes.addressof(buf)
+		self._check("C_GetAttributeValue", self._dll.C_GetAttributeValue(session, handle, ctypes.byref(attribute), 1))
+		return buf.raw[:attribute.ulValueLen]
+
+	def get_attribute_int(self, session, handle, attribute_type):
+		value = self.get_attribute(session, handle, attribute_type)
+		if value is None:
+			return None
+		return CK_ULONG.from_buffer_copy(value).value
+
+	def create_object(self, session, attributes):
+		(template, buffers) = self._template(attributes)
+		handle = CK_ULONG(0)
+		self._check("C_CreateObject", self._dll.C_CreateObject(session, template, len(attributes), ctypes.byref(handle)))
+		return handle.value
+
+	def destroy_object(self, session, handle):
+		self._check("C_DestroyObject", self._dll.C_DestroyObject(session, handle))
+
+	def generate_keypair(self, session, mechanism, public_attributes, private_attributes):
+		mech = CK_MECHANISM(mechanism = mechanism, pParameter = None, ulParameterLen = 0)
+		(public_template, public_buffers) = self._template(public_attributes)
+		(private_template, private_buffers) = self._template(private_attributes)
+		public_handle = CK_ULONG(0)
+		private_handle = CK_ULONG(0)
+		rv = self._dll.C_GenerateKeyPair(session, ctypes.byref(mech), public_template, len(public_attributes), private_template, len(private_attributes), ctypes.byref(public_handle), ctypes.byref(private_handle))
+		self._check("C_GenerateKeyPair", rv)
+		return (public_handle.value, private_handle.value)
+
+	def sign(self, session, mechanism, key_handle, data, parameter = None):
+		# The parameter, if given, is a ctypes structure (e.g., the PSS
+		# parameters). A buffer that fits any RSA-4096 or ECC signature is
+		# tried first so that usually only a single C_Sign call is needed.
+		mech = CK_MECHANISM(mechanism = mechanism, pParameter = None, ulParameterLen = 0)
+		if parameter is not None:
+			mech.pParameter = ctypes.addressof(parameter)
+			mech.ulParameterLen = ctypes.sizeof(parameter)
+		self._check("C_SignInit", self._dll.C_SignInit(session, ctypes.byref(mech), key_handle))
+		signature_length = CK_ULONG(512)
+		signature = ctypes.create_string_buffer(signature_length.value)
+		rv = self._dll.C_Sign(session, data, len(data), signature, ctypes.byref(signature_length))
+		if rv == self.CKR_BUFFER_TOO_SMALL:
+			signature = ctypes.create_string_buffer(signature_length.value)
+			rv = self._dll.C_Sign(session, data, len(data), signature, ctypes.byref(signature_length))
+		self._check("C_Sign", rv)
+		return signature.raw[:signature_length.value]
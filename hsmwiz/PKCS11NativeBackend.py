@@ -0,0 +1,427 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import getpass
+import threading
+import contextlib
+from .PKCS11Library import PKCS11Library, PKCS11Exception, CK_RSA_PKCS_PSS_PARAMS
+from .KeySpec import KeySpec
+from .DER import DER
+from .Certificate import Certificate
+from .TokenInventory import TokenInventory
+
+# PKCS#11 backend that loads the PKCS#11 module into this process once and
+# talks to it directly instead of spawning pkcs11-tool for every operation.
+class PKCS11NativeBackend():
+	name = "native"
+	_OID_RSA_ENCRYPTION = "1.2.840.113549.1.1.1"
+	_OID_EC_PUBLIC_KEY = "1.2.840.10045.2.1"
+	_OBJECT_CLASSES = [
+		("privkey", PKCS11Library.CKO_PRIVATE_KEY),
+		("pubkey", PKCS11Library.CKO_PUBLIC_KEY),
+		("cert", PKCS11Library.CKO_CERTIFICATE),
+		("data", PKCS11Library.CKO_DATA),
+	]
+	_SIGN_MECHANISMS = {
+		"rsa-pkcs":		PKCS11Library.CKM_RSA_PKCS,
+		"rsa-pss":		PKCS11Library.CKM_RSA_PKCS_PSS,
+		"ecdsa":		PKCS11Library.CKM_ECDSA,
+	}
+	_PSS_HASHES = {
+		"sha1":			(PKCS11Library.CKM_SHA_1, PKCS11Library.CKG_MGF1_SHA1),
+		"sha224":		(PKCS11Library.CKM_SHA224, PKCS11Library.CKG_MGF1_SHA224),
+		"sha256":		(PKCS11Library.CKM_SHA256, PKCS11Library.CKG_MGF1_SHA256),
+		"sha384":		(PKCS11Library.CKM_SHA384, PKCS11Library.CKG_MGF1_SHA384),
+		"sha512":		(PKCS11Library.CKM_SHA512, PKCS11Library.CKG_MGF1_SHA512),
+	}
+	# Login state is kept per application and token, not per session: a
+	# logout in any session logs out all sessions on that token, including
+	# the ones other backend instances in this process are using. Logins are
+	# therefore counted per (module, slot) and only the last one logs out.
+	_logins = { }
+	_logins_lock = threading.Lock()
+
+	def __init__(self, module_path, verbose = False, pin = None, sopin = None, reader_name = None, credentials = None, credentials_rejected = None):
+		self._lib = PKCS11Library.load(module_path)
+		self._verbose = verbose
+		self._reader_name = reader_name
+		self.__pin = pin
+		self.__sopin = sopin
+		self._credentials = credentials
+		self._credentials_rejected = credentials_rejected
+		self._slot = None
+		self._persistent_session = None
+		self._logged_in_as = None
+
+	@staticmethod
+	def slot_matches_reader(description, reader_name):
+		# OpenSC uses the reader name as slot description, truncated to the
+		# 64 characters that CK_SLOT_INFO has room for. Slots do not map
+		# one-to-one onto readers (e.g., there are additional slots for PIN
+		# pads or virtual slots), so they are matched by name.
+		return (description != "") and reader_name.startswith(description)
+
+	@property
+	def slot(self):
+		if self._slot is None:
+			token_slots = self._lib.get_slot_list(token_present = True)
+			if self._reader_name is None:
+				if len(token_slots) == 0:
+					raise Exception("No smart card with a present token found.")
+				self._slot = token_slots[0]
+			else:
+				slots = [ slot for slot in token_slots if self.slot_matches_reader(self._lib.get_slot_info(slot)["description"], self._reader_name) ]
+				if len(slots) == 0:
+					raise Exception("No token present in reader %s." % (self._reader_name))
+				self._slot = slots[0]
+			if self._verbose:
+				print("Using slot %d with a present token via %s" % (self._slot, self._lib.module_path))
+		return self._slot
+
+	def _get_pin(self, user_type):
+		if user_type == PKCS11Library.CKU_SO:
+			if self.__sopin is None:
+				self.__sopin = self._stored_pin("sopin") or self._prompt_pin("Please enter SO PIN: ")
+			return self.__sopin
+		else:
+			if self.__pin is None:
+				self.__pin = self._stored_pin("pin") or self._prompt_pin("Please enter User PIN: ")
+			return self.__pin
+
+	def _stored_pin(self, kind):
+		# PIN that was not given explicitly, but is known elsewhere (i.e., to
+		# a running credential agent)
+		if self._credentials is None:
+			return None
+		return self._credentials(kind)
+
+	def _prompt_pin(self, prompt):
+		token_info = self._lib.get_token_info(self.slot)
+		if token_info["flags"] & PKCS11Library.CKF_PROTECTED_AUTHENTICATION_PATH:
+			# PIN is entered on the reader's PIN pad
+			return None
+		return getpass.getpass(prompt)
+
+	@property
+	def in_session(self):
+		return self._persistent_session is not None
+
+	def open_session(self):
+		# Opens one session that is kept open (and, once logged in, stays
+		# logged in) for all following operations until close_session().
+		if self._persistent_session is None:
+			self._persistent_session = self._lib.open_session(self.slot)
+			self._logged_in_as = None
+
+	def _login(self, session, user_type):
+		key = (self._lib.module_path, self.slot)
+		with self._logins_lock:
+			(logged_in_as, count) = self._logins.get(key, (None, 0))
+			if (count == 0) or (logged_in_as != user_type):
+				# Logging in as someone else while logged in fails with
+				# CKR_USER_ANOTHER_ALREADY_LOGGED_IN
+				try:
+					self._lib.login(session, user_type, self._get_pin(user_type))
+				except PKCS11Exception as e:
+					if e.rv in (PKCS11Library.CKR_PIN_INCORRECT, PKCS11Library.CKR_PIN_LOCKED):
+						self._pin_rejected(user_type, e)
+					raise
+			self._logins[key] = (user_type, count + 1)
+
+	def _pin_rejected(self, user_type, error):
+		# A PIN from the credential agent is tried only once: retrying it
+		# would only count down the token's retries until it is locked
+		kind = "sopin" if (user_type == PKCS11Library.CKU_SO) else "pin"
+		if (self._credentials_rejected is None) or (not self._credentials_rejected(kind)):
+			return
+		if user_type == PKCS11Library.CKU_SO:
+			self.__sopin = None
+		else:
+			self.__pin = None
+		raise Exception("The token rejected the %s held by the credential agent, it has been removed from the agent: %s" % ("SO-PIN" if (kind == "sopin") else "PIN", str(error))) from error
+
+	def _logout(self, session):
+		key = (self._lib.module_path, self.slot)
+		with self._logins_lock:
+			(logged_in_as, count) = self._logins[key]
+			if count > 1:
+				self._logins[key] = (logged_in_as, count - 1)
+				return
+			del self._logins[key]
+			self._lib.logout(session)
+
+	def close_session(self):
+		if self._persistent_session is None:
+			return
+		try:
+			if self._logged_in_as is not None:
+				self._logout(self._persistent_session)
+		finally:
+			self._lib.close_session(self._persistent_session)
+			self._persistent_session = None
+			self._logged_in_as = None
+
+	def _persistent_login(self, user_type):
+		if (user_type is None) or (self._logged_in_as == user_type):
+			return
+		if self._logged_in_as is not None:
+			# Login state is shared among all sessions of a token, so we can
+			# only ever be logged in as either the user or the SO.
+			self._logout(self._persistent_session)
+			self._logged_in_as = None
+		self._login(self._persistent_session, user_type)
+		self._logged_in_as = user_type
+
+	@contextlib.contextmanager
+	def _session(self, user_type = PKCS11Library.CKU_USER):
+		if self._persistent_session is not None:
+			self._persistent_login(user_type)
+			yield self._persistent_session
+			return
+
+		session = self._lib.open_session(self.slot)
+		try:
+			if user_type is not None:
+				self._login(session, user_type)
+			try:
+				yield session
+			finally:
+				if user_type is not None:
+					self._logout(session)
+		finally:
+			self._lib.close_session(session)
+
+	@staticmethod
+	def _id_bytes(key_id):
+		# Same interpretation as pkcs11-tool, which gets the ID as a hex string
+		hex_id = "%x" % (key_id)
+		if len(hex_id) % 2 == 1:
+			hex_id = "0" + hex_id
+		return bytes.fromhex(hex_id)
+
+	def _find(self, session, object_class, key_id = None, key_label = None):
+		attributes = [ (PKCS11Library.CKA_CLASS, object_class) ]
+		if key_id is not None:
+			attributes.append((PKCS11Library.CKA_ID, self._id_bytes(key_id)))
+		if key_label is not None:
+			attributes.append((PKCS11Library.CKA_LABEL, key_label))
+		return self._lib.find_objects(session, attributes)
+
+	def _find_one(self, session, object_class, key_id = None, key_label = None):
+		handles = self._find(session, object_class, key_id = key_id, key_label = key_label)
+		if len(handles) == 0:
+			raise Exception("No matching object found on token (ID %s, label %s)." % (key_id, key_label))
+		return handles[0]
+
+	def login(self, with_sopin = False):
+		user_type = PKCS11Library.CKU_SO if with_sopin else PKCS11Library.CKU_USER
+		try:
+			with self._session(user_type = user_type):
+				pass
+			return True
+		except PKCS11Exception as e:
+			if e.rv in (PKCS11Library.CKR_PIN_INCORRECT, PKCS11Library.CKR_PIN_LOCKED):
+				return False
+			raise
+
+	def unblock_pin(self):
+		with self._session(user_type = PKCS11Library.CKU_SO) as session:
+			new_pin = self.__pin
+			if new_pin is None:
+				new_pin = self._prompt_pin("Please enter the new PIN: ")
+			self._lib.init_pin(session, new_pin)
+
+	def keygen(self, key_spec, key_id, key_label = None):
+		key_spec = KeySpec.parse(key_spec)
+		public_attributes = [
+			(PKCS11Library.CKA_TOKEN, True),
+			(PKCS11Library.CKA_VERIFY, True),
+			(PKCS11Library.CKA_ID, self._id_bytes(key_id)),
+		]
+		private_attributes = [
+			(PKCS11Library.CKA_TOKEN, True),
+			(PKCS11Library.CKA_PRIVATE, True),
+			(PKCS11Library.CKA_SENSITIVE, True),
+			(PKCS11Library.CKA_SIGN, True),
+			(PKCS11Library.CKA_ID, self._id_bytes(key_id)),
+		]
+		if key_label is not None:
+			public_attributes.append((PKCS11Library.CKA_LABEL, key_label))
+			private_attributes.append((PKCS11Library.CKA_LABEL, key_label))
+		if key_spec.key_type == "rsa":
+			mechanism = PKCS11Library.CKM_RSA_PKCS_KEY_PAIR_GEN
+			public_attributes += [
+				(PKCS11Library.CKA_ENCRYPT, True),
+				(PKCS11Library.CKA_WRAP, True),
+				(PKCS11Library.CKA_MODULUS_BITS, key_spec.bits),
+				(PKCS11Library.CKA_PUBLIC_EXPONENT, bytes([ 0x01, 0x00, 0x01 ])),
+			]
+			private_attributes += [
+				(PKCS11Library.CKA_DECRYPT, True),
+				(PKCS11Library.CKA_UNWRAP, True),
+			]
+		else:
+			mechanism = PKCS11Library.CKM_EC_KEY_PAIR_GEN
+			public_attributes += [
+				(PKCS11Library.CKA_DERIVE, True),
+				(PKCS11Library.CKA_EC_PARAMS, DER.oid(key_spec.curve.oid)),
+			]
+			private_attributes += [
+				(PKCS11Library.CKA_DERIVE, True),
+			]
+		with self._session() as session:
+			self._lib.generate_keypair(session, mechanism, public_attributes, private_attributes)
+		if self._verbose:
+			print("Key pair generated: %s, ID %02x%s" % (key_spec, key_id, "" if (key_label is None) else (", label %s" % (key_label))))
+
+	@staticmethod
+	def _unwrap_ec_point(ec_point):
+		# Most modules (including OpenSC) return CKA_EC_POINT DER-encoded as
+		# OCTET STRING, some return the raw point.
+		try:
+			element = DER.decode_single(ec_point, expect_tag = DER.TAG_OCTETSTRING)
+			return element.content
+		except Exception:
+			return ec_point
+
+	def _pubkey_der(self, session, handle):
+		key_type = self._lib.get_attribute_int(session, handle, PKCS11Library.CKA_KEY_TYPE)
+		if key_type == PKCS11Library.CKK_RSA:
+			modulus = self._lib.get_attribute(session, handle, PKCS11Library.CKA_MODULUS)
+			exponent = self._lib.get_attribute(session, handle, PKCS11Library.CKA_PUBLIC_EXPONENT)
+			algorithm = DER.sequence(DER.oid(self._OID_RSA_ENCRYPTION), DER.null())
+			key_data = DER.sequence(DER.integer(modulus), DER.integer(exponent))
+		elif key_type == PKCS11Library.CKK_EC:
+			ec_params = self._lib.get_attribute(session, handle, PKCS11Library.CKA_EC_PARAMS)
+			ec_point = self._lib.get_attribute(session, handle, PKCS11Library.CKA_EC_POINT)
+			algorithm = DER.sequence(DER.oid(self._OID_EC_PUBLIC_KEY), ec_params)
+			key_data = self._unwrap_ec_point(ec_point)
+		else:
+			raise Exception("Unsupported public key type 0x%x." % (key_type))
+		return DER.sequence(algorithm, DER.bitstring(key_data))
+
+	def read_pubkey(self, key_id, key_label = None):
+		with self._session() as session:
+			handle = self._find_one(session, PKCS11Library.CKO_PUBLIC_KEY, key_id = key_id, key_label = key_label)
+			return self._pubkey_der(session, handle)
+
+	def list_pubkeys(self):
+		# Yields (key ID, label, DER-encoded public key) for all public keys
+		with self._session() as session:
+			for handle in self._find(session, PKCS11Library.CKO_PUBLIC_KEY):
+				key_id = self._lib.get_attribute(session, handle, PKCS11Library.CKA_ID)
+				label = self._lib.get_attribute(session, handle, PKCS11Library.CKA_LABEL)
+				key_id = None if (key_id is None) else int.from_bytes(key_id, byteorder = "big")
+				label = None if (label is None) else label.decode("utf-8", errors = "replace")
+				yield (key_id, label, self._pubkey_der(session, handle))
+
+	def token_serial(self):
+		return self._lib.get_token_info(self.slot)["serial"]
+
+	def change_fingerprint(self):
+		# PKCS#11 has no change counter, but the free memory reported by the
+		# token and the number of public objects change whenever objects are
+		# created or destroyed
+		token_info = self._lib.get_token_info(self.slot)
+		with self._session(user_type = None) as session:
+			public_objects = len(self._lib.find_objects(session, [ (PKCS11Library.CKA_PRIVATE, False) ]))
+		return [ token_info["free_public_memory"], token_info["free_private_memory"], public_objects ]
+
+	def _describe_key(self, session, handle):
+		# Returns (key type, bits, curve name) of a public or private key
+		key_type = self._lib.get_attribute_int(session, handle, PKCS11Library.CKA_KEY_TYPE)
+		if key_type == PKCS11Library.CKK_RSA:
+			modulus = self._lib.get_attribute(session, handle, PKCS11Library.CKA_MODULUS)
+			return ("rsa", None if (modulus is None) else int.from_bytes(modulus, byteorder = "big").bit_length(), None)
+		elif key_type == PKCS11Library.CKK_EC:
+			ec_params = self._lib.get_attribute(session, handle, PKCS11Library.CKA_EC_PARAMS)
+			curve = None if (ec_params is None) else TokenInventory.curve_from_ec_params(ec_params)
+			return ("ec", None if (curve is None) else curve.bits, None if (curve is None) else curve.name)
+		return (None, None, None)
+
+	def list_objects(self):
+		# Yields a TokenInventory.TokenObject for every object on the token
+		with self._session() as session:
+			for (object_class, cko) in self._OBJECT_CLASSES:
+				for handle in self._find(session, cko):
+					key_id = self._lib.get_attribute(session, handle, PKCS11Library.CKA_ID)
+					label = self._lib.get_attribute(session, handle, PKCS11Library.CKA_LABEL)
+					(key_type, bits, curve, subject) = (None, None, None, None)
+					if object_class in [ "privkey", "pubkey" ]:
+						(key_type, bits, curve) = self._describe_key(session, handle)
+					elif object_class == "cert":
+						try:
+							subject = Certificate(self._lib.get_attribute(session, handle, PKCS11Library.CKA_VALUE)).subject
+						except Exception:
+							pass
+					yield TokenInventory.TokenObject(object_class = object_class, key_id = None if not key_id else int.from_bytes(key_id, byteorder = "big"),
+							label = None if (label is None) else label.decode("utf-8", errors = "replace"), key_type = key_type, bits = bits, curve = curve, subject = subject)
+
+	def sign(self, key_id, key_label, mechanism, hashfnc, inputs):
+		# Signs all inputs (already hashed and, for PKCS#1 v1.5, wrapped in a
+		# DigestInfo) with the same key in one session; yields the raw
+		# signatures in order.
+		with self._session() as session:
+			handle = self._find_one(session, PKCS11Library.CKO_PRIVATE_KEY, key_id = key_id, key_label = key_label)
+			for data in inputs:
+				parameter = None
+				if mechanism == "rsa-pss":
+					# Salt length equals the digest length
+					(hash_mechanism, mgf) = self._PSS_HASHES[hashfnc]
+					parameter = CK_RSA_PKCS_PSS_PARAMS(hashAlg = hash_mechanism, mgf = mgf, sLen = len(data))
+				yield self._lib.sign(session, self._SIGN_MECHANISMS[mechanism], handle, data, parameter = parameter)
+
+	def removekey(self, key_id, key_label = None):
+		with self._session() as session:
+			handle = self._find_one(session, PKCS11Library.CKO_PRIVATE_KEY, key_id = key_id, key_label = key_label)
+			self._lib.destroy_object(session, handle)
+
+	def putcrt(self, crt_derdata, cert_id, cert_label = None):
+		certificate = DER.decode_single(crt_derdata, expect_tag = DER.TAG_SEQUENCE)
+		tbs_certificate = DER.decode_children(certificate.content)[0]
+		tbs_fields = DER.decode_children(tbs_certificate.content)
+		if tbs_fields[0].tag == 0xa0:
+			# Skip explicit version
+			tbs_fields = tbs_fields[1:]
+		(serial, issuer, subject) = (tbs_fields[0].raw, tbs_fields[2].raw, tbs_fields[4].raw)
+
+		attributes = [
+			(PKCS11Library.CKA_CLASS, PKCS11Library.CKO_CERTIFICATE),
+			(PKCS11Library.CKA_CERTIFICATE_TYPE, PKCS11Library.CKC_X_509),
+			(PKCS11Library.CKA_TOKEN, True),
+			(PKCS11Library.CKA_VALUE, crt_derdata),
+			(PKCS11Library.CKA_SUBJECT, subject),
+			(PKCS11Library.CKA_ISSUER, issuer),
+			(PKCS11Library.CKA_SERIAL_NUMBER, serial),
+		]
+		if cert_id is not None:
+			attributes.append((PKCS11Library.CKA_ID, self._id_bytes(cert_id)))
+		if cert_label is not None:
+			attributes.append((PKCS11Library.CKA_LABEL, cert_label))
+		with self._session() as session:
+			self._lib.create_object(session, attributes)
+
+	def change_pin(self, new_value):
+		with self._session() as session:
+			self._lib.set_pin(session, self._get_pin(PKCS11Library.CKU_USER), str(new_value))
+
+	def change_sopin(self, new_value):
+		with self._session(user_type = PKCS11Library.CKU_SO) as session:
+			self._lib.set_pin(session, self._get_pin(PKCS11Library.CKU_SO), str(new_value))
@@ -0,0 +1,253 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import re
+import subprocess
+from .MemoryFile import MemoryFile
+from .PKCS11NativeBackend import PKCS11NativeBackend
+from .TokenInventory import TokenInventory
+
+# PKCS#11 backend that runs one pkcs11-tool process per operation.
+class PKCS11ToolBackend():
+	name = "tool"
+
+	def __init__(self, module_path, call, call_output, pin = None, sopin = None, reader_name = None, credentials = None, credentials_rejected = None):
+		self._module_path = module_path
+		self._call_output = call_output
+		self._reader_name = reader_name
+		self._token_slot = None
+		self._call = call
+		self.__pin = pin
+		self.__sopin = sopin
+		self._credentials = credentials
+		self._credentials_rejected = credentials_rejected
+
+	@property
+	def in_session(self):
+		return False
+
+	def open_session(self):
+		# Every pkcs11-tool invocation needs to login on its own, there is no
+		# way to share a session between them.
+		pass
+
+	def close_session(self):
+		pass
+
+	def _token_slots(self):
+		# Returns (slot ID, slot description, token serial) of all slots with
+		# a token present
+		output = self._call_output([ "pkcs11-tool", "--module", self._module_path, "--list-token-slots" ]).decode(errors = "replace")
+		slots = [ ]
+		for line in output.split("\n"):
+			match = re.match(r"^Slot \d+ \((0x[0-9a-fA-F]+)\): (.*)$", line)
+			if match is not None:
+				slots.append([ int(match.group(1), 16), match.group(2).strip(), None ])
+			elif (len(slots) > 0) and line.strip().startswith("serial num"):
+				slots[-1][2] = line.split(":", maxsplit = 1)[1].strip()
+		return slots
+
+	def _resolve_slot(self):
+		# Same choice of slot as the native backend, see there
+		if self._token_slot is None:
+			slots = self._token_slots()
+			if self._reader_name is None:
+				if len(slots) == 0:
+					raise Exception("No smart card with a present token found.")
+			else:
+				slots = [ slot for slot in slots if PKCS11NativeBackend.slot_matches_reader(slot[1], self._reader_name) ]
+				if len(slots) == 0:
+					raise Exception("No token present in reader %s." % (self._reader_name))
+			self._token_slot = slots[0]
+		return self._token_slot
+
+	@property
+	def slot(self):
+		return self._resolve_slot()[0]
+
+	def _slot_args(self):
+		if self._reader_name is None:
+			return [ ]
+		return [ "--slot", "0x%x" % (self.slot) ]
+
+	def _get_pin(self, kind):
+		# Without a PIN, pkcs11-tool asks for it interactively
+		if kind == "sopin":
+			if (self.__sopin is None) and (self._credentials is not None):
+				self.__sopin = self._verified_pin("sopin", self._credentials("sopin"))
+			return self.__sopin
+		else:
+			if (self.__pin is None) and (self._credentials is not None):
+				self.__pin = self._verified_pin("pin", self._credentials("pin"))
+			return self.__pin
+
+	def _verified_pin(self, kind, pin):
+		# A PIN that was not given explicitly (i.e., one from the credential
+		# agent) is tried once on its own before it is used. If the token
+		# refuses it, it must not be passed to every following pkcs11-tool
+		# call, which would count down the token's retries until it is locked.
+		if (pin is None) or (self._credentials_rejected is None):
+			return pin
+		cmd = [ "pkcs11-tool", "--module", self._module_path ] + self._slot_args() + [ "--login" ]
+		if kind == "sopin":
+			cmd += [ "--login-type", "so", "--so-pin", pin ]
+		else:
+			cmd += [ "--pin", pin ]
+		cmd += [ "--list-objects", "--type", "privkey" ]
+		try:
+			self._call_output(cmd, stderr = subprocess.PIPE)
+		except subprocess.CalledProcessError as e:
+			if (e.stderr is not None) and any(error in e.stderr for error in (b"CKR_PIN_INCORRECT", b"CKR_PIN_LOCKED")) and self._credentials_rejected(kind):
+				raise Exception("The token rejected the %s held by the credential agent, it has been removed from the agent." % ("SO-PIN" if (kind == "sopin") else "PIN"))
+			raise
+		return pin
+
+	def _cmd(self, with_sopin = False):
+		cmd = [ "pkcs11-tool", "--module", self._module_path ] + self._slot_args() + [ "--login" ]
+		if with_sopin:
+			cmd += [ "--login-type", "so" ]
+			sopin = self._get_pin("sopin")
+			if sopin is not None:
+				cmd += [ "--so-pin", sopin ]
+		else:
+			pin = self._get_pin("pin")
+			if pin is not None:
+				cmd += [ "--pin", pin ]
+		return cmd
+
+	def login(self, with_sopin = False):
+		cmd = self._cmd(with_sopin = with_sopin) + [ "--list-objects" ]
+		try:
+			self._call(cmd)
+			return True
+		except subprocess.CalledProcessError:
+			return False
+
+	def unblock_pin(self):
+		cmd = [ "pkcs11-tool", "--module", self._module_path ] + self._slot_args() + [ "--login", "--login-type", "so" ]
+		sopin = self._get_pin("sopin")
+		if sopin is not None:
+			cmd += [ "--so-pin", sopin ]
+		cmd += [ "--init-pin" ]
+		self._call(cmd)
+
+	def keygen(self, key_spec, key_id, key_label = None):
+		cmd = self._cmd()
+		cmd += [ "--keypairgen", "--key-type", key_spec, "--id", "%x" % (key_id) ]
+		if key_label is not None:
+			cmd += [ "--label", key_label ]
+		self._call(cmd)
+
+	def read_pubkey(self, key_id, key_label = None):
+		# pkcs11-tool prints status messages on stdout, so the key itself is
+		# passed through an in-memory file.
+		with MemoryFile("pubkey") as pubkey_derfile:
+			cmd = self._cmd()
+			if key_id is not None:
+				cmd += [ "--id", "%x" % (key_id) ]
+			if key_label is not None:
+				cmd += [ "--label", key_label ]
+			cmd += [ "--read-object", "--type", "pubkey" ]
+			cmd += [ "--output-file", pubkey_derfile.path ]
+			self._call(cmd)
+			return pubkey_derfile.read()
+
+	def list_pubkeys(self):
+		# pkcs11-tool can only read one object per invocation, so this lists
+		# all public keys first and then reads them one by one.
+		output = self._call_output(self._cmd() + [ "--list-objects", "--type", "pubkey" ]).decode(errors = "replace")
+		keys = [ ]
+		for line in output.split("\n"):
+			if line.startswith("Public Key Object"):
+				keys.append({ "id": None, "label": None })
+			elif (len(keys) > 0) and line.startswith("  "):
+				(key, _, value) = line.strip().partition(":")
+				if key in [ "ID", "label" ]:
+					keys[-1][key.lower()] = value.strip()
+		for key in keys:
+			key_id = None if (key["id"] is None) else int(key["id"], 16)
+			if key_id is not None:
+				der_data = self.read_pubkey(key_id)
+			else:
+				der_data = self.read_pubkey(None, key_label = key["label"])
+			yield (key_id, key["label"], der_data)
+
+	def token_serial(self):
+		return self._resolve_slot()[2]
+
+	def change_fingerprint(self):
+		# Not available without spawning another process for every check
+		return None
+
+	def list_objects(self):
+		output = self._call_output(self._cmd() + [ "--list-objects" ]).decode(errors = "replace")
+		return TokenInventory.parse_pkcs11_tool_listing(output)
+
+	def sign(self, key_id, key_label, mechanism, hashfnc, inputs):
+		# Same interface as the native backend, but every signature needs its
+		# own pkcs11-tool invocation (and login).
+		hash_name = "SHA-1" if (hashfnc == "sha1") else hashfnc.upper()
+		mechanism_args = {
+			"rsa-pkcs":		[ "--mechanism", "RSA-PKCS" ],
+			"rsa-pss":		[ "--mechanism", "RSA-PKCS-PSS", "--hash-algorithm", hash_name, "--mgf", "MGF1-%s" % (hashfnc.upper()) ],
+			"ecdsa":		[ "--mechanism", "ECDSA" ],
+		}[mechanism]
+		for data in inputs:
+			with MemoryFile("sign_input", data) as input_file, MemoryFile("signature") as signature_file:
+				cmd = self._cmd()
+				if key_id is not None:
+					cmd += [ "--id", "%x" % (key_id) ]
+				if key_label is not None:
+					cmd += [ "--label", key_label ]
+				cmd += [ "--sign" ] + mechanism_args
+				if mechanism == "rsa-pss":
+					cmd += [ "--salt-len", str(len(data)) ]
+				cmd += [ "--input-file", input_file.path, "--output-file", signature_file.path ]
+				self._call(cmd)
+				yield signature_file.read()
+
+	def removekey(self, key_id, key_label = None):
+		cmd = self._cmd()
+		if key_id is not None:
+			cmd += [ "--id", "%x" % (key_id) ]
+		if key_label is not None:
+			cmd += [ "--label", key_label ]
+		cmd += [ "--delete-object", "--type", "privkey" ]
+		self._call(cmd)
+
+	def putcrt(self, crt_derdata, cert_id, cert_label = None):
+		with MemoryFile("crt", crt_derdata) as crt_tempfile:
+			cmd = self._cmd()
+			if cert_id is not None:
+				cmd += [ "--id", "%x" % (cert_id) ]
+			if cert_label is not None:
+				cmd += [ "--label", cert_label ]
+			cmd += [ "--write-object", crt_tempfile.path, "--type", "cert" ]
+			self._call(cmd)
+
+	def change_pin(self, new_value):
+		cmd = self._cmd()
+		cmd += [ "--change-pin", "--new-pin", str(new_value) ]
+		self._call(cmd)
+
+	def change_sopin(self, new_value):
+		cmd = self._cmd(with_sopin = True)
+		cmd += [ "--change-pin", "--new-pin", str(new_value) ]
+		self._call(cmd)
@@ -0,0 +1,91 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import sys
+import time
+import tempfile
+import collections
+import concurrent.futures
+from .HardwareSecurityModule import HardwareSecurityModule
+
+def run_captured(function, *args):
+	# Runs function(*args) and captures everything that is written to
+	# stdout/stderr meanwhile, including the output of called tools. Returns
+	# (result, error, output); error is None if function did not raise.
+	(result, error) = (None, None)
+	with tempfile.TemporaryFile() as log:
+		sys.stdout.flush()
+		sys.stderr.flush()
+		saved_fds = (os.dup(1), os.dup(2))
+		os.dup2(log.fileno(), 1)
+		os.dup2(log.fileno(), 2)
+		try:
+			result = function(*args)
+		except Exception as e:
+			error = str(e)
+		finally:
+			sys.stdout.flush()
+			sys.stderr.flush()
+			os.dup2(saved_fds[0], 1)
+			os.dup2(saved_fds[1], 2)
+			os.close(saved_fds[0])
+			os.close(saved_fds[1])
+		log.seek(0)
+		output = log.read().decode(errors = "replace")
+	return (result, error, output)
+
+def _run_batch_job(batch_job, reader, hsm_args, verbose):
+	with HardwareSecurityModule(reader = reader, **hsm_args) as hsm:
+		batch_job.run(hsm, verbose = verbose)
+
+def _run_on_reader(batch_job, reader, hsm_args, verbose):
+	# Runs in a worker process, output is captured per reader
+	t0 = time.time()
+	(_, error, output) = run_captured(_run_batch_job, batch_job, reader, hsm_args, verbose)
+	return (reader, error is None, error, output, time.time() - t0)
+
+# Runs the same batch job on multiple readers at once, one worker process per
+# reader. A failure on one reader does not affect any of the others.
+class ParallelBatchRunner():
+	ReaderResult = collections.namedtuple("ReaderResult", [ "reader", "success", "error", "output", "duration" ])
+
+	def __init__(self, batch_job, hsm_args, max_workers = None, verbose = False):
+		self._batch_job = batch_job
+		self._hsm_args = hsm_args
+		self._max_workers = max_workers
+		self._verbose = verbose
+
+	def submit(self, executor, reader):
+		return executor.submit(_run_on_reader, self._batch_job, reader, self._hsm_args, self._verbose)
+
+	def result(self, future, reader):
+		try:
+			return self.ReaderResult(*future.result())
+		except Exception as e:
+			return self.ReaderResult(reader = reader, success = False, error = "Worker failed: %s" % (str(e)), output = "", duration = 0)
+
+	def run(self, readers):
+		# Yields one ReaderResult per reader in order of completion
+		max_workers = self._max_workers or max(len(readers), 1)
+		with concurrent.futures.ProcessPoolExecutor(max_workers = max_workers) as executor:
+			futures = { self.submit(executor, reader): reader for reader in readers }
+			for future in concurrent.futures.as_completed(futures):
+				yield self.result(future, futures[future])
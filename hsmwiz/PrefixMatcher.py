@@ -28,6 +28,10 @@ class PrefixMatcher():
 		self._opts = options
 
 	def matchunique(self, value):
+		if value in self._opts:
+			# An exact match is never ambiguous, even if it is a prefix of
+			# another option
+			return value
 		result = self.match(value)
 		if len(result) != 1:
 			if len(result) == 0:
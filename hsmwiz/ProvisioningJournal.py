@@ -0,0 +1,81 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import time
+import fcntl
+
+# Append-only log of provisioning progress, one JSON object per line. Every
+# event is flushed to disk before the next step starts, so that after a crash
+# or a removed card, provisioning continues with the first step that has not
+# been completed. Multiple processes can append to the same journal; a torn
+# last line (e.g., after a power loss) is ignored.
+class ProvisioningJournal():
+	def __init__(self, filename):
+		self._filename = filename
+
+	@property
+	def filename(self):
+		return self._filename
+
+	def _events(self):
+		try:
+			with open(self._filename) as f:
+				for line in f:
+					try:
+						yield json.loads(line)
+					except ValueError:
+						pass
+		except FileNotFoundError:
+			pass
+
+	def state(self, serial):
+		# Returns (started, finished, completed steps as { number: name },
+		# begun steps as { number: name }). Steps are only marked as begun when
+		# whether they took effect cannot be checked on the card afterwards.
+		(started, finished, completed, begun) = (False, False, { }, { })
+		for event in self._events():
+			if event.get("serial") != serial:
+				continue
+			if event["event"] == "start":
+				started = True
+			elif event["event"] == "begin":
+				begun[event["step"]] = event["name"]
+			elif event["event"] == "step":
+				completed[event["step"]] = event["name"]
+			elif event["event"] == "finish":
+				finished = True
+		return (started, finished, completed, begun)
+
+	def append(self, serial, event, **fields):
+		entry = { "timestamp": time.time(), "serial": serial, "event": event }
+		entry.update(fields)
+		line = (json.dumps(entry) + "\n").encode()
+		with open(self._filename, "a+b") as f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			if f.seek(0, os.SEEK_END) > 0:
+				f.seek(-1, os.SEEK_END)
+				if f.read(1) != b"\n":
+					# Terminate a torn line so that this event stays readable
+					line = b"\n" + line
+			f.write(line)
+			f.flush()
+			os.fsync(f.fileno())
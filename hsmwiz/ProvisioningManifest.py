@@ -0,0 +1,92 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import csv
+import json
+import collections
+from .BatchJob import BatchJob
+
+# Maps token serial numbers to the batch job that provisions the token. A
+# manifest is either a CSV file with a "serial" column or a JSON list (or an
+# object with a "cards" list) of objects with a "serial" key. All other
+# columns/keys are variables that are substituted as "{name}" into the steps,
+# e.g. {"serial": "DENK0100000", "label": "alice", "subject": "/CN=Alice"}.
+# JSON entries can bring their own "steps"; all others use the template job.
+class ProvisioningManifest():
+	Card = collections.namedtuple("Card", [ "serial", "job", "variables" ])
+
+	def __init__(self, cards):
+		self._cards = { }
+		for card in cards:
+			card = self.Card(*card)
+			if card.serial in self._cards:
+				raise Exception("Serial %s is listed more than once in the manifest." % (card.serial))
+			self._cards[card.serial] = card
+
+	def __reduce__(self):
+		# Allows passing manifests to worker processes
+		return (self.__class__, ([ tuple(card) for card in self._cards.values() ], ))
+
+	@classmethod
+	def _card(cls, number, entry, template):
+		entry = dict(entry)
+		serial = entry.pop("serial", None)
+		if (serial is None) or (str(serial).strip() == ""):
+			raise Exception("Manifest entry %d: no serial given." % (number))
+		serial = str(serial).strip()
+		steps = entry.pop("steps", None)
+		if steps is not None:
+			job = BatchJob.from_structured(steps)
+		elif template is not None:
+			job = template
+		else:
+			raise Exception("Manifest entry %d (%s): no steps given and no template job to use." % (number, serial))
+		variables = { key: str(value) for (key, value) in entry.items() if value is not None }
+		variables["serial"] = serial
+		return cls.Card(serial = serial, job = job, variables = variables)
+
+	@classmethod
+	def parse(cls, text, manifest_format = "json", template = None):
+		assert(manifest_format in [ "json", "csv" ])
+		if manifest_format == "csv":
+			entries = list(csv.DictReader(text.splitlines()))
+		else:
+			entries = json.loads(text)
+			if isinstance(entries, dict):
+				entries = entries.get("cards")
+			if not isinstance(entries, list):
+				raise Exception("Manifest must be a list of cards or an object with a 'cards' list.")
+		return cls([ cls._card(number, entry, template) for (number, entry) in enumerate(entries, 1) ])
+
+	@classmethod
+	def load(cls, filename, template = None):
+		with open(filename) as f:
+			text = f.read()
+		manifest_format = "csv" if filename.lower().endswith(".csv") else "json"
+		return cls.parse(text, manifest_format = manifest_format, template = template)
+
+	def get(self, serial):
+		return self._cards.get(serial)
+
+	def __len__(self):
+		return len(self._cards)
+
+	def __iter__(self):
+		return iter(self._cards.values())
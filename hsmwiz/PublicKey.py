@@ -0,0 +1,165 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import json
+import base64
+import struct
+from .DER import DER
+from .KeySpec import KeySpec
+
+# Public key decoded from a DER-encoded SubjectPublicKeyInfo structure that
+# can be rendered as PEM, OpenSSH or JWK without any external tools.
+class PublicKey():
+	_OID_RSA_ENCRYPTION = "1.2.840.113549.1.1.1"
+	_OID_EC_PUBLIC_KEY = "1.2.840.10045.2.1"
+	_JWK_CURVES = {
+		"prime256v1":	"P-256",
+		"secp384r1":	"P-384",
+		"secp521r1":	"P-521",
+		"secp256k1":	"secp256k1",
+	}
+
+	def __init__(self, der_data, key_type, rsa_n = None, rsa_e = None, curve = None, ec_point = None):
+		self._der_data = der_data
+		self._key_type = key_type
+		self._rsa_n = rsa_n
+		self._rsa_e = rsa_e
+		self._curve = curve
+		self._ec_point = ec_point
+
+	@classmethod
+	def from_der(cls, der_data):
+		spki = DER.decode_single(der_data, expect_tag = DER.TAG_SEQUENCE)
+		children = DER.decode_children(spki.content)
+		if (len(children) == 2) and (children[0].tag == DER.TAG_INTEGER):
+			# Bare PKCS#1 RSAPublicKey; wrap it to get a proper SPKI
+			algorithm = DER.sequence(DER.oid(cls._OID_RSA_ENCRYPTION), DER.null())
+			return cls.from_der(DER.sequence(algorithm, DER.bitstring(der_data)))
+		if (len(children) != 2) or (children[0].tag != DER.TAG_SEQUENCE) or (children[1].tag != DER.TAG_BITSTRING):
+			raise Exception("DER data is not a SubjectPublicKeyInfo structure.")
+		algorithm = DER.decode_children(children[0].content)
+		algorithm_oid = DER.decode_oid(algorithm[0].content)
+		key_data = children[1].content[1:]
+
+		if algorithm_oid == cls._OID_RSA_ENCRYPTION:
+			(modulus, exponent) = DER.decode_children(DER.decode_single(key_data, expect_tag = DER.TAG_SEQUENCE).content)
+			return cls(der_data, "rsa", rsa_n = DER.decode_integer(modulus.content), rsa_e = DER.decode_integer(exponent.content))
+		elif algorithm_oid == cls._OID_EC_PUBLIC_KEY:
+			if (len(algorithm) < 2) or (algorithm[1].tag != DER.TAG_OID):
+				raise Exception("Only EC public keys with named curves are supported.")
+			curve_oid = DER.decode_oid(algorithm[1].content)
+			curve = KeySpec.get_curve_by_oid(curve_oid)
+			if curve is None:
+				raise Exception("EC public key uses unsupported curve with OID %s." % (curve_oid))
+			return cls(der_data, "ec", curve = curve, ec_point = key_data)
+		else:
+			raise Exception("Unsupported public key algorithm with OID %s." % (algorithm_oid))
+
+	@property
+	def der_data(self):
+		return self._der_data
+
+	@property
+	def key_type(self):
+		return self._key_type
+
+	@property
+	def curve(self):
+		return self._curve
+
+	@property
+	def bits(self):
+		if self._key_type == "rsa":
+			return self._rsa_n.bit_length()
+		else:
+			return self._curve.bits
+
+	@property
+	def type_name(self):
+		return "RSA" if (self._key_type == "rsa") else "ECC"
+
+	def to_pem(self):
+		encoded = base64.b64encode(self._der_data).decode()
+		lines = [ "-----BEGIN PUBLIC KEY-----" ]
+		lines += [ encoded[i : i + 64] for i in range(0, len(encoded), 64) ]
+		lines += [ "-----END PUBLIC KEY-----" ]
+		return "\n".join(lines) + "\n"
+
+	@staticmethod
+	def _ssh_string(data):
+		if isinstance(data, str):
+			data = data.encode()
+		return struct.pack(">L", len(data)) + data
+
+	@classmethod
+	def _ssh_mpint(cls, value):
+		return cls._ssh_string(value.to_bytes((value.bit_length() + 8) // 8, byteorder = "big"))
+
+	def to_ssh(self):
+		if self._key_type == "rsa":
+			key_type = "ssh-rsa"
+			blob = self._ssh_string(key_type) + self._ssh_mpint(self._rsa_e) + self._ssh_mpint(self._rsa_n)
+		else:
+			if self._curve.ssh_name is None:
+				raise Exception("EC keys on curve %s cannot be represented in OpenSSH format." % (self._curve.name))
+			key_type = "ecdsa-sha2-%s" % (self._curve.ssh_name)
+			blob = self._ssh_string(key_type) + self._ssh_string(self._curve.ssh_name) + self._ssh_string(self._ec_point)
+		return "%s %s\n" % (key_type, base64.b64encode(blob).decode())
+
+	@staticmethod
+	def _b64url(data):
+		return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+	@classmethod
+	def _b64url_int(cls, value):
+		return cls._b64url(value.to_bytes((value.bit_length() + 7) // 8, byteorder = "big"))
+
+	def to_jwk_dict(self):
+		if self._key_type == "rsa":
+			return {
+				"kty":	"RSA",
+				"n":	self._b64url_int(self._rsa_n),
+				"e":	self._b64url_int(self._rsa_e),
+			}
+		else:
+			if self._curve.name not in self._JWK_CURVES:
+				raise Exception("EC keys on curve %s cannot be represented as JWK." % (self._curve.name))
+			if self._ec_point[0] != 0x04:
+				raise Exception("Only uncompressed EC points can be represented as JWK.")
+			coordinate_length = (len(self._ec_point) - 1) // 2
+			return {
+				"kty":	"EC",
+				"crv":	self._JWK_CURVES[self._curve.name],
+				"x":	self._b64url(self._ec_point[1 : 1 + coordinate_length]),
+				"y":	self._b64url(self._ec_point[1 + coordinate_length : ]),
+			}
+
+	def to_jwk(self):
+		return json.dumps(self.to_jwk_dict()) + "\n"
+
+	def format(self, key_format):
+		if key_format == "pem":
+			return self.to_pem()
+		elif key_format == "ssh":
+			return self.to_ssh()
+		elif key_format == "jwk":
+			return self.to_jwk()
+		else:
+			raise Exception("Unsupported public key format '%s'." % (key_format))
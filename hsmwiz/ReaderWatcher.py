@@ -0,0 +1,241 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import time
+import ctypes
+import ctypes.util
+import collections
+from .HardwareSecurityModule import HardwareSecurityModule
+
+class PCSCException(Exception):
+	def __init__(self, function, rv):
+		Exception.__init__(self, "%s failed with 0x%08x" % (function, rv))
+		self.rv = rv
+
+class SCARD_READERSTATE(ctypes.Structure):
+	# Layout of pcsc-lite on Linux, where DWORD is an unsigned long
+	_fields_ = [
+		("szReader", ctypes.c_char_p),
+		("pvUserData", ctypes.c_void_p),
+		("dwCurrentState", ctypes.c_ulong),
+		("dwEventState", ctypes.c_ulong),
+		("cbAtr", ctypes.c_ulong),
+		("rgbAtr", ctypes.c_ubyte * 33),
+	]
+
+# Gets reader states from pcsc-lite and blocks in SCardGetStatusChange()
+# until a card is inserted or removed or a reader is plugged in or out.
+class PCSCMonitor():
+	name = "pcsc"
+	_SCARD_SCOPE_SYSTEM = 2
+	_SCARD_STATE_UNAWARE = 0x0000
+	_SCARD_STATE_CHANGED = 0x0002
+	_SCARD_STATE_PRESENT = 0x0020
+	_SCARD_S_SUCCESS = 0x00000000
+	_SCARD_E_INVALID_HANDLE = 0x80100003
+	_SCARD_E_TIMEOUT = 0x8010000a
+	_SCARD_E_NO_SERVICE = 0x8010001d
+	_SCARD_E_SERVICE_STOPPED = 0x8010001e
+	_SCARD_E_NO_READERS_AVAILABLE = 0x8010002e
+	# pcscd has been stopped or restarted, which invalidates our context
+	_SERVICE_ERRORS = (_SCARD_E_INVALID_HANDLE, _SCARD_E_NO_SERVICE, _SCARD_E_SERVICE_STOPPED)
+	_PNP_NOTIFICATION = b"\\\\?PnP?\\Notification"
+
+	def __init__(self):
+		library = ctypes.util.find_library("pcsclite")
+		if library is None:
+			raise Exception("pcsc-lite library not found.")
+		self._dll = ctypes.CDLL(library)
+		self._dll.SCardEstablishContext.argtypes = [ ctypes.c_ulong, ctypes.c_void_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_long) ]
+		self._dll.SCardReleaseContext.argtypes = [ ctypes.c_long ]
+		self._dll.SCardListReaders.argtypes = [ ctypes.c_long, ctypes.c_char_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_ulong) ]
+		self._dll.SCardGetStatusChange.argtypes = [ ctypes.c_long, ctypes.c_ulong, ctypes.POINTER(SCARD_READERSTATE), ctypes.c_ulong ]
+		for function in [ self._dll.SCardEstablishContext, self._dll.SCardReleaseContext, self._dll.SCardListReaders, self._dll.SCardGetStatusChange ]:
+			function.restype = ctypes.c_long
+		self._context = None
+		self._establish_context()
+		self._states = { }
+
+	def _establish_context(self):
+		context = ctypes.c_long()
+		self._check("SCardEstablishContext", self._dll.SCardEstablishContext(self._SCARD_SCOPE_SYSTEM, None, None, ctypes.byref(context)))
+		self._context = context
+
+	def _reconnect(self):
+		# Returns True if there is a usable context again
+		if self._context is not None:
+			self._dll.SCardReleaseContext(self._context)
+			self._context = None
+		try:
+			self._establish_context()
+		except PCSCException:
+			return False
+		return True
+
+	def _check(self, function, rv, accept = ()):
+		rv &= 0xffffffff
+		if (rv != self._SCARD_S_SUCCESS) and (rv not in accept):
+			raise PCSCException(function, rv)
+		return rv
+
+	def _reader_names(self):
+		length = ctypes.c_ulong()
+		rv = self._check("SCardListReaders", self._dll.SCardListReaders(self._context, None, None, ctypes.byref(length)), accept = (self._SCARD_E_NO_READERS_AVAILABLE, ))
+		if rv == self._SCARD_E_NO_READERS_AVAILABLE:
+			return [ ]
+		buf = ctypes.create_string_buffer(length.value)
+		rv = self._check("SCardListReaders", self._dll.SCardListReaders(self._context, None, buf, ctypes.byref(length)), accept = (self._SCARD_E_NO_READERS_AVAILABLE, ))
+		if rv == self._SCARD_E_NO_READERS_AVAILABLE:
+			return [ ]
+		# Multi-string: names separated by NUL, terminated by an empty name
+		return [ name for name in buf.raw[:length.value].split(b"\x00") if name != b"" ]
+
+	def _get_status_change(self, names, current_states, timeout):
+		states = (SCARD_READERSTATE * len(names))()
+		for (index, (name, current_state)) in enumerate(zip(names, current_states)):
+			states[index].szReader = name
+			states[index].dwCurrentState = current_state
+		rv = self._check("SCardGetStatusChange", self._dll.SCardGetStatusChange(self._context, int(timeout * 1000), states, len(names)), accept = (self._SCARD_E_TIMEOUT, ))
+		if rv == self._SCARD_E_TIMEOUT:
+			return None
+		return [ state.dwEventState & ~self._SCARD_STATE_CHANGED for state in states ]
+
+	def readers(self):
+		if (self._context is None) and (not self._reconnect()):
+			self._states = { }
+			return [ ]
+		try:
+			names = self._reader_names()
+			if len(names) > 0:
+				# Returns immediately, since every state differs from UNAWARE
+				event_states = self._get_status_change(names, [ self._SCARD_STATE_UNAWARE ] * len(names), 0) or [ 0 ] * len(names)
+		except PCSCException as e:
+			if e.rv not in self._SERVICE_ERRORS:
+				raise
+			# Reported as no readers until pcscd is back
+			self._reconnect()
+			names = [ ]
+		if len(names) == 0:
+			self._states = { }
+			return [ ]
+		self._states = dict(zip(names, event_states))
+		return [ HardwareSecurityModule.Reader(index = index, name = name.decode(errors = "replace"), card_present = (event_state & self._SCARD_STATE_PRESENT) != 0) for (index, (name, event_state)) in enumerate(zip(names, event_states)) ]
+
+	def card_counters(self):
+		# pcsc-lite counts insertions and removals per reader in the upper 16
+		# bits of the event state. A different count for a card that is
+		# present in both of two readings means that it has been swapped in
+		# between.
+		return { name.decode(errors = "replace"): event_state >> 16 for (name, event_state) in self._states.items() }
+
+	def wait(self, timeout):
+		if (self._context is None) and (not self._reconnect()):
+			time.sleep(timeout)
+			return
+		# The PnP pseudo reader reports added or removed readers; pcsc-lite
+		# expects the number of known readers in the upper 16 bits.
+		names = list(self._states) + [ self._PNP_NOTIFICATION ]
+		current_states = list(self._states.values()) + [ len(self._states) << 16 ]
+		try:
+			self._get_status_change(names, current_states, timeout)
+		except PCSCException as e:
+			if e.rv not in self._SERVICE_ERRORS:
+				raise
+			# The next readers() call finds out what changed in the meantime
+			if not self._reconnect():
+				time.sleep(timeout)
+
+	def close(self):
+		if self._context is not None:
+			self._dll.SCardReleaseContext(self._context)
+			self._context = None
+
+# Polls the reader list with opensc-tool, for systems without pcsc-lite
+class PollingMonitor():
+	name = "poll"
+
+	def __init__(self, interval = 1.0):
+		self._interval = interval
+
+	def readers(self):
+		return HardwareSecurityModule.enumerate_readers()
+
+	def card_counters(self):
+		# opensc-tool does not tell whether a card has been swapped
+		return { }
+
+	def wait(self, timeout):
+		time.sleep(min(timeout, self._interval))
+
+	def close(self):
+		pass
+
+# Reports cards that are inserted into or removed from any reader. Reader
+# indices are those of the 'readers' command, i.e., the PC/SC reader order.
+class ReaderWatcher():
+	Event = collections.namedtuple("Event", [ "kind", "reader", "name" ])
+
+	def __init__(self, monitor = "auto", poll_interval = 1.0, verbose = False):
+		assert(monitor in [ "auto", "pcsc", "poll" ])
+		self._monitor = None
+		if monitor in [ "auto", "pcsc" ]:
+			try:
+				self._monitor = PCSCMonitor()
+			except Exception as e:
+				if monitor == "pcsc":
+					raise
+				if verbose:
+					print("Cannot watch readers through pcsc-lite, falling back to polling: %s" % (str(e)))
+		if self._monitor is None:
+			self._monitor = PollingMonitor(interval = poll_interval)
+		self._cards = None
+
+	@property
+	def monitor_name(self):
+		return self._monitor.name
+
+	def poll(self, timeout = 1.0, report_present = True):
+		# Waits for up to timeout seconds for changes and returns a list of
+		# Events. The first call reports all cards that are already inserted
+		# unless report_present is False.
+		if self._cards is not None:
+			self._monitor.wait(timeout)
+		readers = self._monitor.readers()
+		counters = self._monitor.card_counters()
+		cards = { reader.name: (reader.index, counters.get(reader.name)) for reader in readers if reader.card_present }
+		previous = self._cards
+		self._cards = cards
+		if previous is None:
+			previous = { } if report_present else cards
+		# A card that was swapped within one wait is reported as removed and
+		# inserted again
+		swapped = [ name for name in cards if (name in previous) and (cards[name][1] is not None) and (cards[name][1] != previous[name][1]) ]
+		events = [ self.Event(kind = "removed", reader = index, name = name) for (name, (index, counter)) in sorted(previous.items(), key = lambda item: item[1][0]) if (name not in cards) or (name in swapped) ]
+		events += [ self.Event(kind = "inserted", reader = index, name = name) for (name, (index, counter)) in sorted(cards.items(), key = lambda item: item[1][0]) if (name not in previous) or (name in swapped) ]
+		return events
+
+	def close(self):
+		self._monitor.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
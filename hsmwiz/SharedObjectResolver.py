@@ -0,0 +1,93 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import threading
+from .DiskCache import DiskCache
+
+# Locates shared objects in a colon-separated search path. Results are
+# memoized per instance and per process and are additionally kept in an
+# on-disk cache. A cached result is only used as long as the found file
+# still has the same mtime and none of the directories that come before it
+# in the search path (or the directory itself) have been modified, i.e., a
+# file cannot have appeared earlier in the search path.
+class SharedObjectResolver():
+	_process_cache = { }
+	_process_cache_lock = threading.Lock()
+
+	def __init__(self, search_path, use_disk_cache = True):
+		self._search_path = search_path
+		self._cache = { }
+		self._disk_cache = DiskCache("shared_objects") if use_disk_cache else None
+
+	@property
+	def search_path(self):
+		return self._search_path
+
+	def _directories(self):
+		for path in self._search_path.split(":"):
+			path = os.path.realpath(os.path.expanduser(path))
+			if not path.endswith("/"):
+				path += "/"
+			yield path
+
+	@staticmethod
+	def _mtime(path):
+		try:
+			return os.stat(path).st_mtime
+		except OSError:
+			return None
+
+	def _scan(self, soname):
+		checked_directories = [ ]
+		for directory in self._directories():
+			checked_directories.append((directory, self._mtime(directory)))
+			path = directory + soname
+			if os.path.isfile(path):
+				return {
+					"path":			path,
+					"mtime":		self._mtime(path),
+					"directories":	checked_directories,
+				}
+		raise Exception("Could not find shared object '%s' anywhere in SO-searchpath '%s'." % (soname, self._search_path))
+
+	def _is_valid(self, entry):
+		if self._mtime(entry["path"]) != entry["mtime"]:
+			return False
+		return all(self._mtime(directory) == mtime for (directory, mtime) in entry["directories"])
+
+	def resolve(self, soname):
+		if soname in self._cache:
+			return self._cache[soname]
+
+		key = "%s|%s" % (self._search_path, soname)
+		with self._process_cache_lock:
+			path = self._process_cache.get(key)
+		if path is None:
+			entry = None if (self._disk_cache is None) else self._disk_cache.get(key)
+			if (entry is None) or (not self._is_valid(entry)):
+				entry = self._scan(soname)
+				if self._disk_cache is not None:
+					self._disk_cache.put(key, entry)
+			path = entry["path"]
+			with self._process_cache_lock:
+				self._process_cache[key] = path
+		self._cache[soname] = path
+		return path
@@ -0,0 +1,145 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import re
+import time
+import collections
+from .DER import DER
+from .KeySpec import KeySpec
+
+# Structured list of the objects on a token (keys, certificates and data
+# objects). Inventories are cached on disk per token serial number by
+# HardwareSecurityModule.inventory().
+class TokenInventory():
+	TokenObject = collections.namedtuple("TokenObject", [ "object_class", "key_id", "label", "key_type", "bits", "curve", "subject" ])
+	_OBJECT_CLASSES = [ "privkey", "pubkey", "cert", "data" ]
+	_TOOL_HEADERS = {
+		"Private Key Object":	"privkey",
+		"Public Key Object":	"pubkey",
+		"Certificate Object":	"cert",
+		"Data object":			"data",
+	}
+
+	_PKCS15_HEADERS = [
+		(re.compile(r"(?P<class>Private|Public) (?P<type>RSA|EC) Key \[(?P<label>.*)\]"), None),
+		(re.compile(r"X\.509 Certificate \[(?P<label>.*)\]"), "cert"),
+		(re.compile(r"Data object '(?P<label>.*)'"), "data"),
+	]
+
+	def __init__(self, serial, objects, timestamp = None):
+		self._serial = serial
+		self._objects = sorted(objects, key = lambda obj: (obj.key_id is None, obj.key_id or 0, self._OBJECT_CLASSES.index(obj.object_class), obj.label or ""))
+		self._timestamp = time.time() if (timestamp is None) else timestamp
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(data["serial"], [ cls.TokenObject(**obj) for obj in data["objects"] ], timestamp = data["timestamp"])
+
+	def to_dict(self):
+		return {
+			"serial":		self._serial,
+			"timestamp":	self._timestamp,
+			"objects":		[ obj._asdict() for obj in self._objects ],
+		}
+
+	@property
+	def serial(self):
+		return self._serial
+
+	@property
+	def timestamp(self):
+		return self._timestamp
+
+	def __iter__(self):
+		return iter(self._objects)
+
+	def __len__(self):
+		return len(self._objects)
+
+	def find(self, key_id = None, label = None, object_class = None):
+		return [ obj for obj in self._objects if ((key_id is None) or (obj.key_id == key_id)) and ((label is None) or (obj.label == label)) and ((object_class is None) or (obj.object_class == object_class)) ]
+
+	@staticmethod
+	def curve_from_ec_params(ec_params):
+		# Returns the Curve for DER-encoded EC parameters (a named curve OID)
+		try:
+			return KeySpec.get_curve_by_oid(DER.decode_oid(DER.decode_single(ec_params, expect_tag = DER.TAG_OID).content))
+		except Exception:
+			return None
+
+	@classmethod
+	def parse_pkcs11_tool_listing(cls, text):
+		# Parses the output of "pkcs11-tool --list-objects"
+		objects = [ ]
+		current = None
+		for line in text.split("\n"):
+			header = next((object_class for (prefix, object_class) in cls._TOOL_HEADERS.items() if line.startswith(prefix)), None)
+			if header is not None:
+				current = { "object_class": header, "key_id": None, "label": None, "key_type": None, "bits": None, "curve": None, "subject": None }
+				objects.append(current)
+				if " RSA" in line:
+					current["key_type"] = "rsa"
+				elif " EC" in line:
+					current["key_type"] = "ec"
+				match = re.search(r"(\d+) bits", line)
+				if match is not None:
+					current["bits"] = int(match.group(1))
+			elif (current is not None) and line.startswith("  "):
+				(key, _, value) = line.strip().partition(":")
+				value = value.strip()
+				if key == "ID":
+					current["key_id"] = int(value, 16) if (value != "") else None
+				elif key == "label":
+					current["label"] = value.strip("'")
+				elif key == "subject":
+					current["subject"] = value[4:] if value.startswith("DN: ") else value
+				elif key == "EC_PARAMS":
+					curve = cls.curve_from_ec_params(bytes.fromhex(value))
+					if curve is not None:
+						(current["curve"], current["bits"]) = (curve.name, curve.bits)
+		return [ cls.TokenObject(**obj) for obj in objects ]
+
+	@classmethod
+	def parse_pkcs15_tool_dump(cls, text):
+		# Parses the output of "pkcs15-tool --dump"
+		objects = [ ]
+		current = None
+		for line in text.split("\n"):
+			for (regex, object_class) in cls._PKCS15_HEADERS:
+				match = regex.fullmatch(line.rstrip())
+				if match is not None:
+					break
+			if match is not None:
+				current = { "object_class": object_class, "key_id": None, "label": match.group("label"), "key_type": None, "bits": None, "curve": None, "subject": None }
+				if object_class is None:
+					current["object_class"] = "privkey" if (match.group("class") == "Private") else "pubkey"
+					current["key_type"] = match.group("type").lower()
+				objects.append(current)
+			elif (current is not None) and line.startswith("\t"):
+				(key, _, value) = line.strip().partition(":")
+				(key, value) = (key.strip(), value.strip())
+				if key == "ID":
+					current["key_id"] = int(value, 16) if (value != "") else None
+				elif key in [ "ModLength", "FieldLength" ]:
+					current["bits"] = int(value)
+			elif line.strip() == "":
+				current = None
+		return [ cls.TokenObject(**obj) for obj in objects ]
@@ -0,0 +1,225 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import time
+import queue
+import itertools
+import threading
+import collections
+import concurrent.futures
+from .HardwareSecurityModule import HardwareSecurityModule
+
+# Serializes all operations on a token through one queue and one worker
+# thread per reader. Operations are dispatched by priority (lower values
+# first) and in FIFO order within the same priority. While operations keep
+# coming in, they all run in the same logged-in session; it is only closed
+# once the queue has been empty for session_linger seconds (or, if that is
+# None, when the scheduler is closed). Queues are bounded, so producers that
+# are faster than the card are slowed down instead of piling up work.
+class TokenScheduler():
+	Job = collections.namedtuple("Job", [ "function", "future", "submitted" ])
+	ReaderStats = collections.namedtuple("ReaderStats", [ "queued", "completed", "failed", "sessions", "busy_time", "wait_time" ])
+	_STOP = object()
+
+	class _ReaderState():
+		def __init__(self, reader, max_queue):
+			self.reader = reader
+			self.queue = queue.PriorityQueue(maxsize = max_queue)
+			self.thread = None
+			self.terminated = False
+			self.completed = 0
+			self.failed = 0
+			self.sessions = 0
+			self.busy_time = 0
+			self.wait_time = 0
+
+	def __init__(self, hsm_args, max_queue = 64, session_linger = 0.5, readers = None):
+		self._hsm_args = hsm_args
+		self._max_queue = max_queue
+		self._session_linger = session_linger
+		self._readers = readers
+		self._default_reader = None
+		self._states = { }
+		self._lock = threading.Lock()
+		self._sequence = itertools.count()
+		self._closed = False
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def _normalize_reader(self, reader):
+		# None, 0 and "0" may all name the same token; they must end up in
+		# the same queue so that access to it is serialized
+		if isinstance(reader, str):
+			try:
+				reader = int(reader)
+			except ValueError:
+				raise Exception("Invalid reader index '%s'." % (reader))
+		if reader is not None:
+			return reader
+		if self._readers is not None:
+			return self._readers[0]
+		with self._lock:
+			if self._default_reader is None:
+				# Same choice the tools make: the first reader with a card
+				self._default_reader = next((present.index for present in HardwareSecurityModule.enumerate_readers() if present.card_present), None)
+			return self._default_reader
+
+	def _get_state(self, reader):
+		reader = self._normalize_reader(reader)
+		with self._lock:
+			if self._closed:
+				raise Exception("Token scheduler has already been closed.")
+			if reader not in self._states:
+				if (self._readers is not None) and (reader not in self._readers):
+					raise Exception("Reader %s is not handled by this scheduler." % (reader))
+				state = self._ReaderState(reader, self._max_queue)
+				state.thread = threading.Thread(target = self._worker, args = (state, ), name = "hsmwiz-scheduler-%s" % ("default" if (reader is None) else reader), daemon = True)
+				state.thread.start()
+				self._states[reader] = state
+			return self._states[reader]
+
+	def submit(self, reader, function, priority = 0, block = True, timeout = None):
+		# Queues function(hsm) for execution on the given reader and returns a
+		# concurrent.futures.Future for its result. Blocks while the reader's
+		# queue is full, unless block is False or the timeout expires, in which
+		# case an exception is raised.
+		state = self._get_state(reader)
+		job = self.Job(function = function, future = concurrent.futures.Future(), submitted = time.monotonic())
+		try:
+			state.queue.put((priority, next(self._sequence), job), block = block, timeout = timeout)
+		except queue.Full:
+			raise Exception("Queue of reader %s is full (%d operations pending)." % ("default" if (reader is None) else reader, self._max_queue))
+		if state.terminated:
+			# Worker died while this job was being queued
+			self._fail_pending(state)
+		return job.future
+
+	def call(self, reader, method, *args, priority = 0, **kwargs):
+		# Convenience wrapper that runs a HardwareSecurityModule method and
+		# waits for its result. Generators (e.g., sign) are fully consumed.
+		def run(hsm):
+			result = getattr(hsm, method)(*args, **kwargs)
+			if hasattr(result, "__next__"):
+				result = list(result)
+			return result
+		return self.submit(reader, run, priority = priority).result()
+
+	def _next_job(self, state, in_session):
+		timeout = self._session_linger if in_session else None
+		try:
+			(priority, sequence, job) = state.queue.get(timeout = timeout)
+		except queue.Empty:
+			return None
+		return job
+
+	@staticmethod
+	def _close_session(hsm):
+		# The card may have been removed in the meantime, which is not worth
+		# losing the worker over
+		try:
+			hsm.__exit__(None, None, None)
+		except Exception:
+			pass
+
+	def _worker(self, state):
+		hsm = None
+		in_session = False
+		job = None
+		try:
+			while True:
+				job = self._next_job(state, in_session)
+				if job is None:
+					# Queue has been idle for a while, give the card a rest
+					self._close_session(hsm)
+					in_session = False
+					continue
+				if job is self._STOP:
+					job = None
+					break
+				if not job.future.set_running_or_notify_cancel():
+					continue
+				t0 = time.monotonic()
+				state.wait_time += t0 - job.submitted
+				try:
+					if hsm is None:
+						hsm = HardwareSecurityModule(reader = state.reader, **self._hsm_args)
+					if not in_session:
+						in_session = True
+						state.sessions += 1
+						hsm.__enter__()
+					result = job.function(hsm)
+				except BaseException as e:
+					state.failed += 1
+					job.future.set_exception(e)
+					# The session may be broken (e.g., because the card was
+					# removed); start over with a new one for the next job
+					if hsm is not None:
+						if in_session:
+							self._close_session(hsm)
+						hsm = None
+					in_session = False
+				else:
+					state.completed += 1
+					job.future.set_result(result)
+				job = None
+				state.busy_time += time.monotonic() - t0
+		finally:
+			if in_session:
+				self._close_session(hsm)
+			# If the worker died, a later submit for this reader starts a new one
+			with self._lock:
+				if (not self._closed) and (self._states.get(state.reader) is state):
+					del self._states[state.reader]
+			state.terminated = True
+			self._fail_pending(state, job)
+
+	def _fail_pending(self, state, job = None):
+		# Only finds jobs if the worker itself failed; never leave their
+		# futures unresolved
+		pending = [ job ] if (job is not None) else [ ]
+		while True:
+			try:
+				(priority, sequence, queued) = state.queue.get_nowait()
+			except queue.Empty:
+				break
+			if queued is not self._STOP:
+				pending.append(queued)
+		for pending_job in pending:
+			if not pending_job.future.done():
+				pending_job.future.set_exception(Exception("Worker for reader %s has terminated." % ("default" if (state.reader is None) else state.reader)))
+
+	def stats(self):
+		with self._lock:
+			return { reader: self.ReaderStats(queued = state.queue.qsize(), completed = state.completed, failed = state.failed, sessions = state.sessions, busy_time = state.busy_time, wait_time = state.wait_time) for (reader, state) in self._states.items() }
+
+	def close(self):
+		# Lets all workers finish their queued operations and then stops them
+		with self._lock:
+			self._closed = True
+			states = list(self._states.values())
+		for state in states:
+			state.queue.put((float("inf"), next(self._sequence), self._STOP))
+		for state in states:
+			state.thread.join()
@@ -0,0 +1,173 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import hashlib
+import datetime
+from .DER import DER
+from .PEM import PEM
+
+# Builds X.509 CSRs and self-signed certificates in-process. Only the
+# signature over the to-be-signed structure needs the private key, which is
+# supplied by a callback, so the token is used for nothing else.
+class X509Builder():
+	_NAME_ATTRIBUTES = {
+		"CN":					("2.5.4.3", DER.TAG_UTF8STRING),
+		"SN":					("2.5.4.4", DER.TAG_UTF8STRING),
+		"serialNumber":			("2.5.4.5", DER.TAG_PRINTABLESTRING),
+		"C":					("2.5.4.6", DER.TAG_PRINTABLESTRING),
+		"L":					("2.5.4.7", DER.TAG_UTF8STRING),
+		"ST":					("2.5.4.8", DER.TAG_UTF8STRING),
+		"street":				("2.5.4.9", DER.TAG_UTF8STRING),
+		"O":					("2.5.4.10", DER.TAG_UTF8STRING),
+		"OU":					("2.5.4.11", DER.TAG_UTF8STRING),
+		"title":				("2.5.4.12", DER.TAG_UTF8STRING),
+		"GN":					("2.5.4.42", DER.TAG_UTF8STRING),
+		"UID":					("0.9.2342.19200300.100.1.1", DER.TAG_UTF8STRING),
+		"DC":					("0.9.2342.19200300.100.1.25", DER.TAG_IA5STRING),
+		"emailAddress":			("1.2.840.113549.1.9.1", DER.TAG_IA5STRING),
+	}
+	_SIGNATURE_ALGORITHMS = {
+		("rsa", "sha1"):		"1.2.840.113549.1.1.5",
+		("rsa", "sha224"):		"1.2.840.113549.1.1.14",
+		("rsa", "sha256"):		"1.2.840.113549.1.1.11",
+		("rsa", "sha384"):		"1.2.840.113549.1.1.12",
+		("rsa", "sha512"):		"1.2.840.113549.1.1.13",
+		("ec", "sha1"):		"1.2.840.10045.4.1",
+		("ec", "sha224"):		"1.2.840.10045.4.3.1",
+		("ec", "sha256"):		"1.2.840.10045.4.3.2",
+		("ec", "sha384"):		"1.2.840.10045.4.3.3",
+		("ec", "sha512"):		"1.2.840.10045.4.3.4",
+	}
+	_OID_BASIC_CONSTRAINTS = "2.5.29.19"
+	_OID_SUBJECT_KEY_IDENTIFIER = "2.5.29.14"
+	_OID_AUTHORITY_KEY_IDENTIFIER = "2.5.29.35"
+
+	def __init__(self, pubkey, sign_digest, hashfnc = "sha256"):
+		# sign_digest(digest) returns the DER-encoded signature (PKCS#1 v1.5
+		# for RSA, ECDSA-Sig-Value for EC keys) over the given digest
+		if (pubkey.key_type, hashfnc) not in self._SIGNATURE_ALGORITHMS:
+			raise Exception("Cannot sign %s keys with hash function %s." % (pubkey.key_type, hashfnc))
+		self._pubkey = pubkey
+		self._sign_digest = sign_digest
+		self._hashfnc = hashfnc
+
+	@staticmethod
+	def parse_subject(subject):
+		# Parses an OpenSSL-style subject like "/CN=foo/O=bar" into a list of
+		# (attribute, value) tuples; "\" escapes the following character.
+		if not subject.startswith("/"):
+			raise Exception("Subject must start with '/', e.g., \"/CN=Example\".")
+		components = [ ]
+		current = ""
+		escaped = False
+		for char in subject[1:]:
+			if escaped:
+				current += char
+				escaped = False
+			elif char == "\\":
+				escaped = True
+			elif char == "/":
+				components.append(current)
+				current = ""
+			else:
+				current += char
+		components.append(current)
+
+		attributes = [ ]
+		for component in components:
+			if component == "":
+				continue
+			(key, sep, value) = component.partition("=")
+			if sep == "":
+				raise Exception("Subject component '%s' is missing a value." % (component))
+			attributes.append((key.strip(), value))
+		return attributes
+
+	@classmethod
+	def encode_name(cls, subject):
+		rdns = [ ]
+		for (key, value) in cls.parse_subject(subject):
+			if key in cls._NAME_ATTRIBUTES:
+				(oid, tag) = cls._NAME_ATTRIBUTES[key]
+			elif all(part.isdigit() for part in key.split(".")) and ("." in key):
+				(oid, tag) = (key, DER.TAG_UTF8STRING)
+			else:
+				raise Exception("Unsupported subject attribute '%s'. Supported are %s or dotted OIDs." % (key, ", ".join(sorted(cls._NAME_ATTRIBUTES))))
+			rdns.append(DER.set(DER.sequence(DER.oid(oid), DER.string(tag, value))))
+		return DER.sequence(*rdns)
+
+	@property
+	def _signature_algorithm(self):
+		oid = DER.oid(self._SIGNATURE_ALGORITHMS[(self._pubkey.key_type, self._hashfnc)])
+		if self._pubkey.key_type == "rsa":
+			return DER.sequence(oid, DER.null())
+		return DER.sequence(oid)
+
+	def _key_identifier(self):
+		# RFC 5280 method 1: SHA-1 over the subjectPublicKey bit string
+		spki = DER.decode_children(DER.decode_single(self._pubkey.der_data, expect_tag = DER.TAG_SEQUENCE).content)
+		return hashlib.sha1(spki[1].content[1:]).digest()
+
+	def digest(self, tbs):
+		return hashlib.new(self._hashfnc, tbs).digest()
+
+	def signed(self, tbs, signature):
+		# Assembles a signed structure from the to-be-signed part and its
+		# signature, for callers that create the signature themselves
+		return DER.sequence(tbs, self._signature_algorithm, DER.bitstring(signature))
+
+	def _signed(self, tbs):
+		return self.signed(tbs, self._sign_digest(self.digest(tbs)))
+
+	def csr_info(self, subject):
+		attributes = DER.explicit(0, b"")
+		return DER.sequence(DER.integer(0), self.encode_name(subject), self._pubkey.der_data, attributes)
+
+	def csr(self, subject):
+		return PEM.encode(self._signed(self.csr_info(subject)), "CERTIFICATE REQUEST")
+
+	def self_signed_certificate(self, subject, validity_days = 365, serial = None, not_before = None):
+		# Same extensions as "openssl req -x509" adds with its default v3_ca
+		# section: a CA certificate with subject and authority key identifier
+		if serial is None:
+			serial = int.from_bytes(os.urandom(20), byteorder = "big") >> 1
+		if not_before is None:
+			not_before = datetime.datetime.now(datetime.timezone.utc).replace(microsecond = 0)
+		not_after = not_before + datetime.timedelta(days = validity_days)
+		name = self.encode_name(subject)
+		key_identifier = self._key_identifier()
+		extensions = DER.sequence(
+			DER.sequence(DER.oid(self._OID_SUBJECT_KEY_IDENTIFIER), DER.octetstring(DER.octetstring(key_identifier))),
+			DER.sequence(DER.oid(self._OID_AUTHORITY_KEY_IDENTIFIER), DER.octetstring(DER.sequence(DER.encode(0x80, key_identifier)))),
+			DER.sequence(DER.oid(self._OID_BASIC_CONSTRAINTS), DER.boolean(True), DER.octetstring(DER.sequence(DER.boolean(True)))),
+		)
+		tbs = DER.sequence(
+			DER.explicit(0, DER.integer(2)),
+			DER.integer(serial),
+			self._signature_algorithm,
+			name,
+			DER.sequence(DER.time(not_before), DER.time(not_after)),
+			name,
+			self._pubkey.der_data,
+			DER.explicit(3, extensions),
+		)
+		return PEM.encode(self._signed(tbs), "CERTIFICATE")
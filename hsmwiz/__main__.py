@@ -22,127 +22,318 @@
 import sys
 import hsmwiz
 from .MultiCommand import MultiCommand
-from .ActionIdentify import ActionIdentify
-from .ActionVerifyPIN import ActionVerifyPIN
-from .ActionCheckEngine import ActionCheckEngine
-from .ActionInit import ActionInit
-from .ActionFormat import ActionFormat
-from .ActionChangePIN import ActionChangePIN
-from .ActionExplore import ActionExplore
-from .ActionUnblock import ActionUnblock
-from .ActionKeyGen import ActionKeyGen
-from .ActionGetPublicKey import ActionGetPublicKey
-from .ActionRemoveKey import ActionRemoveKey
-from .ActionGenCSR import ActionGenCSR
-from .ActionPutCRT import ActionPutCRT
 from .FriendlyArgumentParser import baseint
 
 _default = {
 	"sopath":	"/usr/local/lib:/usr/lib:/usr/lib/x86_64-linux-gnu:/usr/lib/x86_64-linux-gnu/openssl-1.0.2/engines:/usr/lib/x86_64-linux-gnu/engines-1.1",
 }
 
+def _add_profile_args(parser):
+	parser.add_argument("--profile", action = "store_true", help = "Measure all card operations and spawned processes and print a summary table on stderr when done.")
+	parser.add_argument("--profile-output", metavar = "file", type = str, help = "Write the measurements to the given file, either as JSON lines (appended, one record per operation and per spawned process) or as a Prometheus textfile (replaced atomically).")
+	parser.add_argument("--profile-format", choices = [ "jsonl", "prometheus" ], default = "jsonl", help = "Format of the file given with --profile-output. Can be one of %(choices)s, defaults to %(default)s.")
+
+def _key_ids(value):
+	key_ids = [ ]
+	for item in value.split(","):
+		if "-" in item:
+			(first, last) = item.split("-", maxsplit = 1)
+			key_ids += range(baseint(first), baseint(last) + 1)
+		else:
+			key_ids.append(baseint(item))
+	if len(key_ids) != len(set(key_ids)):
+		raise ValueError("duplicate key IDs")
+	return key_ids
+
+def _add_output_args(parser):
+	parser.add_argument("--output", choices = [ "text", "json" ], default = "text", help = "Output format. 'json' prints exactly one JSON object on stdout when the command is done, containing the structured result, any error and timings; all human-readable output goes to stderr instead. Can be one of %(choices)s, defaults to %(default)s.")
+
 def main():
 	mc = MultiCommand(trailing_text = "version: hsmwiz v%s" % (hsmwiz.VERSION))
 	def genparser(parser):
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-	mc.register("identify", "Check if a HSM is connected and list all contents", genparser, action = ActionIdentify)
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("identify", "Check if a HSM is connected and list all contents", genparser, action = "hsmwiz.ActionIdentify:ActionIdentify")
 
 	def genparser(parser):
-		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN/SO-PIN of the smartcard. If this argument is not given, the command will ask for it interactively.")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN/SO-PIN of the smartcard. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
 		parser.add_argument("--verify-sopin", action = "store_true", help = "Instead of specifying/verifying the PIN, verify the SO-PIN instead.")
 		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-	mc.register("verifypin", "Try to login a HSM by entering a PIN or SO-PIN", genparser, action = ActionVerifyPIN)
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("verifypin", "Try to login a HSM by entering a PIN or SO-PIN", genparser, action = "hsmwiz.ActionVerifyPIN:ActionVerifyPIN")
 
 	def genparser(parser):
 		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-	mc.register("checkengine", "Check if the OpenSSL engine driver works", genparser, action = ActionCheckEngine)
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("checkengine", "Check if the OpenSSL engine driver works", genparser, action = "hsmwiz.ActionCheckEngine:ActionCheckEngine")
 
 	def genparser(parser):
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-	mc.register("init", "Initialize the smartcard for the first time, set default SO-PIN and PIN", genparser, action = ActionInit)
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("init", "Initialize the smartcard for the first time, set default SO-PIN and PIN", genparser, action = "hsmwiz.ActionInit:ActionInit")
 
 	def genparser(parser):
 		parser.add_argument("--so-pin", metavar = "so-pin", type = str, required = True, help = "Specifies the current SO-PIN. Mandatory argument.")
 		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-	mc.register("format", "Reinitialize the smartcard completely (removing all keys and certificates) and set SO-PIN and PIN back to their factory default", genparser, action = ActionFormat)
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("format", "Reinitialize the smartcard completely (removing all keys and certificates) and set SO-PIN and PIN back to their factory default", genparser, action = "hsmwiz.ActionFormat:ActionFormat")
 
 	def genparser(parser):
-		parser.add_argument("--old", metavar = "pin/so-pin", type = str, help = "Specifies the old PIN or SO-PIN of the smartcard. If this argument is not given, the command will ask for it interactively.")
+		parser.add_argument("--old", metavar = "pin/so-pin", type = str, help = "Specifies the old PIN or SO-PIN of the smartcard. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
 		group = parser.add_mutually_exclusive_group()
-		group.add_argument("--new", metavar = "pin/so-pin", type = str, help = "Specifies the new PIN or SO-PIN of the smartcard. If this argument is not given, the command will ask for it interactively.")
+		group.add_argument("--new", metavar = "pin/so-pin", type = str, help = "Specifies the new PIN or SO-PIN of the smartcard. If this argument is not given, the command will ask for it interactively. A running hsmwiz agent that holds the old one is updated.")
 		group.add_argument("--randomize-new", action = "store_true", help = "Randomize the new PIN or SO-PIN and print the new value on the command line.")
 		parser.add_argument("--affect-so-pin", action = "store_true", help = "By default, the PIN is changed. When this option is given, the SO-PIN is changed instead.")
 		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-	mc.register("changepin", "Change device PIN or SO-PIN", genparser, action = ActionChangePIN)
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("changepin", "Change device PIN or SO-PIN", genparser, action = "hsmwiz.ActionChangePIN:ActionChangePIN")
 
 	def genparser(parser):
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-	mc.register("explore", "Explore the smartcard structure interactively", genparser, action = ActionExplore)
+		_add_profile_args(parser)
+	mc.register("explore", "Explore the smartcard structure interactively", genparser, action = "hsmwiz.ActionExplore:ActionExplore")
 
 	def genparser(parser):
-		parser.add_argument("--so-pin", metavar = "so-pin", type = str, help = "Specifies the SO-PIN that should be used for authorizing unblocking, in ASCII format. If this argument is not given, the command will ask for it interactively.")
+		parser.add_argument("--so-pin", metavar = "so-pin", type = str, help = "Specifies the SO-PIN that should be used for authorizing unblocking, in ASCII format. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
 		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN that should be set after unblocking, in ASCII format. If this argument is not given, the command will ask for it interactively.")
 		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-	mc.register("unblock", "Unblock the transponder's blocked PIN using the SO-PIN", genparser, action = ActionUnblock)
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("unblock", "Unblock the transponder's blocked PIN using the SO-PIN", genparser, action = "hsmwiz.ActionUnblock:ActionUnblock")
 
 	def genparser(parser):
-		parser.add_argument("--id", metavar = "key_id", type = baseint, default = 1, help = "Specifies the key ID to use for generating the new key. Must be an integer and defaults to %(default)d.")
-		parser.add_argument("--label", metavar = "key_label", type = str, help = "Specifies the key label to use for generating the new key.")
-		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, the command will ask for it interactively.")
+		parser.add_argument("--id", metavar = "key_ids", type = _key_ids, default = [ 1 ], help = "Specifies the key ID to use for generating the new key. Can also be a comma-separated list of IDs and ID ranges such as '1-10,0x20' to generate multiple keys in one session. Defaults to 1.")
+		parser.add_argument("-n", "--count", metavar = "count", type = int, help = "Generate this many keys with consecutive IDs, starting at the (single) ID given with --id.")
+		parser.add_argument("--label", metavar = "key_label", type = str, help = "Specifies the key label to use for generating the new key. When generating multiple keys, '{id}' is replaced by the hex key ID.")
+		parser.add_argument("-f", "--pubkey-format", choices = [ "pem", "ssh", "jwk", "json" ], help = "Print the public key of every generated key in the given format. Can be one of %(choices)s.")
+		parser.add_argument("--csr-subject", metavar = "subject", type = str, help = "Create a CSR with the given subject for every generated key and print it. '{id}' in the subject is replaced by the hex key ID.")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
 		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-		parser.add_argument("keyspec", metavar = "keyspec", type = str, help = "Key specification string to generate. Can be either 'rsa:BITLENGTH' or 'EC:CURVENAME'. Examples are 'rsa:1024', 'EC:brainpool256r1' or 'EC:prime256v1'.")
-	mc.register("keygen", "Create a new private keypair on the smartcard", genparser, action = ActionKeyGen, aliases = [ "genkey" ])
+		parser.add_argument("keyspec", metavar = "keyspec", type = str, help = "Key specification string to generate. Can be either 'rsa:BITLENGTH' or 'EC:CURVENAME'. Examples are 'rsa:1024', 'EC:brainpoolP256r1' or 'EC:prime256v1'.")
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("keygen", "Create a new private keypair on the smartcard", genparser, action = "hsmwiz.ActionKeyGen:ActionKeyGen", aliases = [ "genkey" ])
 
 	def genparser(parser):
 		group = parser.add_mutually_exclusive_group()
 		group.add_argument("--id", metavar = "key_id", type = baseint, help = "Specifies the key ID to fetch.")
 		group.add_argument("--label", metavar = "key_label", type = str, help = "Specifies the key label to fetch.")
-		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, the command will ask for it interactively.")
-		parser.add_argument("-f", "--key-format", choices = [ "pem", "ssh" ], default = "pem", help = "Specifies how the retrieved key should be displayed; can be either of %(choices)s, defaults to %(default)s.")
+		group.add_argument("-a", "--all", action = "store_true", help = "Fetch all public keys that are stored on the smartcard within one session.")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
+		parser.add_argument("-f", "--key-format", choices = [ "pem", "ssh", "jwk", "json" ], default = "pem", help = "Specifies how the retrieved key should be displayed; can be either of %(choices)s, defaults to %(default)s. 'json' emits one JSON object per key.")
 		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-	mc.register("getkey", "Fetch a public key from the smartcard", genparser, action = ActionGetPublicKey, aliases = [ "getpubkey" ])
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("getkey", "Fetch a public key from the smartcard", genparser, action = "hsmwiz.ActionGetPublicKey:ActionGetPublicKey", aliases = [ "getpubkey" ])
+
+	def genparser(parser):
+		parser.add_argument("--id", metavar = "key_id", type = baseint, help = "Only show objects with the given ID.")
+		parser.add_argument("--label", metavar = "label", type = str, help = "Only show objects with the given label.")
+		parser.add_argument("--type", choices = [ "privkey", "pubkey", "cert", "data" ], help = "Only show objects of the given type. Can be one of %(choices)s.")
+		parser.add_argument("--refresh", action = "store_true", help = "Always read the object list from the smartcard instead of using the cached inventory.")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
+		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("inventory", "List all objects on the smartcard, using a cached index when the token is unchanged", genparser, action = "hsmwiz.ActionInventory:ActionInventory")
 
 	def genparser(parser):
 		group = parser.add_mutually_exclusive_group()
 		group.add_argument("--id", metavar = "key_id", type = baseint, help = "Specifies the key ID to remove.")
 		group.add_argument("--label", metavar = "key_label", type = str, help = "Specifies the key label to remove.")
-		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, the command will ask for it interactively.")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
 		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-	mc.register("removekey", "Remove a keypair from the smartcard", genparser, action = ActionRemoveKey, aliases = [ "delkey", "deletekey" ])
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("removekey", "Remove a keypair from the smartcard", genparser, action = "hsmwiz.ActionRemoveKey:ActionRemoveKey", aliases = [ "delkey", "deletekey" ])
 
 	def genparser(parser):
 		parser.add_argument("-s", "--subject", metavar = "subject", type = str, default = "/CN=Hardware Security Module Example", help = "Specifies the CSR subject. Defaults to \"%(default)s\".")
 		parser.add_argument("-i", "--id", metavar = "key_id", type = baseint, default = 1, help = "Specifies the key ID of which to include the public key into the CSR. Defaults to %(default)d.")
-		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, the command will ask for it interactively.")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
 		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-	mc.register("gencsr", "Generate a certificate signing request from a HSM-contained private key", genparser, action = ActionGenCSR)
+		parser.add_argument("--builder", choices = [ "native", "openssl" ], default = "native", help = "Specifies how the CSR is created. 'native' assembles it within hsmwiz and only uses the card for the signature, 'openssl' runs 'openssl req' with the PKCS#11 engine. Can be one of %(choices)s, defaults to %(default)s.")
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("gencsr", "Generate a certificate signing request from a HSM-contained private key", genparser, action = "hsmwiz.ActionGenCSR:ActionGenCSR")
 
 	def genparser(parser):
 		parser.add_argument("-s", "--subject", metavar = "subject", type = str, default = "/CN=Hardware Security Module Example", help = "Specifies the certificate subject. Defaults to \"%(default)s\".")
 		parser.add_argument("--validity-days", metavar = "days", type = int, default = 365, help = "Time in days that the self-signed certificate is valid for. Defaults to %(default)d days.")
 		parser.add_argument("--hashfnc", metavar = "hashfnc", type = str, default = "sha256", help = "Hash function that is used during signing. Defaults to %(default)s.")
 		parser.add_argument("-i", "--id", metavar = "key_id", type = baseint, default = 1, help = "Specifies the key ID of which to include the public key into the CSR. Defaults to %(default)d.")
-		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, the command will ask for it interactively.")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
 		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-	mc.register("gencrt", "Generate a self-signed certificate from a HSM-contained private key", genparser, action = ActionGenCSR)
+		parser.add_argument("--builder", choices = [ "native", "openssl" ], default = "native", help = "Specifies how the certificate is created. 'native' assembles it within hsmwiz and only uses the card for the signature, 'openssl' runs 'openssl req' with the PKCS#11 engine. Can be one of %(choices)s, defaults to %(default)s.")
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("gencrt", "Generate a self-signed certificate from a HSM-contained private key", genparser, action = "hsmwiz.ActionGenCSR:ActionGenCSR")
 
 	def genparser(parser):
-		parser.add_argument("-i", "--id", metavar = "cert_id", type = int, default = 1, help = "Specifies the cert ID under which the certificate will be stored on the smartcard. Defaults to %(default)d.")
-		parser.add_argument("--label", metavar = "cert_label", type = str, help = "Specifies the certificate's label.")
-		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, the command will ask for it interactively.")
+		parser.add_argument("-i", "--id", metavar = "cert_id", type = baseint, help = "Specifies the cert ID under which a single certificate is stored on the smartcard. With multiple certificates, this is the first ID that is assigned to certificates whose key is not on the card. By default, certificates get the ID of the key on the card with the same public key, or otherwise the next ID after the highest key ID.")
+		parser.add_argument("--label", metavar = "cert_label", type = str, help = "Specifies the certificate's label. By default, the label of the matching key or the certificate's common name is used.")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
 		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
+		parser.add_argument("crt_pemfile", metavar = "crt_pemfile", nargs = "+", type = str, help = "Certificates to put on the smartcard. Each can be a PEM file with one or more certificates, a DER file or a directory, in which case all .pem, .crt, .cer and .der files in it are read. All certificates are written in one session.")
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("putcrt", "Put one or more certificates on the smartcard", genparser, action = "hsmwiz.ActionPutCRT:ActionPutCRT")
+
+	def genparser(parser):
+		group = parser.add_mutually_exclusive_group()
+		group.add_argument("--id", metavar = "key_id", type = baseint, help = "Specifies the key ID to sign with.")
+		group.add_argument("--label", metavar = "key_label", type = str, help = "Specifies the key label to sign with.")
+		parser.add_argument("--hashfnc", choices = [ "sha1", "sha224", "sha256", "sha384", "sha512" ], default = "sha256", help = "Hash function that is used to hash the input files or that has been used to create the given digests. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("-m", "--mechanism", choices = [ "auto", "pkcs1", "pss", "ecdsa" ], default = "auto", help = "Signature mechanism to use. 'pkcs1' is RSA PKCS#1 v1.5, 'pss' is RSA-PSS with a salt of the digest's length. 'auto' uses PKCS#1 v1.5 for RSA and ECDSA for EC keys. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--signature-format", choices = [ "der", "raw" ], default = "der", help = "Encoding of ECDSA signatures, either DER (like OpenSSL) or raw r || s (like JWS). Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("-e", "--encoding", choices = [ "base64", "hex" ], default = "base64", help = "Encoding of signatures that are printed. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("-d", "--digest", action = "store_true", help = "Inputs are hex-encoded digests instead of file names.")
+		parser.add_argument("-s", "--suffix", metavar = "suffix", type = str, help = "Instead of printing the signatures, write each one in binary form next to the signed file, with this suffix appended to the file name (e.g., '.sig').")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
+		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
+		parser.add_argument("inputs", metavar = "input", nargs = "+", help = "Files (or, with --digest, hex-encoded digests) to sign. All of them are signed in a single session. Use '-' to read further inputs from stdin, one per line.")
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("sign", "Sign files or digests with a HSM-contained private key", genparser, action = "hsmwiz.ActionSign:ActionSign")
+
+	def genparser(parser):
+		parser.add_argument("--script-format", choices = [ "auto", "json", "yaml", "lines" ], default = "auto", help = "Specifies the format of the batch script. Can be one of %(choices)s, defaults to %(default)s, which guesses the format from the script's content.")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
+		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader to use, as shown by the 'readers' command. By default, the first reader with a card inserted is used.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
+		parser.add_argument("--all-readers", action = "store_true", help = "Run the batch script in parallel on all readers that have a card inserted. Use '{reader}' in file names to make them distinct per reader.")
+		parser.add_argument("-j", "--jobs", metavar = "count", type = int, help = "When running on all readers, the maximum number of readers that are processed at once. Defaults to the number of readers.")
+		parser.add_argument("script", metavar = "script", type = str, help = "Batch script that contains the steps to execute, one after another, on the same smartcard. Supported steps are keygen, gencsr, gencrt, putcrt, getkey, changepin and inventory. Use '-' to read from stdin.")
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("batch", "Run multiple provisioning steps against one smartcard in a single session", genparser, action = "hsmwiz.ActionBatch:ActionBatch")
+
+	def genparser(parser):
+		parser.add_argument("-t", "--template", metavar = "script", type = str, help = "Batch script with the steps for all manifest entries that do not list their own steps. '{serial}' and '{column}' (for every manifest column) are replaced by the values of the card's entry.")
+		parser.add_argument("--script-format", choices = [ "auto", "json", "yaml", "lines" ], default = "auto", help = "Specifies the format of the template script. Can be one of %(choices)s, defaults to %(default)s, which guesses the format from the script's content.")
+		parser.add_argument("--journal", metavar = "file", type = str, help = "Journal that records every completed step, used to resume provisioning after a crash or a removed card. Defaults to the manifest file name with '.journal' appended.")
+		parser.add_argument("-j", "--jobs", metavar = "count", type = int, help = "Maximum number of readers that are processed at once. Defaults to the number of readers.")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcards. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively.")
+		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--reader", metavar = "index", type = int, action = "append", help = "Index of a smart card reader with a card to provision. Can be given multiple times. By default, all readers with a card inserted are used.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
+		parser.add_argument("manifest", metavar = "manifest", type = str, help = "CSV or JSON file that lists the cards to provision by serial number, along with per-card variables and optionally their own steps.")
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("provision", "Provision cards according to a manifest, matched by serial number, resuming where a previous run stopped", genparser, action = "hsmwiz.ActionProvision:ActionProvision")
+
+	def genparser(parser):
+		parser.add_argument("-s", "--script", metavar = "script", type = str, help = "Batch script to run on every inserted card. Together with --manifest, the template for all manifest entries that do not list their own steps.")
+		parser.add_argument("--script-format", choices = [ "auto", "json", "yaml", "lines" ], default = "auto", help = "Specifies the format of the batch script. Can be one of %(choices)s, defaults to %(default)s, which guesses the format from the script's content.")
+		parser.add_argument("-m", "--manifest", metavar = "manifest", type = str, help = "Provision every inserted card according to this manifest, like the 'provision' command does.")
+		parser.add_argument("--journal", metavar = "file", type = str, help = "Provisioning journal. Defaults to the manifest file name with '.journal' appended.")
+		parser.add_argument("--monitor", choices = [ "auto", "pcsc", "poll" ], default = "auto", help = "How to detect card changes. 'pcsc' waits for reader events from pcsc-lite, 'poll' runs opensc-tool periodically and 'auto' uses pcsc-lite if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--poll-interval", metavar = "secs", type = float, default = 1.0, help = "Interval in which readers are checked when polling. Defaults to %(default).1f secs.")
+		parser.add_argument("--ignore-present", action = "store_true", help = "Do not start jobs for cards that are already inserted when watching starts.")
+		parser.add_argument("-c", "--count", metavar = "count", type = int, help = "Exit after this many jobs have finished. By default, watches until interrupted.")
+		parser.add_argument("-j", "--jobs", metavar = "count", type = int, help = "Maximum number of jobs that run at once. Defaults to the number of CPUs.")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcards. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively on startup.")
+		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("watch", "Wait for cards to be inserted and run a batch script or provision them from a manifest on each", genparser, action = "hsmwiz.ActionWatch:ActionWatch")
+
+	def genparser(parser):
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
+		_add_profile_args(parser)
+		_add_output_args(parser)
+	mc.register("readers", "List all connected smart card readers", genparser, action = "hsmwiz.ActionReaders:ActionReaders")
+
+	def genparser(parser):
+		parser.add_argument("--socket", metavar = "path", type = str, help = "Unix domain socket to listen on. Defaults to $XDG_RUNTIME_DIR/hsmwiz.sock or /tmp/hsmwiz-UID.sock.")
+		parser.add_argument("--pin", metavar = "pin", type = str, help = "Specifies the PIN of the smartcard. If this argument is not given, it is taken from a running hsmwiz agent or the command will ask for it interactively on startup.")
+		parser.add_argument("--so-path", metavar = "path", type = str, default = _default["sopath"], help = "Search path, separated by ':' characters, in which to look for shared objects like opensc-pkcs11.so. Defaults to %(default)s")
+		parser.add_argument("--backend", choices = [ "auto", "native", "tool" ], default = "auto", help = "Specifies how to talk to the PKCS#11 module. 'native' loads it directly into the hsmwiz process, 'tool' calls pkcs11-tool for every operation and 'auto' uses the native backend if possible. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--max-queue", metavar = "count", type = int, default = 64, help = "Maximum number of requests that may be queued per reader; further requests wait until there is room again. Defaults to %(default)d.")
+		parser.add_argument("--reader", metavar = "index", type = int, action = "append", help = "Index of a smart card reader to serve. Can be given multiple times; the first one is used for requests that do not name a reader. By default, any reader is served and the first reader with a card inserted is the default.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
+		_add_profile_args(parser)
+	mc.register("serve", "Run a daemon that keeps smartcard sessions open and serves requests over a Unix domain socket", genparser, action = "hsmwiz.ActionServe:ActionServe")
+
+	def genparser(parser):
+		parser.add_argument("--socket", metavar = "path", type = str, help = "Unix domain socket of the daemon. Defaults to $XDG_RUNTIME_DIR/hsmwiz.sock or /tmp/hsmwiz-UID.sock.")
+		parser.add_argument("--reader", metavar = "index", type = int, help = "Index of the smart card reader the request is for. By default, the daemon's default reader is used.")
+		parser.add_argument("--json", action = "store_true", help = "Print the raw JSON result instead of formatting it.")
+		_add_output_args(parser)
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
+		parser.add_argument("method", metavar = "method", type = str, help = "Method to call on the daemon. Can be one of ping, getkey, gencsr, gencrt, putcrt, keygen or sign.")
+		parser.add_argument("params", metavar = "key=value", nargs = "*", help = "Parameters of the request, e.g., 'id=2' or 'keyspec=EC:prime256v1'. For putcrt, 'crt=@filename' reads the PEM certificate from a file.")
+	mc.register("client", "Send a request to a running hsmwiz daemon", genparser, action = "hsmwiz.ActionClient:ActionClient")
+
+	def genparser(parser):
+		parser.add_argument("--socket", metavar = "path", type = str, help = "Unix domain socket to listen on. Defaults to $HSMWIZ_AGENT_SOCK, $XDG_RUNTIME_DIR/hsmwiz-agent.sock or /tmp/hsmwiz-agent-UID/agent.sock.")
+		parser.add_argument("-t", "--timeout", metavar = "secs", type = int, default = 3600, help = "Forget credentials this many seconds after they were added, unless a different lifetime is given when adding them. 0 keeps them until the agent exits. Defaults to %(default)d.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
+	mc.register("agent", "Run an agent that holds PINs in memory so that other commands do not need to ask for them", genparser, action = "hsmwiz.ActionAgent:ActionAgent")
+
+	def genparser(parser):
+		parser.add_argument("--socket", metavar = "path", type = str, help = "Unix domain socket of the agent. Defaults to $HSMWIZ_AGENT_SOCK, $XDG_RUNTIME_DIR/hsmwiz-agent.sock or /tmp/hsmwiz-agent-UID/agent.sock.")
+		parser.add_argument("--sopin", action = "store_true", help = "Add or delete the SO-PIN instead of the PIN.")
+		parser.add_argument("--serial", metavar = "serial", type = str, help = "Serial number of the token the PIN belongs to, as shown by the 'inventory' command. By default, the PIN is used for all tokens that the agent holds no PIN for specifically.")
+		parser.add_argument("--lifetime", metavar = "secs", type = int, help = "Forget the PIN after this many seconds. Defaults to the agent's timeout.")
+		parser.add_argument("--stdin", action = "store_true", help = "Read the PIN from the first line of stdin instead of asking for it interactively.")
+		group = parser.add_mutually_exclusive_group()
+		group.add_argument("-l", "--list", action = "store_true", help = "List the credentials that the agent holds, without revealing them.")
+		group.add_argument("-d", "--delete", action = "store_true", help = "Remove the PIN (or SO-PIN) for the given serial number (or the one for all tokens) from the agent.")
+		group.add_argument("-D", "--delete-all", action = "store_true", help = "Remove all credentials from the agent.")
+		_add_output_args(parser)
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be specified multiple times.")
-		parser.add_argument("crt_pemfile", metavar = "crt_pemfile", type = str, help = "Certificate to put on the smartcart, in PEM format.")
-	mc.register("putcrt", "Put a certificate on the smartcard", genparser, action = ActionPutCRT)
+	mc.register("agent-add", "Add a PIN to a running hsmwiz agent, or list or remove the ones it holds", genparser, action = "hsmwiz.ActionAgentAdd:ActionAgentAdd")
 
 	mc.run(sys.argv[1:])
@@ -0,0 +1,243 @@
+#	hsmwiz - Simplified handling of Hardware Security Modules
+#	Copyright (C) 2018-2020 Johannes Bauer
+#
+#	This file is part of hsmwiz.
+#
+#	hsmwiz is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	hsmwiz is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import base64
+import shutil
+import datetime
+import tempfile
+import unittest
+import subprocess
+from hsmwiz.DER import DER
+from hsmwiz.PEM import PEM
+from hsmwiz.KeySpec import KeySpec
+from hsmwiz.PublicKey import PublicKey
+from hsmwiz.X509Builder import X509Builder
+
+class DERTests(unittest.TestCase):
+	def test_length(self):
+		self.assertEqual(DER.encode_length(0x7f), bytes.fromhex("7f"))
+		self.assertEqual(DER.encode_length(0x80), bytes.fromhex("8180"))
+		self.assertEqual(DER.encode_length(0x100), bytes.fromhex("820100"))
+
+	def test_integer(self):
+		self.assertEqual(DER.integer(0), bytes.fromhex("020100"))
+		self.assertEqual(DER.integer(0x7f), bytes.fromhex("02017f"))
+		self.assertEqual(DER.integer(0x80), bytes.fromhex("02020080"))
+		self.assertEqual(DER.integer(-1), bytes.fromhex("0201ff"))
+		self.assertEqual(DER.integer(b"\xff\x00"), bytes.fromhex("020300ff00"))
+		self.assertEqual(DER.decode_integer(DER.decode_single(DER.integer(-129)).content), -129)
+
+	def test_oid(self):
+		self.assertEqual(DER.oid("1.2.840.113549.1.1.11"), bytes.fromhex("06092a864886f70d01010b"))
+		self.assertEqual(DER.oid("2.5.29.19"), bytes.fromhex("0603551d13"))
+		self.assertEqual(DER.oid("2.999.3"), bytes.fromhex("0603883703"))
+		for oid in [ "1.2.840.10045.2.1", "0.9.2342.19200300.100.1.25", "2.999.3" ]:
+			self.assertEqual(DER.decode_oid(DER.decode_single(DER.oid(oid), expect_tag = DER.TAG_OID).content), oid)
+
+	def test_primitives(self):
+		self.assertEqual(DER.boolean(True), bytes.fromhex("0101ff"))
+		self.assertEqual(DER.boolean(False), bytes.fromhex("010100"))
+		self.assertEqual(DER.null(), bytes.fromhex("0500"))
+		self.assertEqual(DER.bitstring(b"\xaa"), bytes.fromhex("030200aa"))
+		self.assertEqual(DER.octetstring(b""), bytes.fromhex("0400"))
+		self.assertEqual(DER.explicit(3, DER.null()), bytes.fromhex("a3020500"))
+		self.assertEqual(DER.string(DER.TAG_UTF8STRING, "ä"), bytes.fromhex("0c02c3a4"))
+
+	def test_set_sorted(self):
+		self.assertEqual(DER.set(DER.integer(2), DER.integer(1)), bytes.fromhex("3106020101020102"))
+
+	def test_time(self):
+		self.assertEqual(DER.time(datetime.datetime(2049, 12, 31, 23, 59, 58)), b"\x17\x0d491231235958Z")
+		self.assertEqual(DER.time(datetime.datetime(2050, 1, 1, 0, 0, 0)), b"\x18\x0f20500101000000Z")
+
+	def test_decode(self):
+		data = DER.sequence(DER.integer(1), DER.octetstring(bytes(200)))
+		element = DER.decode_single(data, expect_tag = DER.TAG_SEQUENCE)
+		self.assertEqual(element.raw, data)
+		children = DER.decode_children(element.content)
+		self.assertEqual([ child.tag for child in children ], [ DER.TAG_INTEGER, DER.TAG_OCTETSTRING ])
+		self.assertEqual(children[1].content, bytes(200))
+		with self.assertRaises(Exception):
+			DER.decode_single(data[:-1])
+		with self.assertRaises(Exception):
+			DER.decode_single(data + b"\x00")
+
+class KeySpecTests(unittest.TestCase):
+	def test_rsa(self):
+		key_spec = KeySpec.parse("RSA:2048")
+		self.assertEqual((key_spec.key_type, key_spec.bits, str(key_spec)), ("rsa", 2048, "rsa:2048"))
+		with self.assertRaises(Exception):
+			KeySpec.parse("rsa:big")
+
+	def test_ec(self):
+		key_spec = KeySpec.parse("EC:prime256v1")
+		self.assertEqual((key_spec.key_type, key_spec.bits, key_spec.curve.oid), ("ec", 256, "1.2.840.10045.3.1.7"))
+		self.assertEqual(KeySpec.parse("ec:secp256r1").curve.name, "prime256v1")
+		with self.assertRaises(Exception):
+			KeySpec.parse("EC:foo256r1")
+		with self.assertRaises(Exception):
+			KeySpec.parse("dsa:1024")
+
+	def test_brainpool_names(self):
+		# Both the RFC 5639 and the OpenSC-style names are accepted
+		for name in [ "EC:brainpoolP256r1", "EC:brainpool256r1", "ec:BRAINPOOLP256R1" ]:
+			key_spec = KeySpec.parse(name)
+			self.assertEqual((key_spec.curve.name, key_spec.curve.oid, key_spec.bits), ("brainpoolP256r1", "1.3.36.3.3.2.8.1.1.7", 256))
+		self.assertEqual(str(KeySpec.parse("EC:brainpool384r1")), "EC:brainpoolP384r1")
+
+class X509BuilderNameTests(unittest.TestCase):
+	def test_parse_subject(self):
+		self.assertEqual(X509Builder.parse_subject("/CN=foo/O=bar"), [ ("CN", "foo"), ("O", "bar") ])
+		self.assertEqual(X509Builder.parse_subject("/CN=a\\/b/OU=x=y"), [ ("CN", "a/b"), ("OU", "x=y") ])
+		with self.assertRaises(Exception):
+			X509Builder.parse_subject("CN=foo")
+		with self.assertRaises(Exception):
+			X509Builder.parse_subject("/CN")
+
+	def test_encode_name(self):
+		self.assertEqual(X509Builder.encode_name("/CN=foo/O=bar"), bytes.fromhex("301c310c300a06035504030c03666f6f310c300a060355040a0c03626172"))
+		self.assertEqual(X509Builder.encode_name("/C=DE"), bytes.fromhex("300d310b3009060355040613024445"))
+		with self.assertRaises(Exception):
+			X509Builder.encode_name("/XX=foo")
+
+# The remaining tests compare the encoders' output against OpenSSL and
+# OpenSSH, using software keys in place of a token
+@unittest.skipIf(shutil.which("openssl") is None, "openssl not installed")
+class OpenSSLTestCase(unittest.TestCase):
+	_KEYS = {
+		"rsa":	[ "genpkey", "-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:2048" ],
+		"ec":	[ "genpkey", "-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:prime256v1" ],
+	}
+
+	@classmethod
+	def setUpClass(cls):
+		cls._tempdir = tempfile.TemporaryDirectory()
+		cls._keyfiles = { }
+		for (key_type, cmd) in cls._KEYS.items():
+			cls._keyfiles[key_type] = cls._tempfile("%s.key" % (key_type))
+			cls._openssl(cmd + [ "-out", cls._keyfiles[key_type] ])
+
+	@classmethod
+	def tearDownClass(cls):
+		cls._tempdir.cleanup()
+
+	@classmethod
+	def _tempfile(cls, name):
+		return os.path.join(cls._tempdir.name, name)
+
+	@classmethod
+	def _openssl(cls, cmd, input = None):
+		return subprocess.run([ "openssl" ] + cmd, input = input, stdout = subprocess.PIPE, stderr = subprocess.PIPE, check = True).stdout
+
+	def _pubkey_der(self, key_type):
+		return self._openssl([ "pkey", "-in", self._keyfiles[key_type], "-pubout", "-outform", "der" ])
+
+	def _pubkey(self, key_type):
+		return PublicKey.from_der(self._pubkey_der(key_type))
+
+	def _sign_digest(self, key_type, hashfnc):
+		def sign_digest(digest):
+			cmd = [ "pkeyutl", "-sign", "-inkey", self._keyfiles[key_type] ]
+			if key_type == "rsa":
+				cmd += [ "-pkeyopt", "digest:%s" % (hashfnc) ]
+			return self._openssl(cmd, input = digest)
+		return sign_digest
+
+	def _write(self, name, data):
+		filename = self._tempfile(name)
+		with open(filename, "w" if isinstance(data, str) else "wb") as f:
+			f.write(data)
+		return filename
+
+class PublicKeyTests(OpenSSLTestCase):
+	def test_pem(self):
+		for key_type in self._KEYS:
+			pubkey = self._pubkey(key_type)
+			expected = self._openssl([ "pkey", "-in", self._keyfiles[key_type], "-pubout" ]).decode()
+			self.assertEqual(pubkey.to_pem(), expected)
+
+	def test_bare_pkcs1(self):
+		pkcs1 = self._openssl([ "rsa", "-in", self._keyfiles["rsa"], "-RSAPublicKey_out", "-outform", "der" ])
+		self.assertEqual(PublicKey.from_der(pkcs1).to_jwk_dict(), self._pubkey("rsa").to_jwk_dict())
+
+	def test_jwk_rsa(self):
+		jwk = json.loads(self._pubkey("rsa").to_jwk())
+		modulus = self._openssl([ "rsa", "-in", self._keyfiles["rsa"], "-noout", "-modulus" ]).decode().strip().split("=")[1]
+		self.assertEqual(jwk["kty"], "RSA")
+		self.assertEqual(base64.urlsafe_b64decode(jwk["n"] + "==").hex().upper(), modulus)
+		self.assertEqual(jwk["e"], "AQAB")
+
+	def test_jwk_ec(self):
+		jwk = json.loads(self._pubkey("ec").to_jwk())
+		self.assertEqual((jwk["kty"], jwk["crv"]), ("EC", "P-256"))
+		point = b"\x04" + base64.urlsafe_b64decode(jwk["x"] + "==") + base64.urlsafe_b64decode(jwk["y"] + "==")
+		self.assertTrue(self._pubkey_der("ec").endswith(point))
+
+	@unittest.skipIf(shutil.which("ssh-keygen") is None, "ssh-keygen not installed")
+	def test_ssh(self):
+		for key_type in self._KEYS:
+			pem_file = self._write("%s.pub.pem" % (key_type), self._pubkey(key_type).to_pem())
+			expected = subprocess.run([ "ssh-keygen", "-i", "-m", "PKCS8", "-f", pem_file ], stdout = subprocess.PIPE, check = True).stdout.decode().split()[:2]
+			ssh_key = self._pubkey(key_type).to_ssh()
+			self.assertEqual(ssh_key.split(), expected)
+			ssh_file = self._write("%s.pub" % (key_type), ssh_key)
+			fingerprint = subprocess.run([ "ssh-keygen", "-l", "-f", ssh_file ], stdout = subprocess.PIPE, check = True).stdout.decode()
+			self.assertIn("(RSA)" if (key_type == "rsa") else "(ECDSA)", fingerprint)
+
+class X509BuilderTests(OpenSSLTestCase):
+	def _builder(self, key_type, hashfnc = "sha256"):
+		return X509Builder(self._pubkey(key_type), self._sign_digest(key_type, hashfnc), hashfnc = hashfnc)
+
+	def test_csr(self):
+		for key_type in self._KEYS:
+			for hashfnc in [ "sha256", "sha384" ]:
+				csr_file = self._write("%s.csr" % (key_type), self._builder(key_type, hashfnc).csr("/CN=Test \\/ CSR/O=hsmwiz/C=DE"))
+				self._openssl([ "asn1parse", "-in", csr_file ])
+				output = self._openssl([ "req", "-in", csr_file, "-verify", "-noout", "-subject", "-nameopt", "compat" ])
+				self.assertIn(b"subject=/CN=Test \\/ CSR/O=hsmwiz/C=DE", output)
+
+	def test_self_signed_certificate(self):
+		not_before = datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo = datetime.timezone.utc)
+		for key_type in self._KEYS:
+			crt_file = self._write("%s.crt" % (key_type), self._builder(key_type).self_signed_certificate("/CN=Test CA", validity_days = 10000, serial = 0x1234, not_before = not_before))
+			self._openssl([ "asn1parse", "-in", crt_file ])
+			output = self._openssl([ "x509", "-in", crt_file, "-noout", "-serial", "-startdate", "-ext", "basicConstraints" ]).decode()
+			self.assertIn("serial=1234", output)
+			self.assertIn("notBefore=Jan  2 03:04:05 2020 GMT", output)
+			self.assertIn("CA:TRUE", output)
+			self._openssl([ "verify", "-CAfile", crt_file, "-check_ss_sig", crt_file ])
+
+	def test_signed(self):
+		# Signing separately (e.g., through the daemon) gives the same result
+		builder = self._builder("rsa")
+		tbs = builder.csr_info("/CN=Test")
+		signature = self._sign_digest("rsa", "sha256")(builder.digest(tbs))
+		csr = builder.signed(tbs, signature)
+		self.assertEqual(PEM.decode(PEM.encode(csr, "CERTIFICATE REQUEST")), csr)
+		self._openssl([ "req", "-inform", "der", "-verify", "-noout" ], input = csr)
+
+	def test_unsupported_hash(self):
+		with self.assertRaises(Exception):
+			X509Builder(self._pubkey("ec"), None, hashfnc = "md5")
+
+if __name__ == "__main__":
+	unittest.main()